@@ -0,0 +1,53 @@
+""" Benchmark MsgHandler dispatch overhead with no-op callbacks: one
+    message at a time versus handle_messages over a receive burst, for a
+    mix of LCTN, SENS0/LTSW and unsubscribed types.
+
+    Run from the repo root:  python benchmarks/bench_dispatch.py """
+
+import pathlib, sys, time
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from fast_msg import LctnMsg, LtswMsg
+from msg_handler import MsgHandler
+
+MESSAGES = 300000
+BURST = 64
+
+
+class Other():
+    """ A message type nobody subscribed to. """
+    type = "LOCMON"
+
+
+def messages() -> list:
+    mix = [LctnMsg("", 0, 1, "Zone1", False, 0.0, 0.0, 1.0)] * 8
+    mix += [LtswMsg("", 0, 1, 3, 1), Other()]
+    return (mix * (MESSAGES // len(mix) + 1))[:MESSAGES]
+
+
+def bench() -> tuple[float, float]:
+    """ Microseconds per message, single and batched. """
+    handler = MsgHandler()
+    noop = lambda msg: None
+    handler.register_msg_type("LCTN", noop)
+    handler.register_sens0_type("LTSW", noop)
+    msgs = messages()
+    start = time.perf_counter()
+    for msg in msgs:
+        handler.handle_message(msg)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    for idx in range(0, len(msgs), BURST):
+        handler.handle_messages(msgs[idx:idx + BURST])
+    batched = time.perf_counter() - start
+    return single / MESSAGES * 1e6, batched / MESSAGES * 1e6
+
+
+def report():
+    single, batched = bench()
+    print(f"handle_message  {single:.3f} us/msg")
+    print(f"handle_messages {batched:.3f} us/msg (bursts of {BURST})")
+
+
+if __name__ == "__main__":
+    report()
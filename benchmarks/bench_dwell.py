@@ -0,0 +1,72 @@
+""" Benchmark the dwell detector.  Boxes are carried up past open shelves
+    and put down on their own shelf, with height jitter on every sample.
+    Without dwell, a box passing an open shelf on its way up is matched to
+    it.  Reported per setting: right and wrong shelf assignments, LED
+    writes sent, and the cost of recording a sample.
+
+    Run from the repo root:  python benchmarks/bench_dwell.py """
+
+import pathlib, random, sys, timeit
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from cabinet import Cabinet
+from tags import TagLoc, TagStore
+
+BOXES = 500
+CARRY_SAMPLES = 12  # samples while carried from the floor to the shelf
+REST_SAMPLES = 6  # samples after being put down
+SAMPLE_MS = 250
+JITTER = 0.15  # feet, RTLS z noise
+SETTINGS = (('off', {}), ('4 samples', {'dwell_samples': 4}),
+            ('1 s still', {'dwell_samples': 1000, 'dwell_ms': 1000}),
+            ('6 samples or 1 s still', {'dwell_samples': 6, 'dwell_ms': 1000}))
+
+
+def run(dwell:dict, seed:int=1) -> tuple[int, int, int]:
+    rng = random.Random(seed)
+    writes = []
+    config = dict({'cabinet_controller_id': 1, 'zone': 'Zone0', 'shelf_height': 1.0,
+                   'height_proximity_threshold': 0.4, 'location': (0.0, 0.0, 0.4)}, **dwell)
+    cabinet = Cabinet(config, writes.append)
+    right = wrong = 0
+    for tagid in range(BOXES):
+        target = rng.randint(1, 5)  # there is always a shelf above to pass
+        for shelf in range(1, 7):
+            cabinet.store_light_switch_state(shelf, shelf == target or shelf == target + 1)
+        goal = cabinet.get_shelf_height(target)
+        tag = TagLoc(tagid)
+        ts = 0
+        path = [goal * step / CARRY_SAMPLES for step in range(CARRY_SAMPLES)] + [goal] * REST_SAMPLES
+        for idx, z in enumerate(path):
+            moving = idx < CARRY_SAMPLES
+            tag.store.append_sample(tag.row, ts, 0.0, 0.0, z + rng.gauss(0, JITTER), 'Zone0', moving)
+            cabinet.new_tag_loc(tag)
+            ts += SAMPLE_MS
+        shelf = cabinet.get_assigned_shelf(tagid)
+        if shelf == target:
+            right += 1
+        elif shelf is not None:
+            wrong += 1
+    return right, wrong, len(writes)
+
+
+def sample_cost() -> float:
+    """ Microseconds to record one location sample, dwell state included. """
+    store = TagStore()
+    row = store.add_tag(1)
+    number = 100000
+    seconds = timeit.timeit(lambda: store.append_sample(row, 0, 1.0, 2.0, 3.0, 'Zone0', False), number=number)
+    return seconds / number * 1e6
+
+
+def report():
+    print(f"{BOXES} boxes carried past an open shelf")
+    print(f"{'dwell':>26} {'right':>6} {'wrong':>6} {'LED writes':>11}")
+    for name, dwell in SETTINGS:
+        right, wrong, writes = run(dwell)
+        print(f"{name:>26} {right:>6} {wrong:>6} {writes:>11}")
+    print(f"append_sample: {sample_cost():.2f} us")
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,94 @@
+""" End to end benchmark suite against the local GeoTraqr simulator.  The
+    simulator runs in its own process and streams LCTN/LTSW over TCP; the
+    app side is main.run with the normal pipeline.  For each offered load
+    it reports messages/sec handled, switch -> LED latency percentiles and
+    the command count, then the memory used per tag.
+
+    Run from the repo root:  python benchmarks/bench_e2e.py """
+
+import multiprocessing, pathlib, sys, time, tracemalloc
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import main
+from fast_msg import FastMsgFactory
+from pipeline import build_pipeline
+from tags import Tags
+from geotraqr_sim import GeoTraqrSim, DataClient, CmdClient
+
+CABINETS = 16
+TAGS = 2000
+DURATION = 5.0  # seconds per load
+LOADS = ((2000, 2.0), (10000, 5.0), (50000, 10.0))  # (LCTN/sec, LTSW/sec)
+MEMORY_TAGS = 10000
+
+
+def config() -> dict:
+    return {'cabinets': [{'cabinet_controller_id': 1000 + idx, 'zone': f'Zone{idx}', 'shelf_height': 1.0,
+                          'shelf_width': 2.66, 'location': (idx * 5.0, 0.0, 0.4)}
+                         for idx in range(CABINETS)],
+            'led_timeout': 5}
+
+
+def run_sim(conn, rate:float, ltsw_rate:float):
+    """ Simulator process: report the ports, stream for DURATION after the
+        app connects, then send back the stats. """
+    sim = GeoTraqrSim(config()['cabinets'], tags=TAGS, rate=rate, ltsw_rate=ltsw_rate, seed=1)
+    conn.send((sim.data_address, sim.cmd_address))
+    sim.start()
+    conn.recv()  # app connected
+    time.sleep(DURATION)
+    sim.stop()
+    conn.send((sim.lctn_sent, sim.ltsw_sent, sim.commands, sim.latencies))
+
+
+def bench(rate:float, ltsw_rate:float) -> dict:
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=run_sim, args=(child, rate, ltsw_rate))
+    proc.start()
+    data_address, cmd_address = parent.recv()
+    cmd_conn = CmdClient(cmd_address)
+    handler, cluster, _ = build_pipeline(config(), cmd_conn.send)
+    geo_conn = DataClient(data_address, FastMsgFactory())
+    parent.send('connected')
+    start = time.perf_counter()
+    main.run(geo_conn, cmd_conn, handler, cluster.poll, cluster.next_timeout)
+    elapsed = time.perf_counter() - start
+    lctn_sent, ltsw_sent, commands, latencies = parent.recv()
+    proc.join()
+    geo_conn.close()
+    cmd_conn.close()
+    latencies = sorted(latency * 1000 for latency in latencies)
+
+    def pct(p):
+        return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)] if latencies else float('nan')
+    return {'offered': (lctn_sent + ltsw_sent) / DURATION, 'handled': geo_conn.received / elapsed,
+            'p50': pct(50), 'p90': pct(90), 'p99': pct(99), 'commands': commands}
+
+
+def memory_per_tag() -> float:
+    """ Bytes of Tags storage per tag with full history. """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tags = Tags()
+    for tagid in range(MEMORY_TAGS):
+        tagloc = tags._get_or_create(tagid)
+        for ts in range(tags.store.depth):
+            tags.store.append_sample(tagloc.row, ts, 1.0, 2.0, 3.0, 'Zone0', False)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return size / MEMORY_TAGS
+
+
+def report():
+    print(f"{'offered/s':>10} {'handled/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'cmds':>6}")
+    for rate, ltsw_rate in LOADS:
+        result = bench(rate, ltsw_rate)
+        print(f"{result['offered']:>10.0f} {result['handled']:>10.0f} {result['p50']:>8.2f} "
+              f"{result['p90']:>8.2f} {result['p99']:>8.2f} {result['commands']:>6}")
+    print(f"memory per tag: {memory_per_tag():.0f} bytes")
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,49 @@
+""" Import time budget of the message path modules.  Each module is
+    imported in a fresh interpreter with -X importtime, the best of RUNS is
+    compared with its budget, with and without numpy (the tag store needs
+    it as soon as a Tags object exists, so it is not deferred).  Exits 1
+    if a module is over budget.
+
+    Run from the repo root:  python benchmarks/bench_import.py """
+
+import os, pathlib, subprocess, sys
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / "src"
+RUNS = 5
+# Milliseconds, cumulative import time
+BUDGET_MS = {'msg_handler': 50, 'tags': 200, 'zones': 220, 'cabinet': 250, 'pipeline': 270}
+
+
+def import_ms(module:str) -> tuple[float, float]:
+    """ Cumulative import time of module and the part spent in numpy, ms. """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(SRC), os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env=env, capture_output=True, text=True, check=True)
+    total = numpy = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+        elif name.strip() == "numpy":
+            numpy = int(cumulative) / 1000
+    return total, numpy
+
+
+def report() -> bool:
+    print(f"best of {RUNS} fresh imports")
+    print(f"{'module':>12} {'ms':>8} {'no numpy':>9} {'budget':>7}")
+    within = True
+    for module, budget in BUDGET_MS.items():
+        total, numpy = min(import_ms(module) for _ in range(RUNS))
+        over = total > budget
+        within = within and not over
+        print(f"{module:>12} {total:>8.1f} {total - numpy:>9.1f} {budget:>7} {'OVER' if over else ''}")
+    return within
+
+
+if __name__ == "__main__":
+    sys.exit(0 if report() else 1)
@@ -0,0 +1,69 @@
+""" Benchmark micro-batched ingest through the full pipeline.  A burst of
+    LCTNs from a few hundred moving tags, with an occasional LTSW, is fed
+    one message at a time, as drained batches, and as batches with
+    superseded LCTNs collapsed.  Reports messages/sec and the share of
+    LCTNs collapsed.
+
+    Run from the repo root:  python benchmarks/bench_ingest.py """
+
+import pathlib, random, sys, time
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from fast_msg import LctnMsg, LtswMsg
+from msg_handler import collapse_lctns
+from pipeline import build_pipeline
+
+MESSAGES = 200000
+TAGS = 300
+CABINETS = 8
+BATCH = 256  # messages drained per pass
+LTSW_EVERY = 500
+
+
+def config() -> dict:
+    return {'cabinets': [{'cabinet_controller_id': 1000 + idx, 'zone': f'Zone{idx}', 'shelf_height': 1.0,
+                          'dwell_samples': 6, 'dwell_ms': 1000}
+                         for idx in range(CABINETS)]}
+
+
+def messages() -> list:
+    rng = random.Random(1)
+    msgs = []
+    for idx in range(MESSAGES):
+        if idx % LTSW_EVERY == 0:
+            msgs.append(LtswMsg("", idx, 1000 + rng.randrange(CABINETS), rng.randint(1, 6), rng.randint(0, 1)))
+            continue
+        tagid = rng.randrange(TAGS)
+        msgs.append(LctnMsg("", idx, tagid, f"Zone{tagid % CABINETS}", False, 0.0, 0.0, rng.uniform(0.4, 6.0)))
+    return msgs
+
+
+def bench(mode:str, msgs:list) -> tuple[float, int]:
+    """ Messages/sec and the number of messages dispatched. """
+    handler, _, _ = build_pipeline(config(), lambda msg, callback=None: None)
+    dispatched = 0
+    start = time.perf_counter()
+    if mode == 'single':
+        for msg in msgs:
+            handler.handle_message(msg)
+        dispatched = len(msgs)
+    else:
+        for idx in range(0, len(msgs), BATCH):
+            batch = msgs[idx:idx + BATCH]
+            if mode == 'collapsed':
+                batch = collapse_lctns(batch)
+            dispatched += handler.handle_messages(batch)
+    return len(msgs) / (time.perf_counter() - start), dispatched
+
+
+def report():
+    msgs = messages()
+    print(f"{MESSAGES} messages, {TAGS} tags, batches of {BATCH}")
+    print(f"{'mode':>10} {'msgs/s':>10} {'dispatched':>11}")
+    for mode in ('single', 'batched', 'collapsed'):
+        rate, dispatched = bench(mode, msgs)
+        print(f"{mode:>10} {rate:>10.0f} {dispatched:>11}")
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,83 @@
+""" Benchmark the time an INFO log call takes on the message thread when
+    the file handler stalls now and then, as a busy disk does: written
+    directly and through QueueLogging.  Also reports how many DEBUG records
+    a per-LCTN log line queues with and without sampling.
+
+    Run from the repo root:  python benchmarks/bench_logging.py """
+
+import logging, pathlib, sys, time
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from log_queue import QueueLogging
+
+RECORDS = 5000
+STALL_EVERY = 200  # records between disk stalls
+STALL = 0.02  # seconds
+DEBUG_RECORDS = 20000
+
+
+class StallingHandler(logging.Handler):
+    """ Formats the record and stalls every STALL_EVERY records. """
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        self.format(record)
+        self.count += 1
+        if self.count % STALL_EVERY == 0:
+            time.sleep(STALL)
+
+
+def bench(queued:bool) -> tuple[float, float, float]:
+    """ p50, p99 and max milliseconds per logger.info call. """
+    log = logging.getLogger("app.bench")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    handler = StallingHandler()
+    log.addHandler(handler)
+    queue_logging = QueueLogging(loggers=["app.bench"]) if queued else None
+    if queue_logging is not None:
+        queue_logging.start()
+    times = []
+    for idx in range(RECORDS):
+        start = time.perf_counter()
+        log.info("Sending command: %s", idx)
+        times.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.0001)
+    if queue_logging is not None:
+        queue_logging.stop()
+    log.removeHandler(handler)
+    times.sort()
+    return times[len(times) // 2], times[len(times) * 99 // 100], times[-1]
+
+
+def debug_records(per_second:float) -> int:
+    """ Records written for DEBUG_RECORDS calls of one debug line. """
+    log = logging.getLogger("app.bench_debug")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    handler = StallingHandler()
+    handler.count = 1  # never stall
+    log.addHandler(handler)
+    queue_logging = QueueLogging(loggers=["app.bench_debug"], queue_size=DEBUG_RECORDS, per_second=per_second)
+    queue_logging.start()
+    for idx in range(DEBUG_RECORDS):
+        log.debug("Tag %s location", idx)
+    queue_logging.stop()
+    log.removeHandler(handler)
+    return handler.count - 1
+
+
+def report():
+    print(f"{RECORDS} INFO records, {STALL * 1000:.0f} ms stall every {STALL_EVERY}")
+    print(f"{'logging':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for queued in (False, True):
+        p50, p99, worst = bench(queued)
+        print(f"{'queued' if queued else 'direct':>9} {p50:>8.3f} {p99:>8.3f} {worst:>8.2f}")
+    print(f"{DEBUG_RECORDS} debug calls: {debug_records(0)} written unsampled, "
+          f"{debug_records(20)} at 20 per second")
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,123 @@
+""" Benchmark LTSW -> LED command latency through main.run.  Local socket
+    pairs stand in for the GeoTraqr data and command ports.  The time is
+    measured from writing an LTSW line to the data socket until the cabinet
+    hands the RCVPRM to the command send function.  'select' is the event
+    driven loop, 'poll' is the same loop with connections that cannot be
+    waited on, which falls back to sleeping between reads.
+
+    Run from the repo root:  python benchmarks/bench_loop_latency.py """
+
+import pathlib, random, socket, sys, threading, time
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import main
+import msg_handler
+from cabinet import Cluster
+
+SAMPLES = 50
+CABINET_ID = 25001
+
+
+class LineMsg:
+    """ Just enough of a Geomsg for the LTSW path. """
+    def __init__(self, line:str):
+        self.msg = line
+        self.fmsg = [field.strip() for field in line.split(',')]
+        self.type = self.fmsg[1]
+        self.sens_type = self.fmsg[3]
+
+
+class Ack:
+    """ A successful command response. """
+    err = None
+    rspns = ''
+
+
+class SocketConn:
+    """ Non-blocking line reader over one end of a socket pair. """
+    def __init__(self, sock:socket.socket):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.buffer = b''
+        self.connected = True
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def rcv(self):
+        if b'\r\n' not in self.buffer:
+            try:
+                data = self.sock.recv(4096)
+            except BlockingIOError:
+                return None
+            if not data:
+                self.connected = False
+                return None
+            self.buffer += data
+            if b'\r\n' not in self.buffer:
+                return None
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return LineMsg(line.decode())
+
+
+class PollConn(SocketConn):
+    """ A connection without a socket to select on. """
+    def fileno(self) -> int:
+        raise AttributeError("no fileno")
+
+
+def bench(conn_cls) -> list[float]:
+    """ Switch to LED send latencies in milliseconds. """
+    data_out, data_in = socket.socketpair()
+    cmd_out, cmd_in = socket.socketpair()
+    sent = threading.Event()
+    sent_at = []
+
+    def send(msg, callback=None):
+        sent_at.append(time.perf_counter())
+        sent.set()
+        if callback is not None:
+            callback(Ack())
+
+    config = {'cabinets': [{'cabinet_controller_id': CABINET_ID, 'zone': 'Zone1', 'shelf_height': 1.0}]}
+    cluster = Cluster(config, send)
+    handler = msg_handler.MsgHandler()
+    handler.register_sens0_type("LTSW", cluster.add_ltsw_msg)
+    geo_conn, cmd_conn = conn_cls(data_in), conn_cls(cmd_in)
+    loop = threading.Thread(target=main.run, args=(geo_conn, cmd_conn, handler, cluster.poll, cluster.next_timeout))
+    loop.start()
+
+    latencies = []
+    for sample in range(SAMPLES):
+        time.sleep(random.uniform(0.01, 0.05))
+        sent.clear()
+        line = f'{sample},SENS0,{CABINET_ID},LTSW,{sample % 6 + 1},{sample % 2}\r\n'
+        start = time.perf_counter()
+        data_out.sendall(line.encode())
+        if not sent.wait(2.0):
+            raise RuntimeError("LED command was not sent")
+        latencies.append((sent_at[-1] - start) * 1000)
+    data_out.close()
+    loop.join()
+    for sock in (data_in, cmd_out, cmd_in):
+        sock.close()
+    return latencies
+
+
+def percentile(values:list[float], pct:float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def report():
+    print(f"{'loop':>6} {'p50 ms':>8} {'p90 ms':>8} {'max ms':>8}")
+    for name, conn_cls in (('select', SocketConn), ('poll', PollConn)):
+        latencies = bench(conn_cls)
+        print(f"{name:>6} {percentile(latencies, 50):>8.2f} {percentile(latencies, 90):>8.2f} {max(latencies):>8.2f}")
+
+
+if __name__ == "__main__":
+    report()
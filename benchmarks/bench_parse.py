@@ -0,0 +1,81 @@
+""" Micro-benchmark of LCTN ingest: Geomsg plus the fmsg indexing handlers
+    against the FastMsgFactory typed records.  First the decode alone, with
+    the Geomsg fields converted the way the handlers convert them, then
+    each message decoded and dispatched by MsgHandler to Zones (tag history
+    and zone membership).  The lines are bytes, as the data port receives
+    them.  The cases take turns over REPEAT rounds and the best round of
+    each is reported, so a slow spell of the machine hits them all alike.
+
+    Run from the repo root:  python benchmarks/bench_parse.py """
+
+import pathlib, random, sys, timeit
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from net.geo_packet_handler import Geomsg
+from fast_msg import FastMsgFactory
+from zones import Zones
+from msg_handler import MsgHandler
+
+TAGS = 1000
+MESSAGES = 50000
+REPEAT = 7
+
+
+def lctn_lines() -> list[bytes]:
+    lines = []
+    for ts in range(MESSAGES):
+        tagid = random.randrange(TAGS)
+        lines.append(f"{ts},LCTN,{tagid},Tag{tagid},Zone{tagid % 4},1,0,5,0.1,1,2.5,"
+                     f"{random.uniform(80, 95):.2f},{random.uniform(10, 15):.2f},{random.uniform(0, 6):.2f}\r\n".encode())
+    return lines
+
+
+def geomsg_decoded(line:bytes) -> tuple:
+    """ Geomsg and the conversions Tags and Zones do on its fields. """
+    msg = Geomsg(line)
+    fmsg = msg.fmsg
+    return (int(fmsg[0]), int(fmsg[2]), fmsg[4].strip(), int(fmsg[5]) != 0,
+            float(fmsg[11]), float(fmsg[12]), float(fmsg[13]))
+
+
+def bench_decode(factory, lines:list[bytes]) -> float:
+    """ Microseconds per message, decode only. """
+    messages = iter(lines)
+    elapsed = timeit.timeit(lambda: factory(next(messages)), number=len(lines))
+    return elapsed / len(lines) * 1e6
+
+
+def bench(factory, lines:list[bytes]) -> float:
+    """ Microseconds per message. """
+    zones = Zones()
+    handler = MsgHandler()
+    handler.register_msg_type("LCTN", zones.add_lctn)
+    messages = iter(lines)
+    elapsed = timeit.timeit(lambda: handler.handle_message(factory(next(messages))), number=len(lines))
+    return elapsed / len(lines) * 1e6
+
+
+def main():
+    lines = lctn_lines()
+    cases = {
+        ('decode', 'Geomsg + conversions'): lambda: bench_decode(geomsg_decoded, lines),
+        ('decode', 'FastMsgFactory'): lambda: bench_decode(FastMsgFactory(), lines),
+        ('decode and Zones', 'Geomsg'): lambda: bench(Geomsg, lines),
+        ('decode and Zones', 'FastMsgFactory'): lambda: bench(FastMsgFactory(), lines),
+        # Half the zones have a cabinet, the rest is dropped before parsing
+        ('decode and Zones', 'FastMsgFactory + zones'): lambda: bench(FastMsgFactory({'Zone0', 'Zone1'}), lines),
+    }
+    best = {key: float('inf') for key in cases}
+    for _ in range(REPEAT):
+        for key, case in cases.items():
+            best[key] = min(best[key], case())
+    section = None
+    for (group, name), us in best.items():
+        if group != section:
+            section = group
+            print(f"{group:>24} {'us/msg':>8}")
+        print(f"{name:>24} {us:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Benchmark the reconnect resync of a large site: time until every
+    controller's switch and LED states are known, for several in-flight
+    windows.  The command link is simulated in virtual time, every query is
+    answered LATENCY seconds after it is sent and answers to outstanding
+    queries overlap.  Also reports the LED corrections queued when a few
+    controllers were left with a wrong LED.
+
+    Run from the repo root:  python benchmarks/bench_resync.py """
+
+import heapq, itertools, pathlib, sys
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from cabinet import Cluster
+
+CABINETS = 300
+LATENCY = 0.05  # seconds from query to answer
+WINDOWS = (1, 8, 32, 128)
+STALE_LEDS = 10  # controllers with a lit LED nobody asked for
+
+
+class SimulatedLink():
+    """ Answers GETRCVP queries after LATENCY of virtual time. """
+    def __init__(self):
+        self.now = 0.0
+        self.pending = []  # (due, seq, callback, rspns)
+        self.seq = itertools.count()
+
+    def send(self, msg:str, callback=None):
+        fields = [field.strip() for field in msg.split(',')]
+        controller_id = int(fields[1])
+        if len(fields) == 4:
+            rspns = '0'  # all switches off
+        else:
+            stale = controller_id - 1000 < STALE_LEDS
+            rspns = ', '.join(['2' if stale else '0'] + ['0'] * 5)
+        heapq.heappush(self.pending, (self.now + LATENCY, next(self.seq), callback, rspns))
+
+    def run(self):
+        while self.pending:
+            self.now, _, callback, rspns = heapq.heappop(self.pending)
+            callback(Response(rspns))
+
+
+class Response():
+    err = None
+
+    def __init__(self, rspns:str):
+        self.rspns = rspns
+
+
+def bench(window:int) -> tuple[float, int]:
+    link = SimulatedLink()
+    config = {'cabinets': [{'cabinet_controller_id': 1000 + idx, 'zone': f'Zone{idx}'}
+                           for idx in range(CABINETS)],
+              'resync_max_in_flight': window}
+    cluster = Cluster(config, link.send)
+    cluster.request_states()
+    link.run()
+    assert cluster.resync.done()
+    return link.now, sum(cabinet.led_corrections for cabinet in cluster.cabinets.values())
+
+
+def report():
+    print(f"{CABINETS} controllers, {LATENCY * 1000:.0f} ms per query")
+    print(f"{'window':>7} {'resync s':>9} {'corrections':>12}")
+    for window in WINDOWS:
+        seconds, corrections = bench(window)
+        print(f"{window:>7} {seconds:>9.2f} {corrections:>12}")
+
+
+if __name__ == "__main__":
+    report()
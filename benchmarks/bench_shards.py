@@ -0,0 +1,78 @@
+""" Throughput of the single process pipeline against ShardedCluster with
+    N worker processes, on a simulated GeoTraqr stream of LCTN lines (and an
+    LTSW per cabinet so every cabinet is armed and matching).
+
+    Run from the repo root:  python benchmarks/bench_shards.py """
+
+import os, pathlib, random, sys, time
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from fast_msg import FastMsgFactory
+from pipeline import build_pipeline
+from shards import ShardedCluster
+
+CABINETS = 64
+TAGS = 5000
+MESSAGES = 200000
+POLL_EVERY = 256  # messages per main loop pass
+
+
+def config() -> dict:
+    return {'cabinets': [{'cabinet_controller_id': 1000 + idx, 'zone': f'Zone{idx}', 'shelf_height': 1.0,
+                          'location': (idx * 5.0, 0.0, 0.0)} for idx in range(CABINETS)]}
+
+
+def stream() -> list[str]:
+    lines = [f'0,SENS0,{1000 + idx},LTSW,1,1\r\n' for idx in range(CABINETS)]
+    for ts in range(MESSAGES):
+        tagid = random.randrange(TAGS)
+        zone = tagid % CABINETS
+        # below the bottom shelf, so nothing matches and cabinets stay armed
+        lines.append(f'{ts},LCTN,{tagid},Tag{tagid},Zone{zone},1,0,5,0.1,1,2.5,'
+                     f'{zone * 5.0:.2f},0.00,-{random.uniform(1, 2):.2f}\r\n')
+    return lines
+
+
+def send(msg, callback=None):
+    pass
+
+
+def bench_single(lines:list[str]) -> float:
+    handler, cluster, _ = build_pipeline(config(), send)
+    factory = FastMsgFactory()
+    start = time.perf_counter()
+    for idx, line in enumerate(lines):
+        handler.handle_message(factory(line))
+        if idx % POLL_EVERY == 0:
+            cluster.poll()
+    cluster.poll()
+    return len(lines) / (time.perf_counter() - start)
+
+
+def bench_sharded(lines:list[str], num_shards:int) -> float:
+    sharded = ShardedCluster(config(), send, num_shards)
+    sharded.start()
+    sharded.sync()  # workers are up
+    factory = FastMsgFactory()
+    try:
+        start = time.perf_counter()
+        for idx, line in enumerate(lines):
+            sharded.handler.handle_message(factory(line))
+            if idx % POLL_EVERY == 0:
+                sharded.poll()
+        sharded.sync(timeout=600)
+        return len(lines) / (time.perf_counter() - start)
+    finally:
+        sharded.stop()
+
+
+def main():
+    lines = stream()
+    print(f"{'mode':>10} {'msgs/sec':>10}")
+    print(f"{'single':>10} {bench_single(lines):>10.0f}")
+    for num_shards in sorted({1, 2, 4, os.cpu_count() or 1}):
+        print(f"{f'{num_shards} shards':>10} {bench_sharded(lines, num_shards):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
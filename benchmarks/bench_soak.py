@@ -0,0 +1,66 @@
+""" Soak benchmark for tag eviction.  A long stream of LCTNs with steady
+    tag turnover (tags arrive, stay a while and never come back) is fed
+    through the pipeline, with eviction off and on, each in a fresh
+    process.  RSS and tracked tags are reported at checkpoints; with
+    eviction on both should level off once the TTL has passed.
+
+    Run from the repo root:  python benchmarks/bench_soak.py """
+
+import multiprocessing, pathlib, random, resource, sys
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+MESSAGES = 600000
+CHECKPOINTS = 6
+ACTIVE_TAGS = 2000  # tags present at any time
+TURNOVER = 20  # messages between a new tag arriving (and an old one leaving)
+STEP_MS = 10  # message time between LCTNs
+EVICTION = {'tag_ttl_s': 300, 'max_tags': 10000}
+
+
+def rss_mb() -> float:
+    """ Resident set size of this process, MB. """
+    try:
+        with open('/proc/self/statm') as f_in:
+            pages = int(f_in.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def soak(eviction:bool, conn):
+    from fast_msg import LctnMsg
+    from pipeline import build_pipeline
+    config = {'cabinets': [{'cabinet_controller_id': 1, 'zone': 'Zone0'}]}
+    if eviction:
+        config.update(EVICTION)
+    handler, _, zones = build_pipeline(config, lambda msg, callback=None: None)
+    rng = random.Random(1)
+    rows = []
+    for idx in range(MESSAGES):
+        tagid = idx // TURNOVER + rng.randrange(ACTIVE_TAGS)
+        handler.handle_message(LctnMsg("", idx * STEP_MS, tagid, f"Zone{tagid % 8}", False, 1.0, 2.0, 3.0))
+        if (idx + 1) % (MESSAGES // CHECKPOINTS) == 0:
+            stats = zones.memory_stats()
+            rows.append((idx + 1, rss_mb(), stats['tags'], stats['bytes_per_tag']))
+    conn.send(rows)
+
+
+def run(eviction:bool) -> list:
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=soak, args=(eviction, child))
+    proc.start()
+    rows = parent.recv()
+    proc.join()
+    return rows
+
+
+def report():
+    for eviction in (False, True):
+        print(f"eviction {'on ' + str(EVICTION) if eviction else 'off'}")
+        print(f"{'messages':>9} {'RSS MB':>8} {'tags':>7} {'store B/tag':>12}")
+        for messages, rss, tags, per_tag in run(eviction):
+            print(f"{messages:>9} {rss:>8.1f} {tags:>7} {per_tag:>12.0f}")
+
+
+if __name__ == "__main__":
+    report()
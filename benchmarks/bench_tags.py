@@ -0,0 +1,75 @@
+""" Benchmark recording and reading tag location samples, and the memory
+    per tag.  Compares the TagStore with the six bounded deques per tag it
+    replaced.  append_sample also updates whatever per-sample state the
+    store keeps beyond the history.
+
+    Run from the repo root:  python benchmarks/bench_tags.py """
+
+import itertools, pathlib, sys, timeit
+from collections import deque
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from tags import TagLoc, TagStore, MAX_LOC_BUFF_LEN
+
+TAGS = 1000
+MESSAGES = 200000
+SAMPLE = (1700000000000, 10.0, 20.0, 1.5, 'ZoneA', False)
+
+
+class DequeTagLoc():
+    """ The history a TagLoc kept before the TagStore. """
+    def __init__(self, max_len:int=MAX_LOC_BUFF_LEN):
+        self.x = deque(maxlen=max_len)
+        self.y = deque(maxlen=max_len)
+        self.z = deque(maxlen=max_len)
+        self.zone = deque(maxlen=max_len)
+        self.motion = deque(maxlen=max_len)
+        self.ts = deque(maxlen=max_len)
+
+    def add_sample(self, ts, x, y, z, zone, motion):
+        self.ts.append(ts)
+        self.x.append(x)
+        self.y.append(y)
+        self.z.append(z)
+        self.zone.append(zone)
+        self.motion.append(motion)
+
+    def nbytes(self) -> int:
+        fields = (self.x, self.y, self.z, self.zone, self.motion, self.ts)
+        nbytes = sum(sys.getsizeof(field) for field in fields)
+        # The zone names and bools are shared, the numbers are boxed per sample
+        return nbytes + sum(sys.getsizeof(value) for field in (self.x, self.y, self.z, self.ts) for value in field)
+
+
+def per_msg_us(fnc) -> float:
+    return min(timeit.repeat(fnc, number=MESSAGES, repeat=3)) / MESSAGES * 1e6
+
+
+def bench() -> list[tuple[str, float, float, int]]:
+    """ (name, append us, latest x, y, z read us, bytes per tag) """
+    deques = itertools.cycle([DequeTagLoc() for _ in range(TAGS)])
+    for _ in range(TAGS * MAX_LOC_BUFF_LEN):
+        next(deques).add_sample(*SAMPLE)
+    tag = next(deques)
+    results = [("deques", per_msg_us(lambda: next(deques).add_sample(*SAMPLE)),
+                per_msg_us(lambda: (tag.x[-1], tag.y[-1], tag.z[-1])), tag.nbytes())]
+
+    store = TagStore(capacity=TAGS)
+    taglocs = [TagLoc(tagid, store=store) for tagid in range(TAGS)]
+    rows = itertools.cycle([tagloc.row for tagloc in taglocs])
+    append = per_msg_us(lambda: store.append_sample(next(rows), *SAMPLE))
+    tag = taglocs[0]
+    results.append(("TagStore", append, per_msg_us(lambda: (tag.x[-1], tag.y[-1], tag.z[-1])),
+                    store.row_nbytes()))
+    return results
+
+
+def main():
+    print(f"{TAGS} tags, history of {MAX_LOC_BUFF_LEN}, best of 3 x {MESSAGES}")
+    print(f"{'':>10} {'append us':>10} {'x,y,z[-1] us':>13} {'bytes/tag':>10}")
+    for name, append, read, nbytes in bench():
+        print(f"{name:>10} {append:>10.2f} {read:>13.2f} {nbytes:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+""" Benchmark the LED TimerQueue with thousands of concurrent timers:
+    cost of restarting a timer on a new event and of an idle main loop
+    tick (expire + next_timeout) with nothing due.
+
+    Run from the repo root:  python benchmarks/bench_timers.py """
+
+import pathlib, random, sys, timeit
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from timers import TimerQueue
+
+TIMER_COUNTS = (100, 1000, 10000, 100000)
+OPERATIONS = 100000
+
+
+def bench(count:int) -> tuple[float, float]:
+    """ Microseconds per reschedule and per idle tick. """
+    timers = TimerQueue(5.0)
+    keys = [(cabinet, shelf) for cabinet in range(count // 6 + 1) for shelf in range(1, 7)][:count]
+    for key in keys:
+        timers.schedule(key)
+    picks = [random.choice(keys) for _ in range(OPERATIONS)]
+    reschedule = timeit.timeit(lambda: timers.schedule(picks.pop()), number=OPERATIONS)
+
+    def tick():
+        timers.expire()
+        timers.next_timeout()
+    idle = timeit.timeit(tick, number=OPERATIONS)
+    return reschedule / OPERATIONS * 1e6, idle / OPERATIONS * 1e6
+
+
+def main():
+    print(f"{'timers':>8} {'reschedule us':>14} {'idle tick us':>13}")
+    for count in TIMER_COUNTS:
+        reschedule, idle = bench(count)
+        print(f"{count:>8} {reschedule:>14.2f} {idle:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
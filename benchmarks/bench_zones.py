@@ -0,0 +1,47 @@
+""" Benchmark Zones.update_zones per message cost as the zone population
+    grows.  The cost should stay flat: membership is a dict per zone and an
+    update for a tag that did not change zone is a no-op.
+
+    Run from the repo root:  python benchmarks/bench_zones.py """
+
+import pathlib, sys, timeit
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from tags import Tags
+from zones import Zones
+
+POPULATIONS = (100, 1000, 10000, 50000)
+MESSAGES = 100000
+
+
+def bench(population:int) -> tuple[float, float]:
+    """ Per message time in microseconds for tags staying in their zone
+        and for tags moving between two zones. """
+    tags = Tags()
+    zones = Zones(tags)
+    taglocs = []
+    for tagid in range(population):
+        tagloc = tags._get_or_create(tagid)
+        tagloc.zone.append("ZoneA")
+        zones.update_zones(tagloc)
+        taglocs.append(tagloc)
+    # One tag reports repeatedly from the middle of the population
+    tagloc = taglocs[population // 2]
+    stay = timeit.timeit(lambda: zones.update_zones(tagloc), number=MESSAGES)
+
+    def move():
+        tagloc.zone.append("ZoneB" if tagloc.get_latest_zone() == "ZoneA" else "ZoneA")
+        zones.update_zones(tagloc)
+    moving = timeit.timeit(move, number=MESSAGES)
+    return stay / MESSAGES * 1e6, moving / MESSAGES * 1e6
+
+
+def main():
+    print(f"{'tags in zone':>12} {'same zone us/msg':>17} {'zone change us/msg':>19}")
+    for population in POPULATIONS:
+        stay, moving = bench(population)
+        print(f"{population:>12} {stay:>17.2f} {moving:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+""" Local GeoTraqr simulator.  Serves the data port with a synthetic stream
+    of LCTN and SENS0/LTSW lines and answers RCVPRM/RCVCMD on the command
+    port, recording how long each LED command took to follow its switch.
+
+    Run it standalone and point config.yaml's network section at it:
+
+        python benchmarks/geotraqr_sim.py --tags 2000 --rate 5000
+        (geotraqr_address: 127.0.0.1, geo_data_port: 50531, geo_cmd_port: 50532)
+
+    The command port reply format is not documented here; by default a
+    command is answered with '<command>, <controller id>, OK' and GETRCVP
+    with zeros.  Pass reply_fnc to match a specific firmware. """
+
+import argparse, collections, pathlib, random, socket, threading, time
+from typing import Callable
+
+SHELF_PARAM_BASE = 100
+TICK = 0.01  # seconds between stream writes
+
+
+def default_reply(line:str) -> str:
+    fields = [field.strip() for field in line.split(',')]
+    if len(fields) > 2 and fields[0] == "RCVCMD" and fields[2] == "GETRCVP":
+        return ', '.join(['RCVCMD', fields[1]] + ['0'] * (len(fields) - 3))
+    return ', '.join(fields[:2] + ['OK'])
+
+
+class GeoTraqrSim():
+    """ Simulated GeoTraqr with one data and one command client.
+        cabinets: cabinet configs as in config.yaml (id, zone, location,
+        shelf_height).  rate: LCTN lines per second.  ltsw_rate: LTSW lines
+        per second.  Every burst_every seconds burst_size extra LCTNs are sent
+        at once. """
+    def __init__(self, cabinets:list[dict], tags:int=100, rate:float=1000.0, ltsw_rate:float=1.0,
+                 burst_every:float=0.0, burst_size:int=0, host:str='127.0.0.1',
+                 data_port:int=0, cmd_port:int=0, seed:int=None,
+                 reply_fnc:Callable[[str], str]=default_reply):
+        self.cabinets = cabinets
+        self.tags = tags
+        self.rate = rate
+        self.ltsw_rate = ltsw_rate
+        self.burst_every = burst_every
+        self.burst_size = burst_size
+        self.reply_fnc = reply_fnc
+        self.random = random.Random(seed)
+        self.data_server = socket.create_server((host, data_port))
+        self.cmd_server = socket.create_server((host, cmd_port))
+        self.running = False
+        self.threads = []
+        self.lctn_sent = 0
+        self.ltsw_sent = 0
+        self.commands = 0
+        self.switch_times: dict[tuple[int, int], float] = {}  # (controller, param) -> LTSW send time
+        self.latencies: list[float] = []  # switch -> LED command, seconds
+        self.lock = threading.Lock()
+        self.switch_states: dict[tuple[int, int], int] = {}
+
+    @property
+    def data_address(self) -> tuple[str, int]:
+        return self.data_server.getsockname()[:2]
+
+    @property
+    def cmd_address(self) -> tuple[str, int]:
+        return self.cmd_server.getsockname()[:2]
+
+    def start(self):
+        self.running = True
+        for target in (self._serve_data, self._serve_cmd):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """ Stop streaming and close the connections. """
+        self.running = False
+        for server in (self.data_server, self.cmd_server):
+            server.close()
+        for thread in self.threads:
+            thread.join(2.0)
+
+    def lctn_line(self, ts:int) -> str:
+        """ A location for a random tag near its home cabinet. """
+        tagid = self.random.randrange(self.tags)
+        cabinet = self.cabinets[tagid % len(self.cabinets)]
+        x, y, z = _location(cabinet)
+        height = float(cabinet.get('shelf_height', 1.0))
+        return (f"{ts},LCTN,{tagid},Tag{tagid},{cabinet['zone']},{self.random.randint(0, 1)},0,5,0.1,1,2.5,"
+                f"{x + self.random.uniform(-0.5, 0.5):.2f},{y + self.random.uniform(-0.5, 0.5):.2f},"
+                f"{z + self.random.uniform(0, 6 * height):.2f}\r\n")
+
+    def ltsw_line(self, ts:int) -> str:
+        """ Toggle the switch of a random shelf. """
+        cabinet = self.random.choice(self.cabinets)
+        controller_id = cabinet['cabinet_controller_id']
+        shelf = self.random.randint(1, 6)
+        state = 1 - self.switch_states.get((controller_id, shelf), 0)
+        self.switch_states[(controller_id, shelf)] = state
+        with self.lock:
+            self.switch_times[(controller_id, SHELF_PARAM_BASE + shelf)] = time.perf_counter()
+        return f"{ts},SENS0,{controller_id},LTSW,{shelf},{state}\r\n"
+
+    def _serve_data(self):
+        try:
+            conn, _ = self.data_server.accept()
+        except OSError:
+            return
+        with conn:
+            start = time.perf_counter()
+            next_burst = start + self.burst_every if self.burst_every > 0 else None
+            while self.running:
+                now = time.perf_counter()
+                ts = int(time.time() * 1000)
+                lines = []
+                due = int((now - start) * self.rate) - self.lctn_sent
+                if next_burst is not None and now >= next_burst:
+                    due += self.burst_size
+                    next_burst += self.burst_every
+                lines.extend(self.lctn_line(ts) for _ in range(due))
+                self.lctn_sent += due
+                ltsw_due = int((now - start) * self.ltsw_rate) - self.ltsw_sent
+                lines.extend(self.ltsw_line(ts) for _ in range(ltsw_due))
+                self.ltsw_sent += ltsw_due
+                try:
+                    if lines:
+                        conn.sendall(''.join(lines).encode())
+                except OSError:
+                    return
+                time.sleep(TICK)
+
+    def _serve_cmd(self):
+        try:
+            conn, _ = self.cmd_server.accept()
+        except OSError:
+            return
+        conn.settimeout(0.1)
+        buffer = b''
+        with conn:
+            while self.running:
+                try:
+                    data = conn.recv(4096)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                if not data:
+                    return
+                buffer += data
+                while b'\r\n' in buffer:
+                    line, buffer = buffer.split(b'\r\n', 1)
+                    line = line.decode()
+                    self._record(line)
+                    conn.sendall((self.reply_fnc(line) + '\r\n').encode())
+
+    def _record(self, line:str):
+        """ Count a command and time the LED writes against their switch. """
+        now = time.perf_counter()
+        self.commands += 1
+        fields = [field.strip() for field in line.split(',')]
+        if fields[0] != "RCVPRM" or len(fields) < 3:
+            return
+        controller_id = int(fields[1])
+        with self.lock:
+            for param_value in fields[2:]:
+                param = int(param_value.split('=')[0])
+                sent = self.switch_times.pop((controller_id, param), None)
+                if sent is not None:
+                    self.latencies.append(now - sent)
+
+
+class DataClient():
+    """ Minimal stand-in for the tnttcp data connection: a non-blocking line
+        reader that decodes each line with msg_factory. """
+    def __init__(self, address:tuple[str, int], msg_factory:Callable):
+        self.sock = socket.create_connection(address)
+        self.sock.setblocking(False)
+        self.msg_factory = msg_factory
+        self.partial = b''
+        self.lines = collections.deque()
+        self.connected = True
+        self.received = 0  # messages handed out
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def is_connected(self) -> bool:
+        return self.connected or len(self.lines) > 0
+
+    def rcv(self):
+        if not self.lines and self.connected:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                return None
+            if not data:
+                self.connected = False
+                return None
+            *lines, self.partial = (self.partial + data).split(b'\r\n')
+            self.lines.extend(lines)
+        if not self.lines:
+            return None
+        self.received += 1
+        return self.msg_factory(self.lines.popleft().decode())
+
+    def close(self):
+        self.sock.close()
+
+
+class CmdResponse():
+    """ Reply to a command, in place of geo_cmd.Message. """
+    def __init__(self, line:str):
+        self.rspns = line
+        self.err = "ERROR" if "ERROR" in line else None
+
+
+class CmdClient():
+    """ Minimal stand-in for geo_cmd.Connect: send() writes a command and
+        rcv() hands each reply to the callback of its command, in order. """
+    def __init__(self, address:tuple[str, int]):
+        self.sock = socket.create_connection(address)
+        self.sock.setblocking(False)
+        self.partial = b''
+        self.callbacks = collections.deque()
+        self.connected = True
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def send(self, msg:str, callback_fnc=None):
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(msg.encode())
+        finally:
+            self.sock.setblocking(False)
+        self.callbacks.append(callback_fnc)
+
+    def rcv(self):
+        try:
+            data = self.sock.recv(1 << 16)
+        except BlockingIOError:
+            return None
+        if not data:
+            self.connected = False
+            return None
+        *lines, self.partial = (self.partial + data).split(b'\r\n')
+        rsp = None
+        for line in lines:
+            rsp = CmdResponse(line.decode())
+            callback = self.callbacks.popleft() if self.callbacks else None
+            if callback is not None:
+                callback(rsp)
+        return rsp
+
+    def close(self):
+        self.sock.close()
+
+
+def _location(cabinet:dict) -> tuple[float, float, float]:
+    location = cabinet.get('location', (0.0, 0.0, 0.0))
+    if isinstance(location, str):
+        location = location.strip().strip('()[]').split(',')
+    return tuple(float(v) for v in location)
+
+
+def main():
+    import yaml
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default='config/config.yaml')
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1000.0, help='LCTN per second')
+    parser.add_argument('--ltsw-rate', type=float, default=1.0, help='LTSW per second')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='seconds between bursts')
+    parser.add_argument('--burst-size', type=int, default=0, help='LCTNs per burst')
+    args = parser.parse_args()
+    with open(pathlib.Path(args.config)) as f_in:
+        config = yaml.safe_load(f_in)
+    net_conf = config['network']
+    sim = GeoTraqrSim(config['cabinets'], tags=args.tags, rate=args.rate, ltsw_rate=args.ltsw_rate,
+                      burst_every=args.burst_every, burst_size=args.burst_size,
+                      data_port=net_conf['geo_data_port'], cmd_port=net_conf['geo_cmd_port'])
+    print(f"Serving data on {sim.data_address}, commands on {sim.cmd_address}")
+    sim.start()
+    try:
+        while True:
+            time.sleep(5)
+            latencies = sorted(sim.latencies)
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+            print(f"LCTN {sim.lctn_sent}  LTSW {sim.ltsw_sent}  commands {sim.commands}  "
+                  f"switch->LED p50 {p50:.2f} ms")
+    except KeyboardInterrupt:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,51 +9,117 @@
 from tags import Tags, TagLoc, MAX_LOC_BUFF_LEN
 from net.geo_packet_handler import Geomsg
 import logging
-from typing import Callable
+import math
+import time
+from typing import Callable, Iterable
 from geotraqr import geo_cmd
-import socketio
-
-sio = socketio.Client()
-# sio.connect('http://localhost:5000')
-sio.connect('http://10.10.55.74:5000')
+import shelf_match
+from geometry import ShelfGeometry
+from ui_publisher import UiPublisher
+from cmd_scheduler import CommandScheduler, DEFAULT_MAX_IN_FLIGHT, DEFAULT_TIMEOUT as DEFAULT_COMMAND_TIMEOUT
+from timers import TimerQueue
+from fast_msg import LtswMsg
+from metrics import MATCH_SECONDS, HANDLER_ERRORS
+from snapshot import SnapshotWriter, load_snapshot, DEFAULT_INTERVAL as DEFAULT_SNAPSHOT_INTERVAL
+from resync import Resync, DEFAULT_MAX_IN_FLIGHT as DEFAULT_RESYNC_IN_FLIGHT
 
 
 
 SHELF_PARAM_BASE = 100
+# Assumed, not yet checked against the controller documentation or a
+# controller: GETRCVP 97 answers a bitmask with bit n-1 set while the switch
+# of shelf n is on.
+SWITCH_STATE_PARAM = 97
+# Until that is verified a resync only applies switches reported on.  A
+# shelf the controller reports off but the snapshot has on keeps its
+# snapshot state and tags, and the mismatch is logged.
+RESYNC_APPLIES_SWITCH_OFF = False
 LED_OFF = 0
 LED_RED = 1
 LED_GREEN = 2
 LED_BLUE = 4
 LED_WHITE = 7
 
+# config 'height_estimator' -> TagLoc method used to estimate a tag's height
+HEIGHT_ESTIMATORS = {'latest': TagLoc.get_latest_height,
+                     'mean': TagLoc.get_average_height,
+                     'median': TagLoc.get_median_height,
+                     'filtered': TagLoc.get_filtered_height}
+DEFAULT_HEIGHT_ESTIMATOR = 'latest'
+DEFAULT_SHELF_MATCHER = 'greedy'  # see shelf_match.MATCHERS
 
 logger = logging.getLogger("app."+__name__)
 # logger.propagate = True
 # logger.setLevel(logging.INFO)
 
+ui_publisher: UiPublisher = None  # Set by set_ui_publisher(), no UI updates until then
+
+def set_ui_publisher(publisher:UiPublisher):
+    """ Set the publisher shelf updates are sent to the UI through. """
+    global ui_publisher
+    ui_publisher = publisher
+
 def update_shelf(shelf_num:int, tagid:int):
-    """ Update the shelf state in the UI. """
-    logger.debug(f"Updating shelf {shelf_num} with tag {tagid}")
-    sio.emit('box_update', {'box_id': tagid, 'shelf': shelf_num})
+    """ Update the shelf state in the UI.  Queued, never blocks on the UI server. """
+    logger.debug("Updating shelf %s with tag %s", shelf_num, tagid)
+    if ui_publisher is not None:
+        ui_publisher.update_shelf(tagid, shelf_num)
 
 
 class Cabinet:
-    def __init__(self, cabinet_config: dict, send_cmd_fnc: Callable[[str], None]):
+    def __init__(self, cabinet_config: dict, send_cmd_fnc: Callable[[str], None],
+                 cmd_scheduler: CommandScheduler=None, led_timers: TimerQueue=None,
+                 armed: set[int]=None):
         """ Initialize the Cabinet object with its configuration.
             Args:
                 cabinet_config: dict containing cabinet configuration
                 send_cmd_fnc: Function to call to send the geotraqr a message. It should
-                follow the fnc(msg, callback) scheme. See geo_cmd.Connect.send(). """
+                follow the fnc(msg, callback) scheme. See geo_cmd.Connect.send().
+                cmd_scheduler: If given, LED writes are queued on it and merged
+                with other writes to this controller instead of sent one by one.
+                led_timers: If given, a lit shelf LED gets a (cabinet id, shelf)
+                timer on it.  The owner turns the LED off when it expires.
+                armed: If given, the cabinet id is kept in this set while the
+                cabinet has shelves waiting for a tag. """
         self.id = cabinet_config['cabinet_controller_id']
         self.zone = cabinet_config['zone']
-        self.shelf_height = float(cabinet_config.get('shelf_height', 0.0))
-        self.shelf_offset_height = 0.396 # float(cabinet_config.get('location')[2])  # Z coordinate of the shelf
+        self.geometry = ShelfGeometry.from_config(cabinet_config)
+        self.shelf_height = self.geometry.shelf_height
+        self.shelf_offset_height = self.geometry.base_z  # Z coordinate of the shelf
         self.shelf_prox_shreshold = float(cabinet_config.get('height_proximity_threshold', 1.0))
+        # A tag in the z band of shelf n can only be within the threshold of
+        # the shelves up to band_reach bands away.  None: no bands, no prefilter.
+        self.band_reach = None
+        if self.shelf_height > 0:
+            self.band_reach = math.floor((self.shelf_prox_shreshold + self.shelf_height / 2) / self.shelf_height)
+        estimator = cabinet_config.get('height_estimator', DEFAULT_HEIGHT_ESTIMATOR)
+        if estimator not in HEIGHT_ESTIMATORS:
+            raise ValueError(f"Unknown height_estimator '{estimator}'. Use one of {list(HEIGHT_ESTIMATORS)}.")
+        self.get_tag_height = HEIGHT_ESTIMATORS[estimator]
+        matcher = cabinet_config.get('shelf_matcher', DEFAULT_SHELF_MATCHER)
+        if matcher not in shelf_match.MATCHERS:
+            raise ValueError(f"Unknown shelf_matcher '{matcher}'. Use one of {list(shelf_match.MATCHERS)}.")
+        self.match_fnc = shelf_match.MATCHERS[matcher]
+        # A tag is only matched once it rests: dwell_samples samples at about
+        # the same height, or dwell_ms without motion.  1 sample matches at once.
+        self.dwell_samples = int(cabinet_config.get('dwell_samples', 1))
+        dwell_ms = cabinet_config.get('dwell_ms', None)
+        self.dwell_ms = int(dwell_ms) if dwell_ms is not None else None
+        self.check_dwell = self.dwell_samples > 1 or self.dwell_ms is not None
 
         self.send_geo_cmd = send_cmd_fnc
-        self.tags = {num:False for num in range(1,7)} # Keeps trach of tags ids and which shelf they are on}
+        self.cmd_scheduler = cmd_scheduler
+        self.led_timers = led_timers
+        self.armed = armed
+        self.tags = {num:{} for num in range(1,7)} # Shelf -> ordered set of the tag ids on it
+        self.tag_shelf: dict[int, int] = {}  # Tag id -> shelf it is on
         self.light_switch_states = {num:False for num in range(1,7)}  # Assuming 6 shelves
         self.light_switch_events = [] # Indicates new light switch event and correlated shelf
+        self.leds: dict[int, int] = {}  # Shelf -> LED value last set, OFF if not set
+        self.led_states: dict[int, int] = {}  # Shelf -> LED value last reported by the controller
+        self.led_corrections = 0  # LED writes sent because the controller disagreed
+        self.sw_states = None  # Switch bitmask last reported by the controller
+        self.initialized = False  # Switch states were read from the controller
         # self.light_switch_events.append(1)
         # self.store_light_switch_state(6, True)
 
@@ -81,6 +147,16 @@ class Cabinet:
                 self.light_switch_events.remove(shelf_index)
             except ValueError:
                 pass
+        self._update_armed()
+
+    def _update_armed(self):
+        """ Keep the shared armed set in step with light_switch_events. """
+        if self.armed is None:
+            return
+        if self.light_switch_events:
+            self.armed.add(self.id)
+        else:
+            self.armed.discard(self.id)
 
     def get_light_switch_state(self, shelf_index) -> bool:
         return self.light_switch_states[shelf_index]
@@ -89,24 +165,50 @@ class Cabinet:
         """ Get the tags on the shelves. """
         return self.tags
 
+    def get_assigned_shelf(self, tagid:int) -> int:
+        """ Get the shelf a tag is assigned to, None if it is not shelved. """
+        return self.tag_shelf.get(tagid, None)
+
     
     def send_shelf_led_msg(self, shelf_num:int, leds:int):
         """Send a message to set the LED state for a shelf.
            shelf_num: 1-6, leds: bitmask of LED states"""
+        self.leds[shelf_num] = leds
+        if self.led_timers is not None:
+            if leds == LED_OFF:
+                self.led_timers.cancel((self.id, shelf_num))
+            else:
+                self.led_timers.schedule((self.id, shelf_num))
+        self._write_led(shelf_num, leds)
+
+    def _write_led(self, shelf_num:int, leds:int):
+        """ Queue or send the LED write, without touching the timers. """
         param = SHELF_PARAM_BASE+shelf_num
+        if self.cmd_scheduler is not None:
+            self.cmd_scheduler.set_param(self.id, param, leds)
+            return
         msg=f'RCVPRM, {self.id}, {param}={leds}\r\n'
         self.send_geo_cmd(msg) # add a callback
-        logger.info(f"Send: {msg}")
+        logger.info("Send: %s", msg)
 
     
     def add_ltsw_msg(self, msg: Geomsg):
         """Process a light switch message.
         LTSW Geomsg format: ['ts':int, 'msgtype':str, 'Controller ID':int, 
                      'Sensor Type': str, 'shelf number': int, 'state':bool] """
-        shelf_number = int(msg.fmsg[4])
-        sw_state = int(msg.fmsg[5])
-        self.store_light_switch_state(shelf_number, sw_state)
+        if isinstance(msg, LtswMsg):
+            shelf_number = msg.shelf
+            sw_state = msg.state
+        else:
+            shelf_number = int(msg.fmsg[4])
+            sw_state = int(msg.fmsg[5])
         logger.info(msg.msg)
+        self.set_switch(shelf_number, sw_state)
+
+    def set_switch(self, shelf_number:int, sw_state:int):
+        """ A shelf switch changed: store it and light the shelf RED while
+            it waits for a tag, or turn the LED off. """
+        self.store_light_switch_state(shelf_number, sw_state)
         color = LED_OFF
         if sw_state == 1:
             color = LED_RED        
@@ -114,148 +216,406 @@ class Cabinet:
 
     def get_shelf_height(self, shelf_num:int) -> float:
         """ Get the height of the shelf. """
-        if shelf_num < 1 or shelf_num > 6:
-            raise ValueError("Shelf number must be between 1 and 6.")
-        middle_of_shelf_1 = self.shelf_offset_height + (self.shelf_height / 2) + self.shelf_height * 5
-        return middle_of_shelf_1 - ((shelf_num-1) * self.shelf_height)
-    
+        return self.geometry.get_shelf_height(shelf_num)
+
     def get_distance_to_shelf(self, tag: TagLoc, shelf_num:int) -> float:
         """ Get the vertical distance from the tag to the shelf. """
         if shelf_num < 1 or shelf_num > 6:
             raise ValueError("Shelf number must be between 1 and 6.")
-        tag_z = tag.get_latest_location()[2]
+        tag_z = self.get_tag_height(tag)
         shelf_z = self.get_shelf_height(shelf_num)
-        logger.debug(f"Cabinet {self.id} shelf {shelf_num} height: {shelf_z:.2f}, tag {tag.tagid} height: {tag_z:.2f}")
+        if __debug__:
+            logger.debug("Cabinet %s shelf %s height: %.2f, tag %s height: %.2f",
+                         self.id, shelf_num, shelf_z, tag.tagid, tag_z)
         return abs(tag_z - shelf_z)
     
     def print_tag_shelfs(self):
-        """ Print the tags on the shelves. """
-        for _ in range(10):
-            print()
-        print(f"Cabinet {self.id} Tag assignments:")
-        for shelf in range(1,7):
-            tagid = self.tags.get(shelf, None)
-            if tagid:
-                print(f"Shelf {shelf}: Tag {tagid}")
-            else:
-                print(f"Shelf {shelf}:")
+        """ Log the tags on the shelves at debug level. """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        shelves = '; '.join(f"Shelf {shelf}: {', '.join(str(tagid) for tagid in tagids)}"
+                            for shelf, tagids in self.tags.items())
+        logger.debug("Cabinet %s Tag assignments: %s", self.id, shelves)
 
     def update_tags(self, shelf_num:int, tagid:int, action:int=1):
-        """ Update the tags on the shelves. """
+        """ Update the tags on the shelves.  action 1 puts the tag on the
+            shelf, moving it off any other shelf.  action 0 takes it off. """
         if shelf_num < 0 or shelf_num > 6:
             raise ValueError("Shelf number must be between 1 and 6.")
+        current = self.tag_shelf.get(tagid, None)
         if action == 1:
-            self.tags[shelf_num] = tagid
+            if current is not None:
+                del self.tags[current][tagid]
+            self.tags[shelf_num][tagid] = None
+            self.tag_shelf[tagid] = shelf_num
             update_shelf(shelf_num, tagid)
         elif action == 0:
-            if tagid in self.tags.values():
-                del self.tags[shelf_num]
+            if current == shelf_num:
+                del self.tags[shelf_num][tagid]
+                del self.tag_shelf[tagid]
                 update_shelf(0, tagid)
-        self.print_tag_shelfs()
+        if __debug__:
+            self.print_tag_shelfs()
     
     def remove_tag(self, ltsw_state, shelf_num):
-        try:
-            if not ltsw_state:
-                tagid = self.tags[shelf_num]
+        """ The shelf switch went off, the shelf is empty.  Take every tag
+            off it. """
+        if not ltsw_state:
+            for tagid in list(self.tags.get(shelf_num, ())):
                 self.update_tags(shelf_num, tagid, action=0)
-                self.print_tag_shelfs()
-        except KeyError:
-            pass
 
     def new_tag_loc(self, tag: TagLoc):
         """Process a location monitoring message."""
         if len(self.light_switch_events) == 0:
             return
-        
-        logger.debug(f"Cabinet {self.id} processing new tag location for tag {tag.tagid}.")
-        
-        tagid = tag.tagid
-        if tagid in self.tags.values():
+        if tag.tagid in self.tag_shelf:
             return
-        
-        logger.debug(f"Tag {tagid} is not currently assigned to any shelf in cabinet {self.id}.")
-        
-        for shelf in self.light_switch_events:
-            logger.debug(f"Checking shelf {shelf} for tag {tagid}. Light switch state: {self.get_light_switch_state(shelf)}")
-            if self.get_light_switch_state(shelf):
-                dist = self.get_distance_to_shelf(tag, shelf)
-                logger.debug(f"Checking shelf {shelf} for tag {tagid}. Distance to shelf: {dist:.2f}")
-                if dist <= self.shelf_prox_shreshold:
-                    logger.info(f"Tag {tagid} is near shelf {shelf} (dist={dist:.2f}).")
-                    self.update_tags(shelf, tagid, action=1)
-                    self.send_shelf_led_msg(shelf, LED_BLUE)
-                    self.light_switch_events.remove(shelf)
-                    self.print_tag_shelfs()
-        
+
+        if __debug__:
+            logger.debug("Cabinet %s processing new tag location for tag %s.", self.id, tag.tagid)
+        self.assign_tags((tag,))
+
+    def assign_tags(self, tags: Iterable[TagLoc]):
+        """ Match tags against every shelf with a pending light switch event in
+            one pass.  The tag x shelf distances are computed as one matrix and
+            the assignment is solved globally by the configured matcher, then the
+            LED commands for all matched shelves are sent together.  Tags outside
+            the cabinet's z range, or whose shelf band is too far from every
+            pending shelf, are dropped before the matrix by a band lookup. """
+        shelves = [shelf for shelf in self.light_switch_events if self.get_light_switch_state(shelf)]
+        if len(shelves) == 0:
+            return
+        near = None  # shelf bands a matching tag can be in
+        if self.band_reach is not None:
+            reach = self.band_reach
+            near = {band for shelf in shelves for band in range(shelf - reach, shelf + reach + 1)}
+
+        assigned = self.tag_shelf
+        geometry = self.geometry
+        check_dwell = self.check_dwell
+        candidates = []
+        heights = []
+        for tag in tags:
+            if tag.tagid in assigned:
+                continue
+            if check_dwell and not tag.is_settled(self.dwell_samples, self.dwell_ms):
+                continue
+            if geometry.xy_box is not None and not geometry.contains_xy(tag.x[-1], tag.y[-1]):
+                continue
+            height = self.get_tag_height(tag)
+            if height is None:
+                continue
+            if near is not None and geometry.shelf_at_height(height) not in near:
+                continue
+            candidates.append(tag)
+            heights.append(height)
+        if len(candidates) == 0:
+            return
+
+        start = time.perf_counter()
+        shelf_heights = geometry.shelf_z[[shelf - 1 for shelf in shelves]]
+        dist = shelf_match.distance_matrix(heights, shelf_heights)
+        pairs = self.match_fnc(dist, self.shelf_prox_shreshold)
+        MATCH_SECONDS.observe(time.perf_counter() - start)
+        if len(pairs) == 0:
+            return
+
+        matched = []
+        for tag_idx, shelf_idx in pairs:
+            shelf = shelves[shelf_idx]
+            tagid = candidates[tag_idx].tagid
+            logger.info("Tag %s is near shelf %s (dist=%.2f).", tagid, shelf, dist[tag_idx, shelf_idx])
+            self.update_tags(shelf, tagid, action=1)
+            self.light_switch_events.remove(shelf)
+            matched.append(shelf)
+        self._update_armed()
+        for shelf in sorted(matched):
+            self.send_shelf_led_msg(shelf, LED_BLUE)
+
+
+    def get_state(self) -> dict:
+        """ Shelf state to snapshot: switch states, the tags on each shelf,
+            the LED value last set on each shelf and the shelves waiting
+            for a tag, indexed by shelf - 1. """
+        return {'switches': [bool(self.light_switch_states[shelf]) for shelf in range(1,7)],
+                'tags': [list(self.tags[shelf]) for shelf in range(1,7)],
+                'leds': [self.leds.get(shelf, LED_OFF) for shelf in range(1,7)],
+                'events': list(self.light_switch_events)}
+
+    def restore_state(self, state:dict):
+        """ Load a state saved by get_state().  The UI is not updated. """
+        switches = state.get('switches', [])
+        tags = state.get('tags', [])
+        if len(switches) != 6 or len(tags) != 6:
+            logger.warning("Cabinet %s ignoring malformed snapshot state", self.id)
+            return
+        self.tags = {num:{} for num in range(1,7)}
+        self.tag_shelf = {}
+        for shelf in range(1,7):
+            self.light_switch_states[shelf] = bool(switches[shelf - 1])
+            for tagid in tags[shelf - 1]:
+                self.tags[shelf][tagid] = None
+                self.tag_shelf[tagid] = shelf
+        self.light_switch_events = [shelf for shelf in state.get('events', [])
+                                    if 1 <= shelf <= 6 and self.light_switch_states[shelf]]
+        self._update_armed()
+        leds = state.get('leds', None)
+        if leds is None or len(leds) != 6:
+            leds = self._derived_leds()
+        self.leds = {shelf: int(leds[shelf - 1]) for shelf in range(1,7)}
+        if self.led_timers is not None:
+            for shelf, value in self.leds.items():
+                if value != LED_OFF:
+                    self.led_timers.schedule((self.id, shelf))
+
+    def _derived_leds(self) -> list[int]:
+        """ LED values implied by the shelf state, indexed by shelf - 1:
+            RED while waiting for a tag, BLUE with a tag on a switched on
+            shelf, OFF otherwise.  For snapshots saved without LEDs. """
+        leds = []
+        for shelf in range(1,7):
+            if shelf in self.light_switch_events:
+                leds.append(LED_RED)
+            elif self.light_switch_states[shelf] and self.tags[shelf]:
+                leds.append(LED_BLUE)
+            else:
+                leds.append(LED_OFF)
+        return leds
 
     def _init_states(self):
+        """ Ask the controller for its switch and LED states.  The answers
+            are reconciled with the state the cabinet has. """
+        self.initialized = False
         self._request_switch_states()
         self._request_led_states()
-        self.initialized = False
+
+    def state_queries(self) -> list[tuple[str, Callable[[geo_cmd.Message], None]]]:
+        """ The switch then LED state queries, with their response callbacks.
+            The switch answer comes first, so the LED diff sees its changes. """
+        params = ', '.join(str(SHELF_PARAM_BASE + shelf) for shelf in range(1,7))
+        return [(f"RCVCMD, {self.id}, GETRCVP, {SWITCH_STATE_PARAM}\r\n", self._parse_switch_state_response),
+                (f"RCVCMD, {self.id}, GETRCVP, {params}\r\n", self._parse_led_param_response)]
 
     def _request_switch_states(self):
-        msg = f"RCVCMD, {self.dev_id}, GETRCVP, 97\r\n"
-        logger.info(f"Send: {msg}")
-        self.cmd_conn(msg, self._parse_switch_state_response)
+        msg, callback = self.state_queries()[0]
+        logger.info("Send: %s", msg)
+        self.send_geo_cmd(msg, callback)
 
     def _request_led_states(self):
-        msg = f"RCVCMD, {self.dev_id}, GETRCVP, 101, 102, 103, 104, 105, 106\r\n"
-        logger.info(f"Send: {msg}")
-        self.cmd_conn(msg, self._parse_led_param_response)
+        msg, callback = self.state_queries()[1]
+        logger.info("Send: %s", msg)
+        self.send_geo_cmd(msg, callback)
+
+    def correct_leds(self):
+        """ Rewrite the LEDs the controller reports differently from what
+            was last set, or for shelves never set, from what the shelf
+            state implies.  Only the differences are sent. """
+        derived = None
+        for shelf, reported in self.led_states.items():
+            desired = self.leds.get(shelf, None)
+            if desired is None:
+                if derived is None:
+                    derived = self._derived_leds()
+                desired = derived[shelf - 1]
+            if reported != desired:
+                logger.info("Cabinet %s shelf %s LED is %s, setting %s", self.id, shelf, reported, desired)
+                self._write_led(shelf, desired)
+                self.led_corrections += 1
 
 
     def _parse_led_param_response(self, msg:geo_cmd.Message):
-        """ Callback for RCVCMD 101, . """
+        """ Callback for GETRCVP 101..106, the LED state of each shelf. """
         if msg.err == "ERROR":
+            logger.error("Cabinet %s LED state query failed: %s", self.id, msg.rspns)
             return
         
-        logger.debug(f"_parse_led_param_response. msg.rspns: {msg.rspns}")
+        logger.debug("_parse_led_param_response. msg.rspns: %s", msg.rspns)
         try:
-            vals = msg.rspns.replace(" ", "").split(",")
-        except Exception as e:
-            logger.error('_parse_led_patam_response exception. ', e)
-
-        for idx, val in enumerate(vals):
-            try:
-                val=int(val)
-                self.set_sw_state(idx+1, val)
-            except:
-                logger.exception(f'Exception parsing led state response')
-                return
-        self.initialized = True
+            vals = _response_values(msg.rspns, 6)
+        except ValueError:
+            logger.exception('Exception parsing led state response')
+            return
+        self.led_states = {shelf: val for shelf, val in enumerate(vals, start=1)}
+        self.correct_leds()
 
     def _parse_switch_state_response(self, msg:geo_cmd.Message):
-        """ Callback for RCVCMD 97, switch states. """
+        """ Callback for GETRCVP 97, switch states.  Shelves whose switch
+            went on while the app was not listening are handled as if their
+            LTSW had arrived.  See RESYNC_APPLIES_SWITCH_OFF for the ones
+            reported off. """
         if msg.err == "ERROR":
-            
+            logger.error("Cabinet %s switch state query failed: %s", self.id, msg.rspns)
             return
         
-        logger.debug(f"_parse_switch_state_response. msg.rspns: {msg.rspns}")
+        logger.debug("_parse_switch_state_response. msg.rspns: %s", msg.rspns)
 
         try:
-            val=int(msg.rspns)
-        except:
-            logger.exception(f'Exception parsing switch state response')
+            val = _response_values(msg.rspns, 1)[0]
+        except ValueError:
+            logger.exception('Exception parsing switch state response')
             return
         self.sw_states = val
+        for shelf in range(1,7):
+            state = bool(val >> (shelf - 1) & 1)
+            if state != self.light_switch_states[shelf]:
+                if not state and not RESYNC_APPLIES_SWITCH_OFF:
+                    logger.warning("Cabinet %s shelf %s switch reported off (GETRCVP %s=%s), keeping it on",
+                                   self.id, shelf, SWITCH_STATE_PARAM, val)
+                    continue
+                logger.info("Cabinet %s shelf %s switch is %s", self.id, shelf, "on" if state else "off")
+                self.set_switch(shelf, int(state))
         self.initialized = True
 
+
+def _response_values(rspns:str, count:int) -> list[int]:
+    """ The last count comma separated fields of a GETRCVP response as ints. """
+    fields = [field.strip() for field in rspns.split(',')]
+    if len(fields) < count:
+        raise ValueError(f"Expected {count} values in '{rspns}'.")
+    return [int(field) for field in fields[-count:]]
+
 class Cluster:
     """ A Cluster of Cabinet objects.  It is used to manage multiple cabinets.
         Route LTSW message to the appropriate cabinet. """
-    def __init__(self, config: dict, send_fnc: Callable[[str], None]):
-        """ create a Cabinet object for each cabinet in the config """
+    def __init__(self, config: dict, send_fnc: Callable[[str], None],
+                 clock:Callable[[], float]=time.monotonic):
+        """ create a Cabinet object for each cabinet in the config.  clock
+            drives the LED timeouts, command and resync deadlines and
+            snapshot interval, a replay passes the capture's clock. """
         self.cabinets: dict[int, Cabinet] = {}
+        self.send_fnc = send_fnc
+        self.clock = clock
+        self.resync_max_in_flight = int(config.get('resync_max_in_flight', DEFAULT_RESYNC_IN_FLIGHT))
+        self.resync: Resync = None  # the last state resync round
+        self.cmd_scheduler = CommandScheduler(send_fnc,
+                                              max_in_flight=config.get('max_commands_in_flight', DEFAULT_MAX_IN_FLIGHT),
+                                              timeout=float(config.get('command_timeout', DEFAULT_COMMAND_TIMEOUT)),
+                                              clock=clock)
+        led_timeout = config.get('led_timeout', None)  # seconds, LEDs stay on if not set
+        self.led_timers = TimerQueue(float(led_timeout), clock=clock) if led_timeout else None
+        self.armed: set[int] = set()  # ids of cabinets with shelves waiting for a tag
         for cabinet in config.get('cabinets', []):
             cabinet_id = cabinet.get('cabinet_controller_id', None)
-            self.cabinets[cabinet_id] = Cabinet(cabinet, send_cmd_fnc=send_fnc)
-
-    def add_ltsw_msg(self, msg: Geomsg):
-        """ Add a light switch message to the appropriate cabinet. """
-        logger.debug(f"Received message: {msg.msg}")
-        cabinet_id = int(msg.fmsg[2])
-        self.cabinets[cabinet_id].add_ltsw_msg(msg)
-
+            self.cabinets[cabinet_id] = Cabinet(cabinet, send_cmd_fnc=send_fnc,
+                                                cmd_scheduler=self.cmd_scheduler,
+                                                led_timers=self.led_timers,
+                                                armed=self.armed)
+        # Shelf state survives a restart in snapshot_file, see snapshot.py
+        snapshot_file = config.get('snapshot_file', None)
+        self.snapshots = None
+        if snapshot_file:
+            self.restore_state(load_snapshot(snapshot_file))
+            self.snapshots = SnapshotWriter(snapshot_file,
+                                            float(config.get('snapshot_interval', DEFAULT_SNAPSHOT_INTERVAL)),
+                                            clock=clock)
+
+    def add_ltsw_msg(self, msg: Geomsg) -> Cabinet:
+        """ Add a light switch message to the appropriate cabinet. Returns the cabinet. """
+        if __debug__:
+            logger.debug("Received message: %s", msg.msg)
+        cabinet_id = msg.controller_id if isinstance(msg, LtswMsg) else int(msg.fmsg[2])
+        cabinet = self.cabinets[cabinet_id]
+        cabinet.add_ltsw_msg(msg)
+        return cabinet
+
+    def add_ltsw_msgs(self, msgs:Iterable[Geomsg]) -> list[Cabinet]:
+        """ Add a batch of light switch messages.  Returns the cabinets
+            switched, each once, in the order first switched. """
+        cabinets = {}
+        for msg in msgs:
+            # A bad message, e.g. from a controller not in the config, is
+            # logged and skipped, the rest of the batch still applies
+            try:
+                cabinet = self.add_ltsw_msg(msg)
+            except Exception:
+                HANDLER_ERRORS.inc("LTSW")
+                logger.exception("Dropping LTSW that failed to apply: %s", getattr(msg, 'msg', msg))
+                continue
+            cabinets[cabinet.id] = cabinet
+        return list(cabinets.values())
+
+
+    def flush_commands(self):
+        """ Send the LED writes queued by all cabinets. """
+        self.cmd_scheduler.flush()
+
+    def expire_leds(self):
+        """ Turn off the LEDs whose led_timeout has passed.  The OFF writes
+            are queued, so they go out merged per controller. """
+        if self.led_timers is None:
+            return
+        for cabinet_id, shelf_num in self.led_timers.expire():
+            cabinet = self.cabinets.get(cabinet_id, None)
+            if cabinet is not None:
+                logger.debug("Cabinet %s shelf %s LED timed out", cabinet_id, shelf_num)
+                cabinet.send_shelf_led_msg(shelf_num, LED_OFF)
+
+    def poll(self):
+        """ Called once per main loop pass: expire LED timers and resync
+            queries, send the queued commands and save a snapshot when one
+            is due. """
+        self.expire_leds()
+        if self.resync is not None:
+            self.resync.poll()
+        self.flush_commands()
+        if self.snapshots is not None and self.snapshots.due():
+            self.snapshots.save(self.get_state())
+
+    def get_state(self) -> dict:
+        """ Shelf state of every cabinet, keyed by controller id as a string. """
+        return {str(cabinet_id): cabinet.get_state() for cabinet_id, cabinet in self.cabinets.items()}
+
+    def restore_state(self, state:dict):
+        """ Load a state saved by get_state().  Cabinets no longer in the
+            config are skipped. """
+        for cabinet_id, cabinet_state in state.items():
+            cabinet = self.cabinets.get(int(cabinet_id), None)
+            if cabinet is not None:
+                cabinet.restore_state(cabinet_state)
+        if state:
+            logger.info("Restored the state of %s cabinets", len(state))
+
+    def save_snapshot(self):
+        """ Write the snapshot now, e.g. on shutdown. """
+        if self.snapshots is not None:
+            self.snapshots.save(self.get_state())
+
+    def request_states(self):
+        """ Query every controller's switch and LED states, with up to
+            resync_max_in_flight queries outstanding.  The responses update
+            the cabinets as they arrive and queue the LED corrections. """
+        if self.resync is not None:
+            self.resync.cancel()
+        self.resync = Resync(self.send_fnc, self.resync_max_in_flight, self.cmd_scheduler.timeout,
+                             clock=self.clock)
+        for cabinet in self.cabinets.values():
+            cabinet.initialized = False
+            for msg, callback in cabinet.state_queries():
+                self.resync.add(msg, callback)
+        self.resync.start()
+
+    def reset_commands(self):
+        """ The command connection was lost, responses will not arrive. """
+        self.cmd_scheduler.reset()
+        if self.resync is not None:
+            self.resync.cancel()
+
+    def next_timeout(self) -> float:
+        """ Seconds until the next LED timer expires or command or resync
+            query times out, None if there is none. """
+        timeouts = [timeout for timeout in (self.cmd_scheduler.next_timeout(),
+                                            self.led_timers.next_timeout() if self.led_timers else None,
+                                            self.resync.next_timeout() if self.resync else None)
+                    if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def is_armed(self) -> bool:
+        """ Is any cabinet waiting for a tag to be placed on a shelf. """
+        return len(self.armed) > 0
+
+    def get_zones(self) -> set[str]:
+        """ Get the zone names of all cabinets. """
+        return {cabinet.zone for cabinet in self.cabinets.values()}
 
     def get_cabinet(self, cabinet_id: int) -> Cabinet:
         """ Get a Cabinet object by its ID. """
@@ -0,0 +1,172 @@
+""" Capture and replay of raw GeoTraqr data port traffic.
+
+    A capture is an append-only file of records, each the receive time in
+    nanoseconds since the epoch, the line length and the raw line:
+        struct '<qI' (ts_ns, length) + length bytes
+    Files ending in .gz are gzip compressed.  Appending to an existing .gz
+    adds a gzip member, which readers handle transparently.
+
+    Replay a capture through the normal pipeline:
+        python src/capture.py captures/site.cap.gz --speed 10
+    The pipeline's timers (LED timeouts, command deadlines) run on the
+    capture's receive times, so a replay is the same at any speed.
+"""
+
+import argparse
+import gzip
+import logging
+import pathlib
+import struct
+import time
+from typing import Callable, Iterator
+
+RECORD_HEADER = struct.Struct('<qI')
+FLUSH_EVERY = 1000  # records between flushes to disk
+
+logger = logging.getLogger("app."+__name__)
+
+
+def _open(path, mode:str):
+    path = pathlib.Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class CaptureWriter():
+    """ Appends raw lines with their receive time to a capture file. """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = _open(self.path, 'ab')
+        self.count = 0
+
+    def write(self, raw, ts_ns:int=None):
+        if ts_ns is None:
+            ts_ns = time.time_ns()
+        data = raw if isinstance(raw, bytes) else raw.encode()
+        self.file.write(RECORD_HEADER.pack(ts_ns, len(data)))
+        self.file.write(data)
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_capture(path) -> Iterator[tuple[int, str]]:
+    """ Yield (ts_ns, raw line) records in file order.  A record cut short
+        by a crash at the end of the file is ignored, as is the rest of a
+        gzip stream cut short. """
+    with _open(path, 'rb') as f_in:
+        while True:
+            try:
+                header = f_in.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                ts_ns, length = RECORD_HEADER.unpack(header)
+                data = f_in.read(length)
+            except (EOFError, gzip.BadGzipFile) as e:
+                logger.warning("Capture %s ends early: %s", path, e)
+                return
+            if len(data) < length:
+                return
+            yield ts_ns, data.decode('ascii', 'replace')
+
+
+class ReplayClock():
+    """ Clock of a replay: the receive time, in seconds, of the record
+        being replayed.  Pass it as the clock of what replay() drives. """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CapturingFactory():
+    """ Message factory for the receiver parser that records every raw
+        message before handing it to the wrapped factory. """
+    def __init__(self, factory:Callable, writer:CaptureWriter):
+        self.factory = factory
+        self.writer = writer
+
+    def __call__(self, raw):
+        self.writer.write(raw)
+        return self.factory(raw)
+
+
+def replay(path, handler, factory:Callable, speed:float=None,
+           poll_fnc:Callable[[], None]=None, sleep:Callable[[float], None]=time.sleep,
+           clock:ReplayClock=None) -> dict:
+    """ Feed a capture to handler.handle_message.
+        speed: 1 for real time, N for N times faster, None as fast as possible.
+        poll_fnc is called after every message, like the main loop does.
+        clock is set to each record's receive time before it is handled.
+        Returns the message count, the capture span and the replay time. """
+    count = 0
+    first_ts = last_ts = None
+    start = time.perf_counter()
+    for ts_ns, raw in read_capture(path):
+        if first_ts is None:
+            first_ts = ts_ns
+        elif speed is not None:
+            delay = (ts_ns - first_ts) / 1e9 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                sleep(delay)
+        last_ts = ts_ns
+        if clock is not None:
+            clock.now = ts_ns / 1e9
+        handler.handle_message(factory(raw))
+        if poll_fnc is not None:
+            poll_fnc()
+        count += 1
+    elapsed = time.perf_counter() - start
+    span = (last_ts - first_ts) / 1e9 if count else 0.0
+    return {'messages': count, 'span': span, 'elapsed': elapsed}
+
+
+def main():
+    """ Replay a capture through a pipeline built from config.yaml, with the
+        GeoTraqr commands printed instead of sent. """
+    import yaml
+    from fast_msg import FastMsgFactory
+    from pipeline import build_pipeline
+    from net.geo_packet_handler import Geomsg
+
+    parser = argparse.ArgumentParser(description="Replay a GeoTraqr capture.")
+    parser.add_argument('capture')
+    parser.add_argument('--config', default='config/config.yaml')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='1 for real time, N for N times faster, omit for as fast as possible')
+    parser.add_argument('--quiet', action='store_true', help='do not print commands')
+    args = parser.parse_args()
+    with open(pathlib.Path(args.config)) as f_in:
+        config = yaml.safe_load(f_in)
+
+    commands = []
+    def send(msg, callback=None):
+        commands.append(msg)
+        if not args.quiet:
+            print(msg.strip())
+
+    clock = ReplayClock()
+    handler, cluster, _ = build_pipeline(config, send, clock)
+    cluster.cmd_scheduler.max_in_flight = float('inf')  # no responses come back
+    stats = replay(args.capture, handler, FastMsgFactory(fallback=Geomsg), args.speed, cluster.poll,
+                   clock=clock)
+    rate = stats['messages'] / stats['elapsed'] if stats['elapsed'] else float('inf')
+    realtime = stats['span'] / stats['elapsed'] if stats['elapsed'] else float('inf')
+    print(f"{stats['messages']} messages, {len(commands)} commands, {rate:.0f} msgs/sec, "
+          f"{realtime:.1f}x real time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+""" Outbound LED command scheduler.  LED writes are queued per controller
+    and sent as one multi-param RCVPRM per controller, with a bounded number
+    of commands waiting for a response.  A write that is superseded before it
+    is sent (RED then BLUE for the same shelf) is never sent. """
+
+import itertools
+import logging
+import time
+from typing import Callable
+from geotraqr import geo_cmd
+from metrics import CMD_QUEUE_DEPTH, CMD_IN_FLIGHT, LED_RTT_SECONDS
+
+
+DEFAULT_MAX_IN_FLIGHT = 4  # RCVPRM commands waiting for a response
+MAX_RETRIES = 2  # resends of a write the controller answered with an error
+DEFAULT_TIMEOUT = 2.0  # seconds to wait for a response before the write is resent
+
+logger = logging.getLogger("app."+__name__)
+
+
+class CommandScheduler():
+    """ Merges, pipelines and confirms RCVPRM parameter writes.
+        set_param() only queues.  flush() sends what the in-flight window
+        allows and is called once per pass of the main loop.  A command not
+        answered within timeout seconds frees its slot and its writes are
+        queued again, as if the controller had answered with an error. """
+    def __init__(self, send_fnc:Callable[[str, Callable[[geo_cmd.Message], None]], None],
+                 max_in_flight:int=DEFAULT_MAX_IN_FLIGHT, timeout:float=DEFAULT_TIMEOUT,
+                 clock:Callable[[], float]=time.monotonic):
+        """ send_fnc follows the fnc(msg, callback) scheme. See geo_cmd.Connect.send(). """
+        self.send_fnc = send_fnc
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.clock = clock
+        self.outstanding: dict[int, tuple[float, int, dict[int, int]]] = {}  # seq -> (deadline, controller, params)
+        self.seq = itertools.count()
+        self.timed_out = 0  # commands never answered
+        self.pending: dict[int, dict[int, int]] = {}  # controller -> {param: value}
+        self.retries: dict[tuple[int, int], int] = {}  # (controller, param) -> resends
+        self.confirmed: dict[tuple[int, int], int] = {}  # (controller, param) -> value acked
+        self.superseded = 0  # writes replaced before they were sent
+
+    def set_param(self, controller_id:int, param:int, value:int):
+        """ Queue a parameter write, replacing a queued write to the same param. """
+        params = self.pending.get(controller_id, None)
+        if params is None:
+            params = self.pending[controller_id] = {}
+        elif param in params:
+            self.superseded += 1
+        params[param] = value
+        self.retries.pop((controller_id, param), None)
+
+    def queue_depth(self) -> int:
+        """ Number of parameter writes waiting to be sent. """
+        return sum(len(params) for params in self.pending.values())
+
+    @property
+    def in_flight(self) -> int:
+        """ Number of commands sent and waiting for a response. """
+        return len(self.outstanding)
+
+    def flush(self):
+        """ Send one RCVPRM per controller with queued writes, oldest
+            controller first, while the in-flight window has room. """
+        if self.outstanding:
+            self.expire()
+        while self.pending and len(self.outstanding) < self.max_in_flight:
+            controller_id = next(iter(self.pending))
+            params = self.pending.pop(controller_id)
+            values = ', '.join(f'{param}={value}' for param, value in sorted(params.items()))
+            msg = f'RCVPRM, {controller_id}, {values}\r\n'
+            seq = next(self.seq)
+            self.outstanding[seq] = (self.clock() + self.timeout, controller_id, params)
+            logger.info("Send: %s", msg)
+            self.send_fnc(msg, self._make_callback(seq, controller_id, params))
+        CMD_QUEUE_DEPTH.set(self.queue_depth())
+        CMD_IN_FLIGHT.set(len(self.outstanding))
+
+    def expire(self):
+        """ Free the slots of commands past their deadline and queue their
+            writes again.  A late response to them is ignored. """
+        now = self.clock()
+        for seq, (deadline, controller_id, params) in list(self.outstanding.items()):
+            if deadline <= now:
+                del self.outstanding[seq]
+                self.timed_out += 1
+                logger.warning("RCVPRM to %s not answered in %.1f s", controller_id, self.timeout)
+                self._retry(controller_id, params)
+
+    def next_timeout(self) -> float:
+        """ Seconds until the first command in flight times out, None if
+            none are in flight. """
+        if not self.outstanding:
+            return None
+        deadline = min(deadline for deadline, _, _ in self.outstanding.values())
+        return max(deadline - self.clock(), 0.0)
+
+    def reset(self):
+        """ Forget commands in flight, their responses will not arrive (the
+            command connection was lost).  Their writes are queued again
+            unless a newer write replaced them. """
+        outstanding = self.outstanding
+        self.outstanding = {}
+        for _, controller_id, params in outstanding.values():
+            queued = self.pending.setdefault(controller_id, {})
+            for param, value in params.items():
+                queued.setdefault(param, value)
+
+    def _make_callback(self, seq:int, controller_id:int, params:dict[int, int]):
+        sent = time.perf_counter()
+        def callback(msg:geo_cmd.Message):
+            if self.outstanding.pop(seq, None) is None:
+                return  # timed out or reset, the writes were queued again
+            LED_RTT_SECONDS.observe(time.perf_counter() - sent)
+            if msg.err == "ERROR":
+                logger.error("RCVPRM to %s failed: %s", controller_id, msg.rspns)
+                self._retry(controller_id, params)
+            else:
+                for param, value in params.items():
+                    self.confirmed[(controller_id, param)] = value
+            self.flush()
+        return callback
+
+    def _retry(self, controller_id:int, params:dict[int, int]):
+        """ Queue failed writes again unless a newer write replaced them. """
+        queued = self.pending.get(controller_id, {})
+        for param, value in params.items():
+            key = (controller_id, param)
+            if param in queued:
+                continue
+            retries = self.retries.get(key, 0)
+            if retries >= MAX_RETRIES:
+                logger.error("Giving up on %s=%s for %s", param, value, controller_id)
+                self.retries.pop(key, None)
+                continue
+            self.pending.setdefault(controller_id, {})[param] = value
+            self.retries[key] = retries + 1
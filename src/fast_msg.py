@@ -0,0 +1,101 @@
+""" Fast-path decoder for the high rate data port messages.  LCTN and LTSW
+    lines are decoded straight into small typed records with only the fields
+    the handlers use, converted once.  Everything else is handed to Geomsg.
+
+    LCTN: ts, LCTN, tagid, tagname, zonename, inmotion, isalert, rngcnt,
+          rngerr, prircv, prirng, locx, locy, locz
+    LTSW: ts, SENS0, controller id, LTSW, shelf number, state
+"""
+
+from net.geo_packet_handler import Geomsg
+
+
+class LctnMsg():
+    """ Decoded LCTN location message. """
+    __slots__ = ('msg', 'ts', 'tagid', 'zone', 'motion', 'x', 'y', 'z')
+    type = "LCTN"
+
+    def __init__(self, msg:str, ts:int, tagid:int, zone:str, motion:bool,
+                 x:float, y:float, z:float):
+        self.msg = msg
+        self.ts = ts
+        self.tagid = tagid
+        self.zone = zone
+        self.motion = motion
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def fmsg(self) -> list:
+        """ Raw fields, for handlers that still index the message. """
+        return self.msg.split(',')
+
+
+class LtswMsg():
+    """ Decoded SENS0 light switch message. """
+    __slots__ = ('msg', 'ts', 'controller_id', 'shelf', 'state')
+    type = "SENS0"
+    sens_type = "LTSW"
+
+    def __init__(self, msg:str, ts:int, controller_id:int, shelf:int, state:int):
+        self.msg = msg
+        self.ts = ts
+        self.controller_id = controller_id
+        self.shelf = shelf
+        self.state = state
+
+    @property
+    def fmsg(self) -> list:
+        """ Raw fields, for handlers that still index the message. """
+        return self.msg.split(',')
+
+
+class DroppedMsg():
+    """ A message filtered out before parsing.  No handler is registered
+        for its type, so MsgHandler ignores it. """
+    __slots__ = ()
+    type = None
+    msg = ''
+
+DROPPED = DroppedMsg()
+
+
+def zone_name(field:str) -> str:
+    """ Zone name from its raw field.  Every parse path goes through this,
+        so a zone keys the same whichever parser decoded the message. """
+    return field.strip()
+
+
+class FastMsgFactory():
+    """ Message factory for the receiver parser, in place of Geomsg.
+        The line is split in two steps: the six leading fields, which give
+        the type and the zone, and only for an LCTN that is kept, the rest
+        with the location.  Other messages and dropped zones never split
+        the tail.
+        zones: if given, LCTN messages from any other zone are dropped before
+        their numbers are parsed. """
+    def __init__(self, zones:set[str]=None, fallback=Geomsg):
+        self.zones = frozenset(zones) if zones is not None else None
+        self.fallback = fallback
+
+    def __call__(self, raw):
+        msg = raw if isinstance(raw, str) else raw.decode('ascii', 'replace')
+        head = msg.split(',', 6)  # ts, type, id, name or LTSW, zone or shelf, motion or state, rest
+        if len(head) > 1:
+            msg_type = head[1].strip()
+            try:
+                if msg_type == "LCTN" and len(head) == 7:
+                    zone = zone_name(head[4])
+                    if self.zones is not None and zone not in self.zones:
+                        return DROPPED
+                    tail = head[6].split(',')  # isalert, rngcnt, rngerr, prircv, prirng, locx, locy, locz
+                    if len(tail) == 8:
+                        # int() and float() ignore the surrounding spaces and \r\n
+                        return LctnMsg(msg, int(head[0]), int(head[2]), zone, int(head[5]) != 0,
+                                       float(tail[5]), float(tail[6]), float(tail[7]))
+                elif msg_type == "SENS0" and len(head) == 6 and head[3].strip() == "LTSW":
+                    return LtswMsg(msg, int(head[0]), int(head[2]), int(head[4]), int(head[5]))
+            except ValueError:
+                pass  # let Geomsg deal with malformed lines
+        return self.fallback(raw)
@@ -0,0 +1,83 @@
+""" Cabinet geometry.  Everything that can be derived from a cabinet's
+    configuration is computed once when the cabinet is created: the shelf
+    mid heights, the z band each shelf occupies and the x-y footprint a tag
+    has to be inside to be considered in the cabinet. """
+
+import math
+from typing import NamedTuple
+import numpy as np
+
+
+NUM_SHELVES = 6
+DEFAULT_SHELF_OFFSET_HEIGHT = 0.396  # Z of the cabinet when no location is configured
+
+
+def parse_location(value) -> tuple[float, float, float]:
+    """ Parse a config location.  YAML gives '(87.42, 13.0, 0.396)' as a
+        string, tests and code give tuples or lists. Returns None if unset. """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().strip('()[]').split(',')
+    x, y, z = (float(v) for v in value)
+    return (x, y, z)
+
+
+class ShelfGeometry(NamedTuple):
+    """ Immutable geometry table for one cabinet.  Shelf 1 is the top shelf,
+        shelf NUM_SHELVES the bottom one.  Arrays are indexed by shelf-1 and
+        are read only. """
+    location: tuple[float, float, float]  # None if not configured
+    base_z: float  # bottom of the bottom shelf
+    shelf_height: float
+    shelf_z: np.ndarray  # mid height of each shelf
+    xy_box: tuple[float, float, float, float]  # (xmin, xmax, ymin, ymax), None if no footprint
+
+    @classmethod
+    def from_config(cls, cabinet_config:dict) -> 'ShelfGeometry':
+        location = parse_location(cabinet_config.get('location', None))
+        shelf_height = float(cabinet_config.get('shelf_height', 0.0))
+        base_z = location[2] if location is not None else DEFAULT_SHELF_OFFSET_HEIGHT
+
+        # Shelf n occupies [base + (6-n)*h, base + (7-n)*h)
+        levels = np.arange(NUM_SHELVES - 1, -1, -1, dtype=np.float64)
+        shelf_z = base_z + levels * shelf_height + shelf_height / 2
+        shelf_z.flags.writeable = False
+
+        # The footprint is shelf_width wide in x and shelf_depth deep in y,
+        # both widened by width_proximity_threshold.  Without shelf_depth
+        # the footprint is square.
+        xy_box = None
+        shelf_width = cabinet_config.get('shelf_width', None)
+        if location is not None and shelf_width is not None:
+            margin = float(cabinet_config.get('width_proximity_threshold', 0.0))
+            half_width = float(shelf_width) / 2 + margin
+            half_depth = float(cabinet_config.get('shelf_depth', shelf_width)) / 2 + margin
+            xy_box = (location[0] - half_width, location[0] + half_width,
+                      location[1] - half_depth, location[1] + half_depth)
+
+        return cls(location, base_z, shelf_height, shelf_z, xy_box)
+
+    def get_shelf_height(self, shelf_num:int) -> float:
+        """ Mid height of a shelf. """
+        if shelf_num < 1 or shelf_num > NUM_SHELVES:
+            raise ValueError("Shelf number must be between 1 and 6.")
+        return float(self.shelf_z[shelf_num - 1])
+
+    def shelf_at_height(self, z:float) -> int:
+        """ The shelf whose z band contains z, None if z is outside the
+            cabinet.  Shelf n occupies [base + (6-n)*h, base + (7-n)*h). """
+        if self.shelf_height <= 0:
+            return None
+        level = math.floor((z - self.base_z) / self.shelf_height)
+        if level < 0 or level >= NUM_SHELVES:
+            return None
+        return NUM_SHELVES - level
+
+    def contains_xy(self, x:float, y:float) -> bool:
+        """ Is the point inside the cabinet footprint.  Always True when the
+            cabinet has no configured footprint. """
+        if self.xy_box is None:
+            return True
+        xmin, xmax, ymin, ymax = self.xy_box
+        return xmin <= x <= xmax and ymin <= y <= ymax
@@ -0,0 +1,144 @@
+""" Non-blocking logging.  QueueLogging moves the handlers configured on
+    the given loggers (logconfig.json) behind a bounded queue, they are
+    then run by a background QueueListener thread.  Logging on the message
+    thread only formats the record and queues it, so a slow disk or
+    terminal no longer delays LED control.
+
+    When the queue is full records are dropped, not waited for; the count
+    is logged once the queue has room again.  At or below sample_level
+    (DEBUG by default) each logging call site passes at most per_second
+    records a second, so per-LCTN debug logs can not flood the queue. """
+
+import json
+import logging
+import logging.config
+import logging.handlers
+import pathlib
+import queue
+import time
+from typing import Callable, Iterable
+from metrics import LOG_DROPPED
+
+DEFAULT_QUEUE_SIZE = 10000  # records waiting for the writer thread
+DEFAULT_PER_SECOND = 20  # debug records per call site per second
+LOG_CONFIG_FILE = "logconfig.json"
+
+logger = logging.getLogger("app."+__name__)
+
+
+class RateSampler(logging.Filter):
+    """ Passes at most per_second records a second from each call site
+        (file and line) for records at or below level.  Others always pass. """
+    def __init__(self, per_second:float=DEFAULT_PER_SECOND, level:int=logging.DEBUG,
+                 clock:Callable[[], float]=time.monotonic):
+        super().__init__()
+        self.per_second = per_second
+        self.level = level
+        self.clock = clock
+        self.window: dict[tuple[str, int], list] = {}  # call site -> [window start, count]
+        self.sampled = 0
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno > self.level:
+            return True
+        now = self.clock()
+        site = (record.pathname, record.lineno)
+        window = self.window.get(site, None)
+        if window is None or now - window[0] >= 1.0:
+            self.window[site] = [now, 1]
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            return True
+        self.sampled += 1
+        LOG_DROPPED.inc('sampled')
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that drops records when the queue is full instead of
+        reporting an error, and logs how many were dropped once a record
+        fits again. """
+    def __init__(self, log_queue:queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.reported = 0  # dropped records already logged about
+
+    def enqueue(self, record:logging.LogRecord):
+        try:
+            if self.dropped != self.reported:
+                self.queue.put_nowait(self._dropped_record(record))
+                self.reported = self.dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_DROPPED.inc('full')
+
+    def _dropped_record(self, record:logging.LogRecord) -> logging.LogRecord:
+        return logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                 "Log queue full, %s records dropped", (self.dropped - self.reported,), None)
+
+
+class QueueLogging():
+    """ Runs the handlers of loggers from a background thread.  start()
+        moves them behind the queue, stop() writes out what is queued and
+        puts them back. """
+    def __init__(self, loggers:Iterable[str]=("", "app"), queue_size:int=DEFAULT_QUEUE_SIZE,
+                 per_second:float=DEFAULT_PER_SECOND, sample_level:int=logging.DEBUG):
+        self.loggers = [logging.getLogger(name or None) for name in loggers]
+        self.queue_size = queue_size
+        self.per_second = per_second
+        self.sample_level = sample_level
+        self.moved = []  # (logger, handlers, queue handler, listener)
+
+    def start(self):
+        for log in self.loggers:
+            handlers = list(log.handlers)
+            if not handlers:
+                continue
+            log_queue = queue.Queue(self.queue_size)
+            queue_handler = DroppingQueueHandler(log_queue)
+            if self.per_second:
+                queue_handler.addFilter(RateSampler(self.per_second, self.sample_level))
+            listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            for handler in handlers:
+                log.removeHandler(handler)
+            log.addHandler(queue_handler)
+            listener.start()
+            self.moved.append((log, handlers, queue_handler, listener))
+        logger.info("Logging from a background thread, queue of %s records", self.queue_size)
+
+    def stop(self):
+        for log, handlers, queue_handler, listener in self.moved:
+            log.removeHandler(queue_handler)
+            while True:
+                try:
+                    listener.stop()  # queues a sentinel, then waits for the thread
+                    break
+                except queue.Full:
+                    time.sleep(0.01)
+            for handler in handlers:
+                log.addHandler(handler)
+        self.moved = []
+
+    @property
+    def dropped(self) -> int:
+        return sum(queue_handler.dropped for _, _, queue_handler, _ in self.moved)
+
+
+def load_logconfig(path=LOG_CONFIG_FILE):
+    """ Configure logging from a JSON dictConfig file. """
+    with open(pathlib.Path(path)) as f_in:
+        logging.config.dictConfig(json.load(f_in))
+
+
+def start_queue_logging(config:dict) -> QueueLogging:
+    """ Start QueueLogging as log_queue_size and log_debug_per_second in
+        config say.  None if log_queue_size is 0 or not set. """
+    queue_size = int(config.get('log_queue_size', 0))
+    if queue_size <= 0:
+        return None
+    queue_logging = QueueLogging(queue_size=queue_size,
+                                 per_second=float(config.get('log_debug_per_second', 0)))
+    queue_logging.start()
+    return queue_logging
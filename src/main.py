@@ -1,63 +1,121 @@
 from net import rcvr_parser, geo_packet_handler, tnttcp
-import logging, logging.config, json, pathlib, time
+import logging, pathlib, time, selectors
 import msg_handler
+from msg_handler import collapse_lctns
 from geotraqr import geo_cmd
 import yaml
-from typing import Callable
-from zones import Zones
-from cabinet import Cabinet, Cluster
+from typing import Callable, Iterable
+from cabinet import set_ui_publisher
+from pipeline import build_pipeline
+from fast_msg import FastMsgFactory
+import metrics
 
 geo_cmd_connection = None
 
+# Longest the main loop waits for socket data before checking the
+# connections again.  Data wakes it up immediately.
+MAX_IDLE_WAIT = 0.5
+POLL_INTERVAL = 0.1  # sleep when the connections expose no socket to wait on
+MAX_BATCH = 1000  # most data messages drained and handled per pass
+
 # LOGGING_LEVEL = logging.WARNING  # Default logging level
 # Not sure what the use of this is yet.
 # Answer - the "app" logger can be configured seperately
 # from the root logger.  Different handlers and filters
 # can be applied.
 logger = logging.getLogger("app")
-logger.propagate = True
 # logger.setLevel(logging.ERROR)
 # logging.getLogger().setLevel(logging.ERROR)  # Root logger level
 
 def setup_logging():
     """ if config is stored as JSON file """
-    config_file = pathlib.Path("logconfig.json")
-    with open(config_file) as f_in:
-        config = json.load(f_in)
-    logging.config.dictConfig(config)
+    from log_queue import load_logconfig
+    load_logconfig()
+    logger.propagate = True
 
 def geo_cmd_send(msg, callback:Callable[[geo_cmd.Message], None]=None):
     """Send a command to the geotraqr."""
-    logger.info(f"Sending command: {msg}")
+    logger.info("Sending command: %s", msg)
     if geo_cmd_connection is None:
         logger.error("Geo command connection is not established.")
     else:
         geo_cmd_connection.send(msg, callback_fnc=callback)
 
 
-def run(geo_conn, cmd_conn:geo_cmd.Connect, msg_handler:msg_handler.MsgHandler):
-    """
-    """
-
-    while(1):
-        
-        if geo_conn.is_connected():
-            msg = geo_conn.rcv()
-        else: # if its not connected just return and let context mangager deal
-            return
-        
-        if msg is not None:
-            msg_handler.handle_message(msg)
-        else:
-            time.sleep(0.1)
-
-        if not cmd_conn.is_connected():
-            return
-        try:
-            msg = cmd_conn.rcv()
-        except geo_cmd.GeoError as err:
-            logger.error(f"{err}")
-            
+def _selectable(conn) -> bool:
+    """ Can the connection be waited on with a selector. """
+    try:
+        return conn.fileno() >= 0
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def run(geo_conn, cmd_conn:geo_cmd.Connect, msg_handler:msg_handler.MsgHandler,
+        poll_fnc:Callable[[], None]=None, timeout_fnc:Callable[[], float]=None,
+        collapse:bool=False, batch_size:int=MAX_BATCH, wait_conns:Iterable=()):
+    """ Handle data messages and command responses until a connection drops.
+        Each pass drains up to batch_size buffered data messages and
+        handles them as one batch, with superseded LCTNs dropped if
+        collapse is set.  When there is nothing to read, wait on both the
+        data and command sockets at once so a message is handled as soon as
+        its bytes arrive.  poll_fnc is called once per pass to expire timers
+        and send queued commands.  timeout_fnc gives the seconds until the
+        next timer is due (None if none), the wait never runs past it.
+        wait_conns are waited on too, e.g. the pipes shard commands arrive
+        on, so poll_fnc runs as soon as one is readable. """
+
+    selector = None
+    if _selectable(geo_conn) and _selectable(cmd_conn):
+        selector = selectors.DefaultSelector()
+        selector.register(geo_conn, selectors.EVENT_READ)
+        selector.register(cmd_conn, selectors.EVENT_READ)
+        for conn in wait_conns:
+            selector.register(conn, selectors.EVENT_READ)
+
+    try:
+        while(1):
+
+            if not geo_conn.is_connected():
+                return  # if its not connected just return and let context mangager deal
+            batch = []
+            while len(batch) < batch_size:
+                msg = geo_conn.rcv()
+                if msg is None:
+                    break
+                batch.append(msg)
+
+            if batch:
+                metrics.INGEST_BATCH.observe(len(batch))
+                if collapse:
+                    batch = collapse_lctns(batch)
+                msg_handler.handle_messages(batch)
+
+            if not cmd_conn.is_connected():
+                return
+            rsp = None
+            try:
+                rsp = cmd_conn.rcv()
+            except geo_cmd.GeoError as err:
+                logger.error(f"{err}")
+
+            if poll_fnc is not None:
+                poll_fnc()
+
+            # The parsers may hold more buffered messages, only wait once both are empty
+            if not batch and rsp is None:
+                wait = MAX_IDLE_WAIT
+                if timeout_fnc is not None:
+                    timeout = timeout_fnc()
+                    if timeout is not None:
+                        wait = min(wait, timeout)
+                if selector is not None:
+                    selector.select(wait)
+                else:
+                    time.sleep(min(wait, POLL_INTERVAL))
+    finally:
+        if selector is not None:
+            selector.close()
+
 
 def main():
     """ Main function to start the application. """
@@ -71,22 +129,43 @@ def main():
     with open(config_file) as f_in:
         config = yaml.safe_load(f_in)
 
-    handler = msg_handler.MsgHandler()
-
-    # create Cluster for Cabinet objects
-    cluster = Cluster(config, geo_cmd_send)
-
-
-    handler.register_sens0_type("LTSW", cluster.add_ltsw_msg)
-
-    zones = Zones()
-    cabs = cluster.cabinets
-    for cab_id, cabinet in cabs.items():
-        zones.add_cabinet(cabinet, cabinet.zone)
-    
-    # handler.register_msg_type("LOCMON", zones.add_locmon)
-    handler.register_msg_type("LCTN", zones.add_lctn)
-    
+    # Write the logs from a background thread, see log_queue.py
+    from log_queue import start_queue_logging
+    queue_logging = start_queue_logging(config)
+
+    # Shelf updates go to the UI from a background thread
+    ui_url = config.get('ui', {}).get('server_address', None)
+    if ui_url:
+        from ui_publisher import UiPublisher
+        ui_publisher = UiPublisher(ui_url)
+        ui_publisher.start()
+        set_ui_publisher(ui_publisher)
+
+    # Counters and timings at http://127.0.0.1:<metrics_port>/metrics
+    metrics_port = config.get('metrics_port', None)
+    if metrics_port:
+        metrics_server = metrics.MetricsServer(metrics.REGISTRY, int(metrics_port))
+        metrics_server.start()
+        logger.info("Serving metrics on port %s", metrics_port)
+
+    num_shards = int(config.get('shards', 1))
+    if num_shards > 1:
+        # Cabinets run in shard processes, this one only routes messages
+        from shards import ShardedCluster
+        sharded = ShardedCluster(config, geo_cmd_send, num_shards)
+        sharded.start()
+        handler = sharded.handler
+        poll_fnc, timeout_fnc, reset_fnc = sharded.poll, sharded.next_timeout, sharded.reset_commands
+        wait_conns = sharded.selectables()
+        # The shards save their snapshots as they stop
+        resync_fnc, save_fnc = sharded.request_states, sharded.stop
+        msg_factory = sharded.factory
+    else:
+        handler, cluster, zones = build_pipeline(config, geo_cmd_send)
+        poll_fnc, timeout_fnc, reset_fnc = cluster.poll, cluster.next_timeout, cluster.reset_commands
+        wait_conns = ()
+        resync_fnc, save_fnc = cluster.request_states, cluster.save_snapshot
+        msg_factory = None
 
     # # Start the receiver parser
     # rcvr_parser.start_receiver(config, msg_handler.handle_message)
@@ -102,28 +181,60 @@ def main():
     geo_cmd_port = net_conf['geo_cmd_port']
     geo_data_port = net_conf['geo_data_port']
     
-    parser = rcvr_parser.RcvrParser(geo_packet_handler.Geomsg)
+    # LCTN and LTSW are decoded on a fast path, everything else by Geomsg.
+    # In sharded mode only the routing fields are, the shards decode the rest.
+    if msg_factory is None:
+        cabinet_zones = None
+        if config.get('drop_lctn_outside_cabinet_zones', False):
+            cabinet_zones = {cabinet['zone'] for cabinet in config.get('cabinets', [])}
+        msg_factory = FastMsgFactory(cabinet_zones, fallback=geo_packet_handler.Geomsg)
+    factory = metrics.Timed(msg_factory, metrics.PARSE_SECONDS)
+    # Record the raw data port traffic for offline replay, see capture.py
+    capture_file = config.get('capture_file', None)
+    capture = None
+    if capture_file:
+        from capture import CaptureWriter, CapturingFactory
+        capture = CaptureWriter(capture_file)
+        factory = CapturingFactory(factory, capture)
+        logger.info(f"Capturing data port traffic to {capture_file}")
+    parser = rcvr_parser.RcvrParser(factory)
+    # Keep only the latest of a tag's LCTNs drained in one pass
+    collapse = bool(config.get('collapse_lctn', False))
     
     # Main loop
-    while True:
-        try:
-            with tnttcp.client_connect(geo_address, geo_data_port, parser=parser) as geo_out, \
-                    geo_cmd.Connect(geo_address, geo_cmd_port) as cmd_conn:
-                logger.info("Connected to GeoTraqr")
-                geo_cmd_connection = cmd_conn
-                run(geo_out, cmd_conn, handler)
-
-        except TimeoutError:
-            logger.error("Connection Timed Out")
-            time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Closing connection.")
-            return
-        except Exception as e:
-            logger.error(f"An error occurred: {e}")
-            time.sleep(5)
-        finally:
-            geo_cmd_connection = None
+    try:
+        while True:
+            try:
+                with tnttcp.client_connect(geo_address, geo_data_port, parser=parser) as geo_out, \
+                        geo_cmd.Connect(geo_address, geo_cmd_port) as cmd_conn:
+                    logger.info("Connected to GeoTraqr")
+                    geo_cmd_connection = cmd_conn
+                    reset_fnc()
+                    # Catch up on what changed while disconnected and correct the LEDs
+                    resync_fnc()
+                    run(geo_out, cmd_conn, handler, poll_fnc, timeout_fnc, collapse=collapse,
+                        wait_conns=wait_conns)
+
+            except TimeoutError:
+                logger.error("Connection Timed Out")
+                time.sleep(1)
+            except KeyboardInterrupt:
+                logger.info("Closing connection.")
+                if save_fnc is not None:
+                    save_fnc()
+                if queue_logging is not None:
+                    queue_logging.stop()
+                return
+            except Exception as e:
+                logger.error(f"An error occurred: {e}")
+                time.sleep(5)
+            finally:
+                geo_cmd_connection = None
+    finally:
+        # Also when an exception escapes the loop, e.g. Ctrl-C while waiting to
+        # reconnect, so the buffered records and the gzip trailer are written
+        if capture is not None:
+            capture.close()
 
 if __name__ == "__main__":
     main()
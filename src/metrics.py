@@ -0,0 +1,235 @@
+""" Lightweight counters, gauges and histograms for the hot path, cheap
+    enough to leave on in production.  Updating a metric is a dict or list
+    increment, there is no locking; the HTTP endpoint reads them from its
+    own thread.
+
+    The metrics used by the app are defined at the bottom of this module.
+    Serve them in the Prometheus text format with:
+        MetricsServer(REGISTRY, port).start()
+    or read REGISTRY.snapshot() periodically.
+
+    Debug level log formatting on the hot path sits under `if __debug__:`,
+    run python with -O to compile it out. """
+
+import bisect
+import logging
+import threading
+import time
+from typing import Callable
+
+# Seconds, 10 us to 2.5 s
+TIME_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+logger = logging.getLogger("app."+__name__)
+
+
+class Counter():
+    """ Monotonic count, optionally split by the value of one label. """
+    kind = 'counter'
+
+    def __init__(self, name:str, help:str, label:str=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: dict = {}  # label value -> count, key None without a label
+
+    def inc(self, key=None, amount:int=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, key=None) -> int:
+        return self.values.get(key, 0)
+
+    def snapshot(self):
+        if self.label is None:
+            return self.values.get(None, 0)
+        return {str(key): value for key, value in list(self.values.items())}
+
+    def render(self) -> list[str]:
+        if self.label is None:
+            return [f"{self.name} {self.values.get(None, 0)}"]
+        return [f'{self.name}{{{self.label}="{key}"}} {value}' for key, value in list(self.values.items())]
+
+
+class Gauge():
+    """ Value that goes up and down, the last one set is reported.  A gauge
+        given a function with set_function() reports what it returns when
+        the metrics are read instead. """
+    kind = 'gauge'
+
+    def __init__(self, name:str, help:str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.fnc: Callable[[], float] = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, fnc:Callable[[], float]):
+        self.fnc = fnc
+
+    def snapshot(self):
+        return self.fnc() if self.fnc is not None else self.value
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.snapshot()}"]
+
+
+class Histogram():
+    """ Distribution of observed values over fixed bucket upper bounds. """
+    kind = 'histogram'
+
+    def __init__(self, name:str, help:str, buckets:tuple[float, ...]=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q:float) -> float:
+        """ Upper bound of the bucket the q quantile falls in, None if empty. """
+        counts = list(self.counts)
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for idx, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[idx] if idx < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'sum': self.sum,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+    def render(self) -> list[str]:
+        lines = []
+        seen = 0
+        counts = list(self.counts)
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {seen}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {seen}")
+        return lines
+
+
+class Registry():
+    """ Named collection of metrics. """
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, help:str, label:str=None) -> Counter:
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name:str, help:str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name:str, help:str, buckets:tuple[float, ...]=TIME_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def snapshot(self) -> dict:
+        """ Current values of all metrics as plain data. """
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def render(self) -> str:
+        """ All metrics in the Prometheus text exposition format. """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class Timed():
+    """ Wraps fnc, observing the time each call takes in histogram. """
+    def __init__(self, fnc:Callable, histogram:Histogram):
+        self.fnc = fnc
+        self.histogram = histogram
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        result = self.fnc(*args)
+        self.histogram.observe(time.perf_counter() - start)
+        return result
+
+
+class MetricsServer():
+    """ Serves registry.render() at /metrics from a daemon thread.  Binds to
+        localhost unless another host is given. """
+    def __init__(self, registry:Registry, port:int, host:str='127.0.0.1'):
+        import http.server  # only the app serves metrics, keep it out of every import of metrics
+        registry_ = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics: " + format, *args)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join(2.0)
+
+
+REGISTRY = Registry()
+
+MESSAGES = REGISTRY.counter("cabinet_messages_total",
+                            "Data port messages handled, by type (None for dropped by the parser).", "type")
+FILTERED = REGISTRY.counter("cabinet_messages_filtered_total", "Messages dropped by a MsgHandler filter.", "type")
+COLLAPSED = REGISTRY.counter("cabinet_lctn_collapsed_total", "LCTNs dropped for a later one of the same tag in a batch.")
+INGEST_BATCH = REGISTRY.histogram("cabinet_ingest_batch_messages", "Messages drained from the data port per pass.",
+                                  buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+HANDLER_ERRORS = REGISTRY.counter("cabinet_handler_errors_total", "Message callbacks that raised.", "type")
+PARSE_SECONDS = REGISTRY.histogram("cabinet_parse_seconds", "Time to decode a data port message.")
+ZONE_UPDATE_SECONDS = REGISTRY.histogram("cabinet_zone_update_seconds", "Time spent in Zones.update_zones.")
+MATCH_SECONDS = REGISTRY.histogram("cabinet_match_seconds", "Time to match candidate tags to shelves.")
+CMD_QUEUE_DEPTH = REGISTRY.gauge("cabinet_command_queue_depth", "Parameter writes waiting to be sent.")
+CMD_IN_FLIGHT = REGISTRY.gauge("cabinet_commands_in_flight", "Commands sent and waiting for a response.")
+LED_RTT_SECONDS = REGISTRY.histogram("cabinet_led_round_trip_seconds",
+                                     "Time from sending an LED write to its response.")
+TAGS_TRACKED = REGISTRY.gauge("cabinet_tags_tracked", "Tags with location history.")
+TAGS_EVICTED = REGISTRY.counter("cabinet_tags_evicted_total", "Tags evicted, by reason.", "reason")
+TAG_STORE_BYTES = REGISTRY.gauge("cabinet_tag_store_bytes", "Bytes allocated for tag location history.")
+LOG_DROPPED = REGISTRY.counter("cabinet_log_records_dropped_total",
+                                  "Log records dropped, by reason (full queue or sampled).", "reason")
@@ -1,33 +1,255 @@
 
+import itertools
+import logging
+from typing import Callable, Iterable
 import net.geo_packet_handler as geo_packet_handler
+from fast_msg import LctnMsg, zone_name
+from metrics import MESSAGES, FILTERED, HANDLER_ERRORS, COLLAPSED
+
+PRUNE_MIN_SIZE = 1024  # IdleSampler tag count below which it never prunes
+SUBTYPED = {"SENS0"}  # message types dispatched on msg.sens_type as well
+
+logger = logging.getLogger("app."+__name__)
 
 
 class MsgHandler():
+    """ Dispatches messages to the callbacks subscribed to their type, or
+        for SENS0 their type and sensor type.  A type can have any number
+        of callbacks.  They run highest priority first, then in the order
+        they were registered.  A callback that raises is logged and does not
+        stop the others.  The callbacks of each (type, subtype) are compiled
+        into a flat tuple when they are registered, so dispatch is one or two
+        dict lookups and a loop. """
     def __init__(self):
-        self.lookup = {"SENS0": self._handle_sens0}
-        self.sens0_lookup = {}
+        self.subscribers = {}  # msg type -> subtype (None for all) -> [(priority, seq, callback)]
+        self.chains: dict[str, tuple] = {}  # msg type without subtype subscribers -> callbacks
+        self.sub_chains: dict[str, dict] = {}  # msg type -> subtype -> callbacks, None for other subtypes
+        self.seq = itertools.count()
+        self.filters = {}  # msg type -> list of predicates, all must pass
+        self.filtered = 0  # messages dropped by a filter
+        self.errors = 0  # callbacks that raised
+        self.batch_subscribers = {}  # msg type or (SENS0, subtype) -> [(priority, seq, callback)]
+        self.batch_chains: dict = {}  # msg type or (SENS0, subtype) -> batch callbacks
+
+    def register_msg_type(self, msg_type:str, callback_fnc:Callable, priority:int=0):
+        """ Call callback_fnc(msg) for every message of msg_type. """
+        self._subscribe(msg_type, None, callback_fnc, priority)
+
+    def register_sens0_type(self, sens_type:str, callback_fnc:Callable, priority:int=0):
+        """ Call callback_fnc(msg) for every SENS0 message of sens_type. """
+        self._subscribe("SENS0", sens_type, callback_fnc, priority)
+
+    def register_batch(self, msg_type:str, callback_fnc:Callable, subtype:str=None, priority:int=0):
+        """ Call callback_fnc(msgs) with lists of messages of msg_type (and
+            SENS0 subtype).  handle_messages passes each run of consecutive
+            such messages at once, after their per-message callbacks;
+            handle_message passes a list of one. """
+        key = (msg_type, subtype) if msg_type in SUBTYPED else msg_type
+        entries = self.batch_subscribers.setdefault(key, [])
+        entries.append((priority, next(self.seq), callback_fnc))
+        self.batch_chains[key] = _chain(entries)
 
-    def register_msg_type(self, msg_type:str, callback_fnc):
+    def unregister(self, msg_type:str, callback_fnc:Callable, subtype:str=None):
+        """ Remove a callback registered for msg_type (and subtype). """
+        entries = self.subscribers.get(msg_type, {}).get(subtype, [])
+        entries[:] = [entry for entry in entries if entry[2] != callback_fnc]
+        self._compile(msg_type)
+        key = (msg_type, subtype) if msg_type in SUBTYPED else msg_type
+        entries = [entry for entry in self.batch_subscribers.get(key, []) if entry[2] != callback_fnc]
+        if entries:
+            self.batch_subscribers[key] = entries
+            self.batch_chains[key] = _chain(entries)
+        else:
+            self.batch_subscribers.pop(key, None)
+            self.batch_chains.pop(key, None)
 
-        if msg_type in self.lookup:
-            del self.lookup[msg_type]
-            
-        self.lookup[msg_type] = callback_fnc
+    def _subscribe(self, msg_type:str, subtype:str, callback_fnc:Callable, priority:int):
+        subtypes = self.subscribers.setdefault(msg_type, {})
+        subtypes.setdefault(subtype, []).append((priority, next(self.seq), callback_fnc))
+        self._compile(msg_type)
 
-    def register_sens0_type(self, sens_type, callback_fnc):
-        
-        if sens_type in self.sens0_lookup:
-            del self.sens0_lookup[sens_type]
-            
-        self.sens0_lookup[sens_type] = callback_fnc
+    def _compile(self, msg_type:str):
+        """ Rebuild the callback tuples of msg_type. """
+        self.chains.pop(msg_type, None)
+        self.sub_chains.pop(msg_type, None)
+        subtypes = self.subscribers.get(msg_type, {})
+        everyone = subtypes.get(None, [])
+        if msg_type not in SUBTYPED:
+            if everyone:
+                self.chains[msg_type] = _chain(everyone)
+            return
+        table = {subtype: _chain(everyone + entries) for subtype, entries in subtypes.items() if subtype is not None}
+        table[None] = _chain(everyone)
+        self.sub_chains[msg_type] = table
+
+    def register_filter(self, msg_type:str, predicate_fnc):
+        """ Only dispatch messages of msg_type for which predicate_fnc(msg)
+            is True.  Filters run in the order they were registered. """
+        self.filters.setdefault(msg_type, []).append(predicate_fnc)
 
 
     def handle_message(self, msg:geo_packet_handler.Geomsg):
 
-        if msg.type in self.lookup:
-            self.lookup[msg.type](msg)
+        msg_type = msg.type
+        MESSAGES.inc(msg_type)
+        filters = self.filters.get(msg_type, None)
+        if filters is not None:
+            for predicate in filters:
+                if not predicate(msg):
+                    self.filtered += 1
+                    FILTERED.inc(msg_type)
+                    return
+        chain = self.chains.get(msg_type, None)
+        if chain is None:
+            table = self.sub_chains.get(msg_type, None)
+            chain = () if table is None else table.get(msg.sens_type, None) or table[None]
+        for callback in chain:
+            try:
+                callback(msg)
+            except Exception:
+                self._error(callback, msg_type)
+        if self.batch_chains:
+            key = (msg_type, msg.sens_type) if msg_type in SUBTYPED else msg_type
+            batch_chain = self.batch_chains.get(key, None)
+            if batch_chain is not None:
+                self._run_batch(batch_chain, [msg], msg_type)
+
+    def handle_messages(self, msgs:Iterable[geo_packet_handler.Geomsg]) -> int:
+        """ Dispatch a burst of messages in order, with the lookups done
+            once for the whole burst.  Consecutive messages with batch
+            callbacks are collected and passed to them as one list.
+            Returns the number of messages. """
+        chains = self.chains
+        sub_chains = self.sub_chains
+        batch_chains = self.batch_chains
+        filters_of = self.filters
+        count_type = MESSAGES.inc
+        count = 0
+        run_key = None
+        run = []
+        for msg in msgs:
+            count += 1
+            msg_type = msg.type
+            count_type(msg_type)
+            if batch_chains:
+                # Flush the run before the filters, they may depend on it
+                key = (msg_type, msg.sens_type) if msg_type in SUBTYPED else msg_type
+                if run and key != run_key:
+                    self._run_batch(batch_chains[run_key], run, run_key)
+                    run = []
+            filters = filters_of.get(msg_type, None)
+            if filters is not None:
+                passed = True
+                for predicate in filters:
+                    if not predicate(msg):
+                        passed = False
+                        break
+                if not passed:
+                    self.filtered += 1
+                    FILTERED.inc(msg_type)
+                    continue
+            if batch_chains and key in batch_chains:
+                run_key = key
+                run.append(msg)
+            chain = chains.get(msg_type, None)
+            if chain is None:
+                table = sub_chains.get(msg_type, None)
+                if table is None:
+                    continue
+                chain = table.get(msg.sens_type, None) or table[None]
+            for callback in chain:
+                try:
+                    callback(msg)
+                except Exception:
+                    self._error(callback, msg_type)
+        if run:
+            self._run_batch(batch_chains[run_key], run, run_key)
+        return count
+
+    def _run_batch(self, batch_chain:tuple, msgs:list, key):
+        for callback in batch_chain:
+            try:
+                callback(msgs)
+            except Exception:
+                self._error(callback, key)
+
+    def _error(self, callback:Callable, msg_type:str):
+        self.errors += 1
+        HANDLER_ERRORS.inc(msg_type)
+        logger.exception("Handler %r failed on a %s message", callback, msg_type)
+
+
+def _chain(entries:list) -> tuple:
+    """ Callbacks by priority, highest first, then registration order. """
+    return tuple(callback for _, _, callback in sorted(entries, key=lambda entry: (-entry[0], entry[1])))
+
+
+class ZoneAllowlist():
+    """ LCTN filter: pass only messages from the given zones. """
+    def __init__(self, zones:set[str]):
+        self.zones = frozenset(zones)
+
+    def __call__(self, msg) -> bool:
+        zone = msg.zone if isinstance(msg, LctnMsg) else zone_name(msg.fmsg[4])
+        return zone in self.zones
+
+
+class IdleSampler():
+    """ LCTN filter: pass everything while is_armed_fnc() is True, otherwise
+        pass at most one message per tag every interval_ms, so tag history
+        stays fresh without recording every sample while no shelf is waiting
+        for a tag. """
+    def __init__(self, is_armed_fnc, interval_ms:int):
+        self.is_armed = is_armed_fnc
+        self.interval_ms = interval_ms
+        self.last_ts: dict[int, int] = {}  # tagid -> ts of the last message passed
+        self.prune_size = PRUNE_MIN_SIZE  # prune last_ts when it grows past this
+
+    def __call__(self, msg) -> bool:
+        if self.is_armed():
+            return True
+        if isinstance(msg, LctnMsg):
+            tagid, ts = msg.tagid, msg.ts
+        else:
+            tagid, ts = int(msg.fmsg[2]), int(msg.fmsg[0])
+        last = self.last_ts.get(tagid, None)
+        if last is not None and 0 <= ts - last < self.interval_ms:
+            return False
+        self.last_ts[tagid] = ts
+        if len(self.last_ts) > self.prune_size:
+            self._prune(ts)
+        return True
+
+    def _prune(self, now:int):
+        """ Drop tags last passed an interval or more ago, they pass again
+            anyway.  The size to prune at next doubles what is left, so the
+            cost is amortized over the messages in between. """
+        interval_ms = self.interval_ms
+        self.last_ts = {tagid: ts for tagid, ts in self.last_ts.items() if 0 <= now - ts < interval_ms}
+        self.prune_size = max(PRUNE_MIN_SIZE, 2 * len(self.last_ts))
 
-    def _handle_sens0(self, msg:geo_packet_handler.Geomsg):
 
-        if msg.sens_type in self.sens0_lookup:
-            self.sens0_lookup[msg.sens_type](msg)
+def collapse_lctns(msgs:list) -> list:
+    """ Drop LCTNs superseded by a later LCTN of the same tag in msgs.  Only
+        LCTNs between the same two other messages are collapsed, so every
+        other message still sees the locations that came before it.  The
+        kept LCTN takes the place of the latest sample. """
+    out = []
+    latest: dict[int, int] = {}  # tagid -> index in out of its LCTN since the last other message
+    superseded = 0
+    for msg in msgs:
+        if msg.type != "LCTN":
+            latest.clear()
+            out.append(msg)
+            continue
+        tagid = msg.tagid if isinstance(msg, LctnMsg) else int(msg.fmsg[2])
+        idx = latest.get(tagid, None)
+        if idx is not None:
+            out[idx] = None
+            superseded += 1
+        latest[tagid] = len(out)
+        out.append(msg)
+    if not superseded:
+        return msgs
+    COLLAPSED.inc(amount=superseded)
+    return [msg for msg in out if msg is not None]
@@ -0,0 +1,68 @@
+""" Builds the message processing pipeline: the Cluster of cabinets, the
+    Zones tracking tags and the MsgHandler that routes LCTN and LTSW
+    messages to them.  Used by main for a single process and by each shard
+    worker in sharded mode. """
+
+import logging
+import time
+from typing import Callable, NamedTuple
+import msg_handler
+from cabinet import Cluster
+from zones import Zones
+from tags import Tags, DWELL_BAND
+from metrics import HANDLER_ERRORS
+
+logger = logging.getLogger("app."+__name__)
+
+
+class Pipeline(NamedTuple):
+    handler: msg_handler.MsgHandler
+    cluster: Cluster
+    zones: Zones
+
+
+def build_pipeline(config:dict, send_fnc:Callable, clock:Callable[[], float]=time.monotonic) -> Pipeline:
+    """ Create the cabinets in config and wire them to a MsgHandler.
+        send_fnc follows the fnc(msg, callback) scheme. See geo_cmd.Connect.send().
+        clock drives the cluster's timers, see Cluster. """
+    handler = msg_handler.MsgHandler()
+
+    # create Cluster for Cabinet objects
+    cluster = Cluster(config, send_fnc, clock)
+
+    # Height band of the dwell detector, see TagStore.update_dwell
+    tags = Tags(dwell_band=float(config.get('dwell_band', DWELL_BAND)))
+    # Tag eviction, see Zones.  Off unless configured.
+    ttl = config.get('tag_ttl_s', None)
+    exit_ttl = config.get('exit_zone_ttl_s', 0)
+    zones = Zones(tags, ttl_ms=int(float(ttl) * 1000) if ttl is not None else None,
+                  max_tags=config.get('max_tags', None),
+                  exit_zones=config.get('exit_zones', None) or (),
+                  exit_ttl_ms=int(float(exit_ttl) * 1000))
+    for cabinet in cluster.cabinets.values():
+        zones.add_cabinet(cabinet, cabinet.zone)
+
+    def add_ltsw_msgs(msgs):
+        """ Shelves switched, match the tags already in the zone of each
+            cabinet switched. """
+        for cabinet in cluster.add_ltsw_msgs(msgs):
+            try:
+                zones.assign_zone_tags(cabinet.zone)
+            except Exception:
+                HANDLER_ERRORS.inc("LTSW")
+                logger.exception("Matching the tags of zone %s failed", cabinet.zone)
+
+    # Batch callbacks get each run of consecutive messages of their type
+    handler.register_batch("SENS0", add_ltsw_msgs, subtype="LTSW")
+
+    # handler.register_msg_type("LOCMON", zones.add_locmon)
+    handler.register_batch("LCTN", zones.add_lctns)
+
+    if config.get('drop_lctn_outside_cabinet_zones', False):
+        handler.register_filter("LCTN", msg_handler.ZoneAllowlist(cluster.get_zones()))
+    # Record every LCTN only while a shelf is waiting for a tag
+    idle_interval = config.get('idle_lctn_interval_ms', None)
+    if idle_interval is not None:
+        handler.register_filter("LCTN", msg_handler.IdleSampler(cluster.is_armed, int(idle_interval)))
+
+    return Pipeline(handler, cluster, zones)
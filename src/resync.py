@@ -0,0 +1,124 @@
+""" Bulk state resync of the cabinet controllers after a (re)connect.  The
+    switch and LED state queries of every cabinet are queued and sent with
+    up to max_in_flight of them waiting for a response, instead of one
+    controller at a time.  Each response goes to the callback given with
+    its query; the cabinets reconcile and queue only the corrections.  A
+    query not answered within timeout seconds frees its slot and is sent
+    again, up to MAX_RETRIES times. """
+
+import collections
+import itertools
+import logging
+import time
+from typing import Callable
+from geotraqr import geo_cmd
+
+
+DEFAULT_MAX_IN_FLIGHT = 32  # state queries waiting for a response
+DEFAULT_TIMEOUT = 2.0  # seconds to wait for a response before the query is resent
+MAX_RETRIES = 2  # resends of a query that was not answered
+
+logger = logging.getLogger("app."+__name__)
+
+
+class Resync():
+    """ One resync round.  add() the queries, then start().  Responses
+        keep the window full until every query is answered or given up.
+        poll() expires the queries past their deadline and is called once
+        per pass of the main loop. """
+    def __init__(self, send_fnc:Callable[[str, Callable[[geo_cmd.Message], None]], None],
+                 max_in_flight:int=DEFAULT_MAX_IN_FLIGHT, timeout:float=DEFAULT_TIMEOUT,
+                 clock:Callable[[], float]=time.monotonic):
+        """ send_fnc follows the fnc(msg, callback) scheme. See geo_cmd.Connect.send(). """
+        self.send_fnc = send_fnc
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.clock = clock
+        self.queue = collections.deque()  # (msg, callback, resends) not sent yet
+        self.outstanding: dict[int, tuple[float, str, Callable, int]] = {}  # seq -> (deadline, msg, callback, resends)
+        self.seq = itertools.count()
+        self.answered = 0
+        self.failed = 0  # queries answered with an error or never answered
+        self.timed_out = 0  # queries not answered in time, resent or given up
+        self.started = None
+        self.elapsed = None  # seconds from start() to the last response
+
+    def add(self, msg:str, callback_fnc:Callable[[geo_cmd.Message], None]):
+        self.queue.append((msg, callback_fnc, 0))
+
+    @property
+    def in_flight(self) -> int:
+        """ Number of queries sent and waiting for a response. """
+        return len(self.outstanding)
+
+    def start(self):
+        self.started = self.clock()
+        logger.info("Resync of %s queries started", len(self.queue))
+        self.pump()
+
+    def pump(self):
+        """ Send queued queries while the window has room. """
+        while self.queue and len(self.outstanding) < self.max_in_flight:
+            msg, callback_fnc, resends = self.queue.popleft()
+            seq = next(self.seq)
+            self.outstanding[seq] = (self.clock() + self.timeout, msg, callback_fnc, resends)
+            logger.debug("Send: %s", msg)
+            self.send_fnc(msg, self._make_callback(seq, callback_fnc))
+
+    def poll(self):
+        """ Free the slots of queries past their deadline and send them
+            again, or give up on them after MAX_RETRIES resends.  A late
+            response to an expired query is ignored. """
+        if not self.outstanding:
+            return
+        now = self.clock()
+        expired = [seq for seq, (deadline, _, _, _) in self.outstanding.items() if deadline <= now]
+        for seq in expired:
+            _, msg, callback_fnc, resends = self.outstanding.pop(seq)
+            self.timed_out += 1
+            if resends < MAX_RETRIES:
+                logger.warning("Resync query not answered in %.1f s, resending: %s", self.timeout, msg.strip())
+                self.queue.appendleft((msg, callback_fnc, resends + 1))
+            else:
+                logger.error("Giving up on resync query: %s", msg.strip())
+                self.failed += 1
+        if expired:
+            self.pump()
+            self._check_done()
+
+    def next_timeout(self) -> float:
+        """ Seconds until the first query in flight times out, None if
+            none are in flight. """
+        if not self.outstanding:
+            return None
+        deadline = min(deadline for deadline, _, _, _ in self.outstanding.values())
+        return max(deadline - self.clock(), 0.0)
+
+    def done(self) -> bool:
+        return not self.queue and not self.outstanding
+
+    def cancel(self):
+        """ Drop the round, the command connection was lost. """
+        self.queue.clear()
+        self.outstanding.clear()
+
+    def _check_done(self):
+        if self.done():
+            self.elapsed = self.clock() - self.started
+            logger.info("Resync done: %s responses, %s failed, %.2f s",
+                        self.answered, self.failed, self.elapsed)
+
+    def _make_callback(self, seq:int, callback_fnc:Callable[[geo_cmd.Message], None]):
+        def callback(msg:geo_cmd.Message):
+            if self.outstanding.pop(seq, None) is None:
+                return  # timed out or cancelled
+            self.answered += 1
+            if msg.err == "ERROR":
+                self.failed += 1
+            try:
+                callback_fnc(msg)
+            except Exception:
+                logger.exception("Resync response handler failed")
+            self.pump()
+            self._check_done()
+        return callback
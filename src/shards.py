@@ -0,0 +1,331 @@
+""" Sharded mode for large deployments.  Cabinets are partitioned by zone
+    across worker processes, each running its own pipeline (Cluster, Zones
+    and tag history for its zones only).  The main process decodes just
+    enough of each message to find its shard (zone for LCTN, controller id
+    for LTSW), batches the raw lines per shard and forwards the commands the
+    shards produce to the GeoTraqr.
+
+    Tags are routed by zone name, so a zone and every tag seen in it live in
+    exactly one shard.  LCTNs from zones without a cabinet are dropped.
+
+    Each shard sends its commands back on its own pipe.  The main loop
+    waits on the pipes' read ends together with the GeoTraqr sockets, so a
+    command is relayed as soon as the shard produces it. """
+
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import queue
+import time
+from typing import Callable
+from net.geo_packet_handler import Geomsg
+from fast_msg import FastMsgFactory, LctnMsg, LtswMsg, zone_name
+from geometry import ShelfGeometry
+import msg_handler
+from pipeline import build_pipeline
+from cabinet import set_ui_publisher
+from spatial import GridIndex
+from ui_publisher import UiPublisher
+from log_queue import load_logconfig, start_queue_logging
+
+
+STOP = None  # sent to a shard's queue to have it save its snapshot and end
+
+logger = logging.getLogger("app."+__name__)
+
+
+def partition_zones(config:dict, num_shards:int) -> dict[str, int]:
+    """ Assign each cabinet zone to a shard, round robin over the sorted
+        zone names so every process computes the same partition. """
+    zones = sorted({cabinet['zone'] for cabinet in config.get('cabinets', [])})
+    return {zone: idx % num_shards for idx, zone in enumerate(zones)}
+
+
+def shard_config(config:dict, zones:set[str], shard:int=None) -> dict:
+    """ Copy of config with only the cabinets in zones.  Each shard keeps
+        its own snapshot file, named after the configured one. """
+    config = dict(config)
+    config['cabinets'] = [cabinet for cabinet in config.get('cabinets', []) if cabinet['zone'] in zones]
+    if shard is not None and config.get('snapshot_file', None):
+        config['snapshot_file'] = f"{config['snapshot_file']}.shard{shard}"
+    return config
+
+
+class RouteMsg():
+    """ A data port line decoded only as far as routing needs: its type and
+        the shards it goes to.  The shard decodes the rest. """
+    __slots__ = ('msg', 'type', 'sens_type', 'shards')
+
+    def __init__(self, msg:str, msg_type:str, sens_type:str, shards:tuple):
+        self.msg = msg
+        self.type = msg_type
+        self.sens_type = sens_type
+        self.shards = shards
+
+
+class ShardResponse():
+    """ Command response handed back to a shard, in place of geo_cmd.Message. """
+    __slots__ = ('err', 'rspns')
+
+    def __init__(self, err, rspns):
+        self.err = err
+        self.rspns = rspns
+
+
+def setup_worker_logging(config:dict):
+    """ Configure logging in a shard process as main does.  A spawned
+        process starts with none, a forked one with the parent's queue
+        handlers but not the threads that write their records out.
+        Returns the QueueLogging to stop, None if it is off. """
+    try:
+        load_logconfig()
+    except (OSError, ValueError) as e:
+        logger.warning("Shard keeps the inherited logging, %s", e)
+    return start_queue_logging(config)
+
+
+def shard_worker(config:dict, shard:int, in_queue, out_conn):
+    """ Worker process main.  Runs a full pipeline over the raw lines it is
+        sent.  in_queue carries lists of items:
+            ('msg', raw line)
+            ('rsp', command id, err, rspns) response to a command it sent
+            ('reset',) the command connection was lost
+            ('resync',) query the controllers' switch and LED states
+            ('sync',) reply ('sync', shard) once everything before is handled
+        out_conn, the write end of a pipe, gets ('cmd', shard, command id,
+        msg) for each command. """
+    queue_logging = setup_worker_logging(config)
+    callbacks = {}
+    ids = itertools.count()
+
+    def send(msg, callback=None):
+        cmd_id = None
+        if callback is not None:
+            cmd_id = next(ids)
+            callbacks[cmd_id] = callback
+        out_conn.send(('cmd', shard, cmd_id, msg))
+
+    ui_url = config.get('ui', {}).get('server_address', None)
+    if ui_url:
+        publisher = UiPublisher(ui_url)
+        publisher.start()
+        set_ui_publisher(publisher)
+
+    handler, cluster, _ = build_pipeline(config, send)
+    factory = FastMsgFactory()
+    while True:
+        try:
+            batch = in_queue.get(timeout=cluster.next_timeout())
+        except queue.Empty:
+            batch = ()
+        if batch is STOP:
+            cluster.save_snapshot()
+            if queue_logging is not None:
+                queue_logging.stop()
+            return
+        msgs = []  # consecutive messages are handled as one batch
+        for item in batch:
+            kind = item[0]
+            if kind == 'msg':
+                msgs.append(factory(item[1]))
+                continue
+            if msgs:
+                handler.handle_messages(msgs)
+                msgs = []
+            if kind == 'rsp':
+                callback = callbacks.pop(item[1], None)
+                if callback is not None:
+                    callback(ShardResponse(item[2], item[3]))
+            elif kind == 'reset':
+                callbacks.clear()
+                cluster.reset_commands()
+            elif kind == 'resync':
+                cluster.request_states()
+            elif kind == 'sync':
+                cluster.poll()
+                out_conn.send(('sync', shard))
+        if msgs:
+            handler.handle_messages(msgs)
+        cluster.poll()
+
+
+class ShardedCluster():
+    """ Routes messages to shard worker processes and relays their commands.
+        Use handler for the MsgHandler to feed, and call poll() once per
+        main loop pass. """
+    def __init__(self, config:dict, send_fnc:Callable, num_shards:int, context=None):
+        """ send_fnc follows the fnc(msg, callback) scheme. See geo_cmd.Connect.send(). """
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1.")
+        context = context or multiprocessing.get_context()
+        self.send_fnc = send_fnc
+        self.num_shards = num_shards
+        self.zone_shard = partition_zones(config, num_shards)
+        self.controller_shard = {cabinet['cabinet_controller_id']: self.zone_shard[cabinet['zone']]
+                                 for cabinet in config.get('cabinets', [])}
+        self.footprints = GridIndex()  # shard of each cabinet footprint by x-y location
+        for cabinet in config.get('cabinets', []):
+            xy_box = ShelfGeometry.from_config(cabinet).xy_box
+            if xy_box is not None:
+                self.footprints.insert(xy_box, self.zone_shard[cabinet['zone']])
+        self.fallback = Geomsg
+        self.in_queues = [context.Queue() for _ in range(num_shards)]
+        self.out_conns = []  # read end of each shard's command pipe
+        self.batches = [[] for _ in range(num_shards)]
+        self.unrouted = 0  # messages for no shard
+        self.procs = []
+        for shard in range(num_shards):
+            zones = {zone for zone, idx in self.zone_shard.items() if idx == shard}
+            reader, writer = context.Pipe(duplex=False)
+            self.out_conns.append(reader)
+            self.procs.append(context.Process(target=shard_worker, name=f"shard-{shard}", daemon=True,
+                                              args=(shard_config(config, zones, shard), shard,
+                                                    self.in_queues[shard], writer)))
+        self.handler = msg_handler.MsgHandler()
+        self.handler.register_msg_type("LCTN", self.add_lctn)
+        self.handler.register_sens0_type("LTSW", self.add_ltsw_msg)
+
+    def start(self):
+        for proc in self.procs:
+            proc.start()
+
+    def stop(self, timeout:float=2.0):
+        """ Have every shard save its snapshot and end, then wait for them. """
+        self.poll()
+        for in_queue in self.in_queues:
+            in_queue.put(STOP)
+        for proc in self.procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+
+    def factory(self, raw):
+        """ Message factory for the receiver parser, in place of
+            FastMsgFactory.  Splits off only the fields that pick the shard:
+            the zone of an LCTN, plus its x and y when cabinets have a
+            footprint, and the controller id of an LTSW. """
+        msg = raw if isinstance(raw, str) else raw.decode('ascii', 'replace')
+        head = msg.split(',', 5)  # ts, type, id, name or LTSW, zone or shelf, rest
+        if len(head) == 6:
+            msg_type = head[1].strip()
+            try:
+                if msg_type == "LCTN":
+                    x = y = None
+                    if self.footprints.cells:
+                        _, x, y, _ = msg.rsplit(',', 3)  # ..., locx, locy, locz
+                        x, y = float(x), float(y)
+                    return RouteMsg(msg, "LCTN", None, self._lctn_shards(zone_name(head[4]), x, y))
+                if msg_type == "SENS0" and head[3].strip() == "LTSW":
+                    shard = self.controller_shard.get(int(head[2]), None)
+                    return RouteMsg(msg, "SENS0", "LTSW", () if shard is None else (shard,))
+            except ValueError:
+                pass  # let Geomsg deal with malformed lines
+        return self.fallback(raw)
+
+    def _lctn_shards(self, zone:str, x:float, y:float) -> tuple:
+        """ Shards of the cabinets whose footprint contains x, y, or if
+            none, the shard of the zone. """
+        if x is not None:
+            shards = self.footprints.query(x, y)
+            if shards:
+                return tuple(dict.fromkeys(shards))
+        shard = self.zone_shard.get(zone, None)
+        return () if shard is None else (shard,)
+
+    def add_lctn(self, msg):
+        if isinstance(msg, RouteMsg):
+            shards = msg.shards
+        elif isinstance(msg, LctnMsg):
+            shards = self._lctn_shards(msg.zone, msg.x, msg.y)
+        else:
+            shards = self._lctn_shards(zone_name(msg.fmsg[4]), None, None)
+        self._route(shards, msg)
+
+    def add_ltsw_msg(self, msg):
+        if isinstance(msg, RouteMsg):
+            shards = msg.shards
+        else:
+            controller_id = msg.controller_id if isinstance(msg, LtswMsg) else int(msg.fmsg[2])
+            shard = self.controller_shard.get(controller_id, None)
+            shards = () if shard is None else (shard,)
+        self._route(shards, msg)
+
+    def _route(self, shards:tuple, msg):
+        if not shards:
+            self.unrouted += 1
+            return
+        for shard in shards:
+            self.batches[shard].append(('msg', msg.msg))
+
+    def poll(self):
+        """ Send the batched messages to the shards and relay the commands
+            they produced. """
+        for shard, batch in enumerate(self.batches):
+            if batch:
+                self.in_queues[shard].put(batch)
+                self.batches[shard] = []
+        for conn in list(self.out_conns):
+            try:
+                while conn.poll():
+                    item = conn.recv()
+                    if item[0] == 'cmd':
+                        self._send(*item[1:])
+            except EOFError:
+                self._lost(conn)
+
+    def _send(self, shard:int, cmd_id:int, msg:str):
+        if cmd_id is None:
+            self.send_fnc(msg, None)
+            return
+        def relay_response(rsp):
+            self.in_queues[shard].put([('rsp', cmd_id, rsp.err, rsp.rspns)])
+        self.send_fnc(msg, relay_response)
+
+    def _lost(self, conn):
+        """ A shard process ended, its pipe would read as ready forever. """
+        logger.error("A shard process exited, its commands are no longer relayed")
+        self.out_conns.remove(conn)
+        conn.close()
+
+    def selectables(self) -> list:
+        """ The shards' command pipes, for the main loop to wait on. """
+        return self.out_conns
+
+    def next_timeout(self) -> float:
+        """ The timers run in the shards, and their commands wake the main
+            loop through the pipes. """
+        return None
+
+    def reset_commands(self):
+        """ The command connection was lost, responses will not arrive. """
+        for in_queue in self.in_queues:
+            in_queue.put([('reset',)])
+
+    def request_states(self):
+        """ Have every shard query its controllers' states. """
+        for in_queue in self.in_queues:
+            in_queue.put([('resync',)])
+
+    def sync(self, timeout:float=10.0):
+        """ Wait until every shard has handled everything sent so far,
+            relaying commands meanwhile. """
+        self.poll()
+        for in_queue in self.in_queues:
+            in_queue.put([('sync',)])
+        waiting = set(range(self.num_shards))
+        deadline = time.monotonic() + timeout
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Shards {sorted(waiting)} did not sync.")
+            for conn in multiprocessing.connection.wait(self.out_conns, remaining):
+                try:
+                    item = conn.recv()
+                except EOFError:
+                    self._lost(conn)
+                    continue
+                if item[0] == 'cmd':
+                    self._send(*item[1:])
+                else:
+                    waiting.discard(item[1])
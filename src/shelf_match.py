@@ -0,0 +1,90 @@
+""" Match tags to shelves.  Builds a tag x shelf distance matrix in one
+    vectorized step and solves the assignment globally, so the result does
+    not depend on the order the shelves were switched or the tags reported. """
+
+import numpy as np
+
+
+def distance_matrix(tag_heights, shelf_heights) -> np.ndarray:
+    """ Vertical distance of every tag (rows) to every shelf (columns). """
+    tag_heights = np.asarray(tag_heights, dtype=np.float64)
+    shelf_heights = np.asarray(shelf_heights, dtype=np.float64)
+    return np.abs(tag_heights[:, None] - shelf_heights[None, :])
+
+
+def match_greedy(dist:np.ndarray, threshold:float) -> list[tuple[int, int]]:
+    """ Assign the closest (tag, shelf) pair first, then the next closest
+        among the remaining tags and shelves.  Pairs further apart than
+        threshold are never assigned.  Returns (row, col) pairs. """
+    rows, cols = np.nonzero(dist <= threshold)
+    order = np.argsort(dist[rows, cols], kind='stable')
+    used_rows, used_cols = set(), set()
+    pairs = []
+    for idx in order:
+        row, col = int(rows[idx]), int(cols[idx])
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        pairs.append((row, col))
+    return pairs
+
+
+def match_hungarian(dist:np.ndarray, threshold:float) -> list[tuple[int, int]]:
+    """ Minimum total distance assignment (Hungarian algorithm).  Pairs
+        further apart than threshold are never assigned.  Returns (row, col)
+        pairs. """
+    n_rows, n_cols = dist.shape
+    if n_rows == 0 or n_cols == 0:
+        return []
+    transposed = n_rows > n_cols
+    cost = dist.T if transposed else dist
+    # Out of range pairs get a cost larger than any in range assignment
+    big = threshold * (min(cost.shape) + 1) + 1.0
+    cost = np.where(cost <= threshold, cost, big)
+    n, m = cost.shape  # n <= m
+
+    # Potentials formulation, 1 based with a dummy column 0
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)  # column -> row assigned
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    pairs = []
+    for col in range(1, m + 1):
+        row = int(p[col])
+        if row == 0 or cost[row - 1, col - 1] > threshold:
+            continue
+        pair = (col - 1, row - 1) if transposed else (row - 1, col - 1)
+        pairs.append(pair)
+    return sorted(pairs)
+
+
+MATCHERS = {'greedy': match_greedy,
+            'hungarian': match_hungarian}
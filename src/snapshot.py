@@ -0,0 +1,81 @@
+""" Persistent snapshots of the shelf state for a fast warm restart.
+
+    The Cluster's tag assignments, switch states and pending switch events
+    are written to a JSON file every few seconds when they changed, and
+    loaded back at startup.  A write goes to a temporary file in the same
+    directory which then replaces the snapshot, so a crash leaves either
+    the old or the new snapshot, never a partial one:
+        {"version": 1, "saved": <epoch seconds>,
+         "cabinets": {"<controller id>": <Cabinet.get_state()>}}
+"""
+
+import json
+import logging
+import os
+import pathlib
+import time
+from typing import Callable
+
+SNAPSHOT_VERSION = 1
+DEFAULT_INTERVAL = 5.0  # seconds between checks for a changed state
+
+logger = logging.getLogger("app."+__name__)
+
+
+def save_snapshot(path, cabinets:dict):
+    """ Atomically replace the snapshot at path. """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f_out:
+        json.dump({'version': SNAPSHOT_VERSION, 'saved': time.time(), 'cabinets': cabinets}, f_out)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    os.replace(tmp, path)
+
+
+def load_snapshot(path) -> dict:
+    """ Get the cabinet states of the snapshot at path, an empty dict if
+        there is none or it cannot be read. """
+    try:
+        with open(pathlib.Path(path)) as f_in:
+            data = json.load(f_in)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return {}
+    if not isinstance(data, dict) or data.get('version', None) != SNAPSHOT_VERSION:
+        logger.warning("Ignoring snapshot %s with unknown version", path)
+        return {}
+    return data.get('cabinets', {})
+
+
+class SnapshotWriter():
+    """ Saves a state to path at most every interval seconds, and only if it
+        changed since the last save. """
+    def __init__(self, path, interval:float=DEFAULT_INTERVAL, clock:Callable[[], float]=time.monotonic):
+        self.path = pathlib.Path(path)
+        self.interval = interval
+        self.clock = clock
+        self.next_check = clock() + interval
+        self.last_state = None
+        self.saves = 0
+
+    def due(self) -> bool:
+        return self.clock() >= self.next_check
+
+    def save(self, state:dict, force:bool=False) -> bool:
+        """ Write state unless it equals the last one written.  Returns
+            True if the file was written. """
+        self.next_check = self.clock() + self.interval
+        if state == self.last_state and not force:
+            return False
+        try:
+            save_snapshot(self.path, state)
+        except OSError as e:
+            logger.error("Could not save snapshot %s: %s", self.path, e)
+            return False
+        self.last_state = state
+        self.saves += 1
+        return True
@@ -0,0 +1,43 @@
+""" Uniform grid spatial index.  Maps x-y boxes (cabinet footprints) to the
+    grid cells they cover so the boxes near a point are found with a single
+    dict lookup instead of a scan over every box. """
+
+import math
+
+
+DEFAULT_CELL_SIZE = 4.0  # feet, about one cabinet footprint with its margin
+
+
+class GridIndex():
+    """ Index of items by x-y box on a uniform grid.  An item is stored in
+        every cell its box overlaps.  Querying a point looks up one cell and
+        checks only the items stored there. """
+    def __init__(self, cell_size:float=DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive.")
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], tuple] = {}  # (i, j) -> ((box, item), ...)
+
+    def _cell(self, x:float, y:float) -> tuple[int, int]:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, box:tuple[float, float, float, float], item):
+        """ Add an item covering box = (xmin, xmax, ymin, ymax). """
+        xmin, xmax, ymin, ymax = box
+        i0, j0 = self._cell(xmin, ymin)
+        i1, j1 = self._cell(xmax, ymax)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self.cells[(i, j)] = self.cells.get((i, j), ()) + ((box, item),)
+
+    def query(self, x:float, y:float) -> list:
+        """ Get the items whose box contains the point. """
+        entries = self.cells.get(self._cell(x, y), None)
+        if entries is None:
+            return []
+        return [item for (xmin, xmax, ymin, ymax), item in entries
+                if xmin <= x <= xmax and ymin <= y <= ymax]
+
+    def __len__(self) -> int:
+        """ Number of occupied cells. """
+        return len(self.cells)
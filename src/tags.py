@@ -1,109 +1,458 @@
 """ Create and manage Tag class """
 
 from net.geo_packet_handler import Geomsg
-from collections import deque
+from fast_msg import LctnMsg, zone_name
 import logging
+import math
+import sys
+import numpy as np
 
 
 MAX_LOC_BUFF_LEN = 10
+INITIAL_TAG_CAPACITY = 256
 
+# Height filter tuning (feet^2).  Process noise is how much a tag's height
+# is expected to drift between samples, measurement noise is the RTLS z jitter.
+HEIGHT_FILTER_PROCESS_NOISE = 0.01
+HEIGHT_FILTER_MEASUREMENT_NOISE = 0.25
 
+# Dwell detection.  A run of samples whose height stays within DWELL_BAND
+# (feet) of the run's first sample counts as the tag resting at one height.
+DWELL_BAND = 0.3
+
+# Column name -> dtype.  Zone names are interned and stored as int codes.
+FIELDS = {'ts': np.int64,
+          'x': np.float64,
+          'y': np.float64,
+          'z': np.float64,
+          'zone': np.int32,
+          'motion': np.bool_}
+FIELD_INDEX = {name: idx for idx, name in enumerate(FIELDS)}  # position in a sample tuple
+EMPTY_SAMPLE = (0, 0.0, 0.0, 0.0, '', False)
+
+FLUSH_SAMPLES = 1024  # samples queued before they are written to the arrays
+SCALAR_FLUSH_SAMPLES = 8  # at most this many are written one by one
+PENDING_WIDTH = 1 + len(FIELDS)  # slot in the flattened arrays, then the sample
+
+LIST_SLOT_BYTES = 8  # a pointer in a Python list
+FLOAT_BYTES = sys.getsizeof(0.0)
+
+
+class TagStore():
+    """ Columnar ring-buffer storage for tag location history.  One
+        preallocated NumPy array per field with a row per tag and a fixed
+        history depth.  A row has one write head and fill count for all its
+        fields.
+
+        Samples are not written to the arrays one at a time.  Each row keeps
+        its latest sample as a tuple, which is what the message path reads,
+        and samples are queued and written with one assignment per field
+        once FLUSH_SAMPLES are waiting or older history is read.  The rest
+        of the per-row state (head, count, height filter and dwell state) is
+        also used one row at a time, so it is kept in plain lists, which
+        index several times faster than NumPy scalars. """
+    def __init__(self, depth:int=MAX_LOC_BUFF_LEN, capacity:int=INITIAL_TAG_CAPACITY,
+                 dwell_band:float=DWELL_BAND):
+        self.depth = depth
+        self.dwell_band = dwell_band
+        self.capacity = capacity
+        self.rows: dict[int, int] = {}  # tagid -> row
+        self.free_rows: list[int] = []  # rows of removed tags, reused first
+        self.data = {name: np.zeros((capacity, depth), dtype=dtype) for name, dtype in FIELDS.items()}
+        self.head = [0] * capacity  # next history slot written in each row
+        self.count = [0] * capacity  # samples in each row's history
+        self.last: list[tuple] = [None] * capacity  # latest (ts, x, y, z, zone, motion) of each row
+        self.pending: list = []  # flat (slot, ts, x, y, z, zone, motion) of samples not yet in the arrays
+        self.zone_names: list[str] = []  # zone code -> zone name
+        self.zone_codes: dict[str, int] = {}  # zone name -> zone code
+        # Incremental height filter state, NaN until the first sample
+        self.filt_z = [math.nan] * capacity
+        self.filt_p = [0.0] * capacity
+        # Incremental dwell state: height and length of the current in-band
+        # run, and ts of the first sample of the current still (no motion) run
+        self.run_z = [0.0] * capacity
+        self.run_len = [0] * capacity
+        self.still_since = [-1] * capacity
+
+    def add_tag(self, tagid:int) -> int:
+        """ Get the row for a tagid, allocating one if the tag is new. """
+        row = self.rows.get(tagid, None)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = len(self.rows)
+                if row >= self.capacity:
+                    self._grow()
+            self.rows[tagid] = row
+        return row
+
+    def remove_tag(self, tagid:int):
+        """ Free the row of a tag for reuse.  Views of the row must not be
+            used afterwards. """
+        row = self.rows.pop(tagid, None)
+        if row is None:
+            return
+        self.head[row] = 0
+        self.count[row] = 0
+        self.last[row] = None
+        self.filt_z[row] = math.nan
+        self.filt_p[row] = 0.0
+        self.run_len[row] = 0
+        self.still_since[row] = -1
+        self.free_rows.append(row)
+
+    def row_nbytes(self) -> int:
+        """ Bytes of storage per row: the history arrays, a list slot per
+            row state value, the latest sample tuple with its ts, x, y and z,
+            and the filter and dwell floats. """
+        nbytes = sum(np.dtype(dtype).itemsize for dtype in FIELDS.values()) * self.depth
+        nbytes += 8 * LIST_SLOT_BYTES  # head, count, last, filt_z, filt_p, run_z, run_len, still_since
+        nbytes += sys.getsizeof(EMPTY_SAMPLE) + 4 * FLOAT_BYTES
+        return nbytes + 3 * FLOAT_BYTES
+
+    def nbytes(self) -> int:
+        """ Bytes of storage allocated, used rows or not. """
+        return self.row_nbytes() * self.capacity
+
+    def _grow(self):
+        """ Double the number of rows. """
+        added = self.capacity
+        for name in FIELDS:
+            data = np.zeros((self.capacity + added, self.depth), dtype=self.data[name].dtype)
+            data[:self.capacity] = self.data[name]
+            self.data[name] = data
+        self.head.extend([0] * added)
+        self.count.extend([0] * added)
+        self.last.extend([None] * added)
+        self.filt_z.extend([math.nan] * added)
+        self.filt_p.extend([0.0] * added)
+        self.run_z.extend([0.0] * added)
+        self.run_len.extend([0] * added)
+        self.still_since.extend([-1] * added)
+        self.capacity += added
+
+    def zone_code(self, zone:str) -> int:
+        """ Intern a zone name and return its code. """
+        code = self.zone_codes.get(zone, None)
+        if code is None:
+            code = len(self.zone_names)
+            self.zone_names.append(zone)
+            self.zone_codes[zone] = code
+        return code
+
+    def _write(self, row:int, ts:int, x:float, y:float, z:float, zone:str, motion:bool):
+        """ Queue a sample for the head of a row and keep it as the latest. """
+        pos = self.head[row]
+        self.last[row] = (ts, x, y, z, zone, motion)
+        self.pending.extend((row * self.depth + pos, ts, x, y, z, zone, motion))
+        self.head[row] = (pos + 1) % self.depth
+        if self.count[row] < self.depth:
+            self.count[row] += 1
+        if len(self.pending) >= FLUSH_SAMPLES * PENDING_WIDTH:
+            self.flush()
+
+    def flush(self):
+        """ Write the queued samples to the arrays, with one assignment per
+            field.  A slot queued more than once keeps its last sample.
+            Samples queued for a row that was removed since land beyond the
+            new tag's count, or are overwritten by its later samples. """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        if len(pending) <= SCALAR_FLUSH_SAMPLES * PENDING_WIDTH:
+            # Too few for the vectorized pass to pay off, e.g. a history
+            # read right after a sample
+            data = self.data
+            for idx in range(0, len(pending), PENDING_WIDTH):
+                slot, ts, x, y, z, zone, motion = pending[idx:idx + PENDING_WIDTH]
+                row, pos = divmod(slot, self.depth)
+                data['ts'][row, pos] = ts
+                data['x'][row, pos] = x
+                data['y'][row, pos] = y
+                data['z'][row, pos] = z
+                data['zone'][row, pos] = self.zone_code(zone)
+                data['motion'][row, pos] = motion
+            return
+        slots = pending[0::PENDING_WIDTH]
+        keep = None
+        if len(set(slots)) < len(slots):
+            last_of = {slot: idx for idx, slot in enumerate(slots)}
+            keep = np.fromiter(last_of.values(), dtype=np.intp, count=len(last_of))
+        slots = np.array(slots, dtype=np.intp)
+        if keep is not None:
+            slots = slots[keep]
+        zones = pending[5::PENDING_WIDTH]
+        for zone in set(zones):
+            self.zone_code(zone)
+        codes = self.zone_codes
+        columns = (pending[1::PENDING_WIDTH], pending[2::PENDING_WIDTH], pending[3::PENDING_WIDTH],
+                   pending[4::PENDING_WIDTH], [codes[zone] for zone in zones], pending[6::PENDING_WIDTH])
+        for (name, dtype), column in zip(FIELDS.items(), columns):
+            values = np.fromiter(column, dtype=dtype, count=len(column))
+            self.data[name].reshape(-1)[slots] = values if keep is None else values[keep]
+
+    def append(self, row:int, name:str, value):
+        """ Append a sample that changes only one field.  The other fields
+            repeat the latest sample, or are zero in an empty row.  Location
+            messages go through append_sample. """
+        sample = list(self.last[row] or EMPTY_SAMPLE)
+        sample[FIELD_INDEX[name]] = value
+        self._write(row, *sample)
+
+    def append_sample(self, row:int, ts:int, x:float, y:float, z:float, zone:str, motion:bool):
+        """ Append a full location sample to a row. """
+        self._write(row, ts, x, y, z, zone, motion)
+        self.update_dwell(row, ts, z, motion)
+        self.update_height_filter(row, z)
+
+    def update_height_filter(self, row:int, z:float):
+        """ One step of a scalar Kalman filter on the tag height.  O(1) per
+            sample, no history is rescanned.  The filter restarts from z
+            when a new dwell run starts: the tag moved by more than
+            dwell_band, and smoothing across the move would leave the
+            estimate short of the new height for many samples. """
+        est = self.filt_z[row]
+        if est != est or self.run_len[row] == 1:  # first sample, or the tag moved
+            self.filt_z[row] = z
+            self.filt_p[row] = HEIGHT_FILTER_MEASUREMENT_NOISE
+            return
+        p = self.filt_p[row] + HEIGHT_FILTER_PROCESS_NOISE
+        gain = p / (p + HEIGHT_FILTER_MEASUREMENT_NOISE)
+        self.filt_z[row] = est + gain * (z - est)
+        self.filt_p[row] = (1.0 - gain) * p
+
+    def update_dwell(self, row:int, ts:int, z:float, motion:bool):
+        """ Extend or restart the in-band and still runs of a row.  O(1)
+            per sample, no history is rescanned. """
+        if self.run_len[row] > 0 and abs(z - self.run_z[row]) <= self.dwell_band:
+            self.run_len[row] += 1
+        else:
+            self.run_z[row] = z
+            self.run_len[row] = 1
+        if motion:
+            self.still_since[row] = -1
+        elif self.still_since[row] < 0:
+            self.still_since[row] = ts
+
+    def settled(self, row:int, samples:int, still_ms:int=None) -> bool:
+        """ Has the row had samples consecutive samples within dwell_band
+            of each other, or no motion for still_ms. """
+        if self.run_len[row] >= samples:
+            return True
+        if still_ms is None:
+            return False
+        since = self.still_since[row]
+        return since >= 0 and self.last[row][0] - since >= still_ms
+
+    def filtered_height(self, row:int):
+        """ Get the filtered height of a row, None before the first sample. """
+        est = self.filt_z[row]
+        return None if est != est else est
+
+    def length(self, row:int, name:str=None) -> int:
+        """ Number of samples in a row.  Every field has the same length. """
+        return self.count[row]
+
+    def get(self, row:int, name:str, idx:int):
+        """ Get an item by chronological index, oldest first.  Negative
+            indexes count back from the latest item. """
+        count = self.count[row]
+        if idx == -1 and count:
+            return self.last[row][FIELD_INDEX[name]]
+        if idx < 0:
+            idx += count
+        if idx < 0 or idx >= count:
+            raise IndexError(f"{name} index out of range")
+        if idx == count - 1:
+            return self.last[row][FIELD_INDEX[name]]
+        self.flush()
+        pos = (self.head[row] - count + idx) % self.depth
+        value = self.data[name][row, pos].item()
+        if name == 'zone':
+            return self.zone_names[value]
+        return value
+
+    def latest(self, row:int, name:str):
+        """ Get the latest item of a field, None if the row is empty. """
+        sample = self.last[row]
+        if sample is None:
+            return None
+        return sample[FIELD_INDEX[name]]
+
+    def history(self, row:int, name:str) -> np.ndarray:
+        """ Get the buffered values of a field in chronological order. """
+        self.flush()
+        count = self.count[row]
+        values = self.data[name][row]
+        if count < self.depth:
+            return values[:count]
+        return np.roll(values, -self.head[row])
+
+
+class FieldView():
+    """ deque-like view of one field of one tag in a TagStore. """
+    __slots__ = ('store', 'row', 'name')
+
+    def __init__(self, store:TagStore, row:int, name:str):
+        self.store = store
+        self.row = row
+        self.name = name
+
+    def append(self, value):
+        self.store.append(self.row, self.name, value)
+
+    def __len__(self) -> int:
+        return self.store.length(self.row, self.name)
+
+    def __getitem__(self, idx:int):
+        return self.store.get(self.row, self.name, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.store.get(self.row, self.name, idx)
 
 
 class TagLoc():
     """ Buffers up location data for a tag. Gets the latest location, mean, median.
-        Gets the latest zone. """
-    def __init__(self, tagid:int, max_len:int=MAX_LOC_BUFF_LEN):
+        Gets the latest zone.  The data lives in a TagStore row; the TagLoc is
+        a thin view over it. """
+    def __init__(self, tagid:int, max_len:int=MAX_LOC_BUFF_LEN, store:TagStore=None):
         self.tagid = tagid
-        self.x = deque(maxlen=max_len)
-        self.y = deque(maxlen=max_len)
-        self.z = deque(maxlen=max_len)
-        self.zone = deque(maxlen=max_len)
-        self.motion = deque(maxlen=max_len)
-        self.ts = deque(maxlen=max_len)
+        if store is None:
+            store = TagStore(depth=max_len, capacity=1)
+        self.store = store
+        self.row = store.add_tag(tagid)
+        self.x = FieldView(store, self.row, 'x')
+        self.y = FieldView(store, self.row, 'y')
+        self.z = FieldView(store, self.row, 'z')
+        self.zone = FieldView(store, self.row, 'zone')
+        self.motion = FieldView(store, self.row, 'motion')
+        self.ts = FieldView(store, self.row, 'ts')
 
 
     def add_locmon(self, msg:Geomsg):
-        """ add lomon msg to que. 
+        """ add lomon msg to que.
          tag message format: ['ts':int, 'msgtype':str, 'tagid':int, 'name':str, /
                           'zone':str, 'isalert':int, 'boundary':int, 'motion':int, /
                           'isloc':int, 'rngcnt':int, 'rngerr':float, 'prircv':int, /
                           'prirng':float, 'x':float, 'y':float, 'z':float]
         """
         try:
-            self.ts.append(int(msg.fmsg[0]))
-            self.x.append(float(msg.fmsg[13]))
-            self.y.append(float(msg.fmsg[14]))
-            self.z.append(float(msg.fmsg[15]))
-            self.zone.append(msg.fmsg[4])
-            self.motion.append(bool(msg.fmsg[7]))
+            self.store.append_sample(self.row,
+                                     int(msg.fmsg[0]),
+                                     float(msg.fmsg[13]),
+                                     float(msg.fmsg[14]),
+                                     float(msg.fmsg[15]),
+                                     zone_name(msg.fmsg[4]),
+                                     bool(msg.fmsg[7]))
         except Exception as e:
             logging.exception("TagLoc.add_locmon exception:", e)
 
     def add_lctn(self, msg:Geomsg):
         """ add LCTN message to queue.
            LCTN message format: ['ts':int, 'msgtype':str, 'tagid':int, 'tagname':str,
-                         'zonename':str, 'inmotion':int, 'isalert':int, 
+                         'zonename':str, 'inmotion':int, 'isalert':int,
                          'rngcnt':int, 'rngerr':float, 'prircv':int, 'prirng':float,
                          'locx':float, 'locy':float, 'locz':float]
         """
-        
+
         try:
-            self.ts.append(int(msg.fmsg[0]))
-            self.x.append(float(msg.fmsg[11]))
-            self.y.append(float(msg.fmsg[12]))
-            self.z.append(float(msg.fmsg[13]))
-            self.zone.append(msg.fmsg[4])
-            self.motion.append(bool(msg.fmsg[5]))
+            self.store.append_sample(self.row,
+                                     int(msg.fmsg[0]),
+                                     float(msg.fmsg[11]),
+                                     float(msg.fmsg[12]),
+                                     float(msg.fmsg[13]),
+                                     zone_name(msg.fmsg[4]),
+                                     bool(msg.fmsg[5]))
         except Exception as e:
             print("TagLoc.add_locmon exception:", e)
 
+    def add_lctn_record(self, msg:LctnMsg):
+        """ add an already decoded LCTN message to the queue. """
+        self.store.append_sample(self.row, msg.ts, msg.x, msg.y, msg.z, msg.zone, msg.motion)
 
     def get_latest_location(self) -> tuple[float, float, float]:
         """ get the last x, y, z location """
         return (self.x[-1], self.y[-1], self.z[-1])
 
+    def _locations(self) -> np.ndarray:
+        """ Buffered x, y, z history as a 3 x N array. """
+        return np.vstack((self.store.history(self.row, 'x'),
+                          self.store.history(self.row, 'y'),
+                          self.store.history(self.row, 'z')))
+
     def get_mean_location(self) -> tuple[float, float, float]:
-        pass
+        """ get the mean x, y, z of the buffered locations """
+        if len(self.z) == 0:
+            return None
+        return tuple(np.mean(self._locations(), axis=1).tolist())
 
     def get_median_location(self) -> tuple[float, float, float]:
-        pass
+        """ get the median x, y, z of the buffered locations """
+        if len(self.z) == 0:
+            return None
+        return tuple(np.median(self._locations(), axis=1).tolist())
 
     def get_latest_height(self):
-        pass
+        return self.store.latest(self.row, 'z')
 
     def get_average_height(self):
-        pass
+        if len(self.z) == 0:
+            return None
+        return float(np.mean(self.store.history(self.row, 'z')))
 
     def get_median_height(self):
-        pass
+        if len(self.z) == 0:
+            return None
+        return float(np.median(self.store.history(self.row, 'z')))
+
+    def get_filtered_height(self):
+        """ get the Kalman filtered height.  Updated on every add_lctn. """
+        return self.store.filtered_height(self.row)
 
     def get_latest_zone(self):
-        return self.zone[-1] if len(self.zone) > 0 else None
+        return self.store.latest(self.row, 'zone')
+
+    def is_settled(self, samples:int, still_ms:int=None) -> bool:
+        """ Is the tag resting: samples consecutive samples at about the
+            same height, or no motion reported for still_ms. """
+        return self.store.settled(self.row, samples, still_ms)
 
 class Tags():
     """ Class to manage tags.  Holds a dictionary of TagLoc objects.
-        Each TagLoc object buffers location data for a tag. """
-    def __init__(self):
+        Each TagLoc object is a view of a row in a shared TagStore. """
+    def __init__(self, max_len:int=MAX_LOC_BUFF_LEN, dwell_band:float=DWELL_BAND):
+        self.store = TagStore(depth=max_len, dwell_band=dwell_band)
         self.tags = {}
 
+    def _get_or_create(self, tagid:int) -> TagLoc:
+        tagloc = self.tags.get(tagid, None)
+        if tagloc is None:
+            tagloc = TagLoc(tagid, store=self.store)
+            self.tags[tagid] = tagloc
+        return tagloc
+
     def add_locmon(self, msg:Geomsg) -> TagLoc:
         """ add a locmon message to the appropriate tag.  Create a new TagLoc
             object if the tag does not exist. """
         tagid = int(msg.fmsg[2])  # tagid is at index 2
-        if tagid not in self.tags:
-            self.tags[tagid] = TagLoc(tagid)
-        self.tags[tagid].add_locmon(msg)
-        return self.tags[tagid]
+        tagloc = self._get_or_create(tagid)
+        tagloc.add_locmon(msg)
+        return tagloc
 
     def add_lctn(self, msg:Geomsg) -> TagLoc:
         """ add a lctn message to the appropriate tag.  Create a new TagLoc
             object if the tag does not exist. """
+        if isinstance(msg, LctnMsg):
+            tagloc = self._get_or_create(msg.tagid)
+            tagloc.add_lctn_record(msg)
+            return tagloc
         tagid = int(msg.fmsg[2])  # tagid is at index 2
-        if tagid not in self.tags:
-            self.tags[tagid] = TagLoc(tagid)
-        self.tags[tagid].add_lctn(msg)
-        return self.tags[tagid]
+        tagloc = self._get_or_create(tagid)
+        tagloc.add_lctn(msg)
+        return tagloc
 
 
     # def __setitem__(self, tagid:int, tagloc:TagLoc):
@@ -113,7 +462,7 @@ class Tags():
     def __getitem__(self, tagid:int) -> TagLoc:
         """ Allow Tags object to be used like a dictionary """
         return self.tags.get(tagid, None)
-    
+
     def __contains__(self, tagid:int) -> bool:
         """ Check if a tag exists in the Tags object """
         return tagid in self.tags
@@ -122,9 +471,17 @@ class Tags():
     #     """ add a new tag to the tags dict """
     #     if tagid not in self.tags:
     #         self.tags[tagid] = TagLoc(tagid)
-        
+
 
     def get_tag(self, tagid:int) -> 'TagLoc':
         """ get a TagLoc object for the given tagid """
         return self.tags.get(tagid, None)
-    
\ No newline at end of file
+
+    def remove(self, tagid:int):
+        """ Forget a tag and its history.  Its TagLoc must not be used
+            afterwards; a new one is created if the tag is seen again. """
+        if self.tags.pop(tagid, None) is not None:
+            self.store.remove_tag(tagid)
+
+    def __len__(self) -> int:
+        return len(self.tags)
@@ -0,0 +1,67 @@
+""" Timer queue for many concurrent timeouts driven from the main loop.
+    Deadlines are kept in a heap with lazy cancellation: cancelling or
+    rescheduling a key only updates a dict, stale heap entries are skipped
+    when they reach the top. """
+
+import heapq
+import itertools
+import time
+
+
+class TimerQueue():
+    """ One-shot timers keyed by any hashable.  A key has at most one live
+        timer, scheduling it again replaces the old deadline. """
+    def __init__(self, delay:float=None, clock=time.monotonic):
+        """ delay: default timeout in seconds for schedule(). """
+        self.delay = delay
+        self.clock = clock
+        self.deadlines: dict = {}  # key -> (deadline, seq) of its live timer
+        self.heap: list = []  # (deadline, seq, key), may hold stale entries
+        self.seq = itertools.count()
+
+    def schedule(self, key, delay:float=None):
+        """ Start or restart the timer for key. """
+        if delay is None:
+            delay = self.delay
+        entry = (self.clock() + delay, next(self.seq))
+        self.deadlines[key] = entry
+        heapq.heappush(self.heap, (*entry, key))
+        self._compact()
+
+    def cancel(self, key):
+        """ Stop the timer for key, if any. """
+        if self.deadlines.pop(key, None) is not None:
+            self._compact()
+
+    def expire(self) -> list:
+        """ Remove and return the keys whose deadline has passed, earliest first. """
+        now = self.clock()
+        heap = self.heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(heap)
+            if self.deadlines.get(key, None) == (deadline, seq):
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+    def next_timeout(self) -> float:
+        """ Seconds until the earliest live deadline, None if no timers. """
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][2], None) != heap[0][:2]:
+            heapq.heappop(heap)  # drop stale entries
+        if not heap:
+            return None
+        return max(heap[0][0] - self.clock(), 0.0)
+
+    def _compact(self):
+        """ Rebuild the heap once stale entries outnumber the live ones. """
+        if len(self.heap) > 2 * len(self.deadlines) + 16:
+            self.heap = [(*entry, key) for key, entry in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key) -> bool:
+        return key in self.deadlines
@@ -0,0 +1,153 @@
+""" Publishes shelf updates to the UI server over Socket.IO without blocking
+    the message processing path.  Updates are queued, coalesced per box for a
+    short window and emitted by a background thread, which connects lazily and
+    reconnects with backoff when the UI server is slow or down. """
+
+import logging
+import threading
+import time
+from typing import Callable
+
+
+DEFAULT_COALESCE_WINDOW = 0.05  # seconds to gather updates before emitting
+DEFAULT_MAX_PENDING = 1000  # boxes waiting to be emitted, newer updates are dropped past it
+DEFAULT_MIN_BACKOFF = 0.5  # seconds
+DEFAULT_MAX_BACKOFF = 30.0
+
+logger = logging.getLogger("app."+__name__)
+
+
+def socketio_client():
+    """ Default client factory.  socketio is only imported when the
+        publisher first connects. """
+    import socketio
+    return socketio.Client()
+
+
+class UiPublisher():
+    """ Background Socket.IO publisher.  publish() only touches an in-memory
+        dict and never blocks on the network.  Pending updates are keyed so a
+        newer update for the same key replaces the older one before it is
+        sent. """
+    def __init__(self, url:str,
+                 client_factory:Callable[[], object]=socketio_client,
+                 window:float=DEFAULT_COALESCE_WINDOW,
+                 max_pending:int=DEFAULT_MAX_PENDING,
+                 min_backoff:float=DEFAULT_MIN_BACKOFF,
+                 max_backoff:float=DEFAULT_MAX_BACKOFF):
+        self.url = url
+        self.client_factory = client_factory
+        self.window = window
+        self.max_pending = max_pending
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.client = None
+        self.pending: dict = {}  # key -> (event, data), oldest first
+        self.dropped = 0
+        self.emitted = 0
+        self.lock = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """ Start the background thread. """
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="ui-publisher", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout:float=1.0):
+        """ Stop the background thread, trying once to send what is pending. """
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.flush()
+        if self.client is not None:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.client = None
+
+    def publish(self, key, event:str, data:dict):
+        """ Queue an event.  Replaces a pending event with the same key. """
+        with self.lock:
+            if key not in self.pending and len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.pending.pop(key, None)  # keep the newest last
+            self.pending[key] = (event, data)
+            self.lock.notify()
+
+    def update_shelf(self, box_id:int, shelf_num:int):
+        """ Queue a box_update.  Only the latest shelf of a box is sent. """
+        self.publish(box_id, 'box_update', {'box_id': box_id, 'shelf': shelf_num})
+
+    def flush(self) -> bool:
+        """ Emit everything pending now.  Returns False if the UI server
+            could not be reached; the unsent events stay pending. """
+        with self.lock:
+            batch = self.pending
+            self.pending = {}
+        if not batch:
+            return True
+        sent = 0
+        try:
+            client = self._connect()
+            for event, data in batch.values():
+                client.emit(event, data)
+                sent += 1
+        except Exception as e:
+            logger.warning("UI publish failed: %s", e)
+            self._disconnect()
+            self._requeue(list(batch.items())[sent:])
+            return False
+        finally:
+            self.emitted += sent
+        return True
+
+    def _requeue(self, items:list):
+        """ Put unsent events back in front of the pending ones, unless a
+            newer event with the same key has been published since. """
+        with self.lock:
+            merged = {key: value for key, value in items if key not in self.pending}
+            merged.update(self.pending)
+            while len(merged) > self.max_pending:
+                del merged[next(iter(merged))]
+                self.dropped += 1
+            self.pending = merged
+
+    def _connect(self):
+        if self.client is None:
+            client = self.client_factory()
+            client.connect(self.url)
+            self.client = client
+        return self.client
+
+    def _disconnect(self):
+        client, self.client = self.client, None
+        if client is not None:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    def _run(self):
+        backoff = self.min_backoff
+        while True:
+            with self.lock:
+                while self.running and not self.pending:
+                    self.lock.wait()
+                if not self.running:
+                    return
+            time.sleep(self.window)  # let updates for the same box coalesce
+            if self.flush():
+                backoff = self.min_backoff
+            else:
+                with self.lock:
+                    self.lock.wait_for(lambda: not self.running, timeout=backoff)
+                backoff = min(backoff * 2, self.max_backoff)
@@ -4,65 +4,237 @@
 """
 
 from net.geo_packet_handler import Geomsg
+import collections
 import logging
+import time
 from tags import TagLoc, Tags
-from typing import Callable
-from cabinet import Cabinet
+from typing import Callable, Iterable, TYPE_CHECKING
+from spatial import GridIndex
+from metrics import ZONE_UPDATE_SECONDS, TAGS_TRACKED, TAGS_EVICTED, TAG_STORE_BYTES, HANDLER_ERRORS
+if TYPE_CHECKING:
+    from cabinet import Cabinet  # type hints only, Zones is given its cabinets
 
 
 logger = logging.getLogger("app."+__name__)
 # logger.propagate = True
 # logger.setLevel(logging.INFO)
 
+_EMPTY_ZONE = {}.keys()  # returned for unknown zones
+EVICT_BATCH = 8  # most tags evicted per message, spreads a backlog over later messages
+
 class Zones():
     """ Class to manage zones.  Holds a dictionary of TagLoc objects.
-        Each TagLoc object buffers location data for a tag. """
-    def __init__(self, tags:Tags=None):
-        self.zones: dict[str, list[int]] = {} # Zone name -> list of tag ids
-        if not tags:
-            self.tags:Tags = Tags()  # Class that holds all TagLoc objects
+        Each TagLoc object buffers location data for a tag.
+
+        Tags can be evicted to bound memory: ttl_ms after they were last
+        seen, least recently seen first once there are more than max_tags,
+        or exit_ttl_ms after they were seen in one of exit_zones.  Times are
+        the message timestamps.  Eviction forgets the tag's history and zone,
+        shelf assignments in the cabinets are kept. """
+    def __init__(self, tags:Tags=None, ttl_ms:int=None, max_tags:int=None,
+                 exit_zones:Iterable[str]=(), exit_ttl_ms:int=0):
+        self.zones: dict[str, dict[TagLoc, None]] = {} # Zone name -> ordered set of TagLocs
+        if tags is None:
+            tags = Tags()
+        self.tags:Tags = tags  # Class that holds all TagLoc objects
         self.cabinets: dict[str, Cabinet] = {}  # Zone name -> Cabinet object
+        self.cabinet_grid = GridIndex()  # Cabinet footprints by x-y location
         self.last_zone: dict[int, str] = {}  # Last zone tag was in
+        self.ttl_ms = ttl_ms
+        self.max_tags = max_tags
+        self.exit_zones = frozenset(exit_zones)
+        self.exit_ttl_ms = exit_ttl_ms
+        self.seen = None  # Tag id -> ts last seen, least recent first.  None without eviction
+        self.exiting = None  # Tag id -> ts it entered an exit zone, earliest first
+        if ttl_ms is not None or max_tags is not None or self.exit_zones:
+            self.seen = collections.OrderedDict()
+            self.exiting = collections.OrderedDict()
+        # Read when the metrics are collected, the store grows as tags arrive
+        TAG_STORE_BYTES.set_function(self.tags.store.nbytes)
 
     def add_locmon(self, msg:Geomsg):
         """ add a locmon message to Tags.  Update zones with tagid. """
         tagloc = self.tags.add_locmon(msg)  # Add to Tags object
         self.update_zones(tagloc)
         self.inform_cabinet(tagloc)  # Inform the cabinet object of the tag's latest location
+        if self.seen is not None:
+            self._touch(tagloc)
 
     def add_lctn(self, msg:Geomsg):
         """ add a lctn message to Tags.  Update zones with tagid. """
         tagloc = self.tags.add_lctn(msg)  # Add to Tags object
+        start = time.perf_counter()
         self.update_zones(tagloc)
+        ZONE_UPDATE_SECONDS.observe(time.perf_counter() - start)
         self.inform_cabinet(tagloc)  # Inform the cabinet object of the tag's latest location
+        if self.seen is not None:
+            self._touch(tagloc)
         
+    def add_lctns(self, msgs:Iterable[Geomsg]):
+        """ add a batch of lctn messages to Tags.  Zones are updated per
+            message, cabinets are informed once per tag with its latest
+            location. """
+        add_lctn = self.tags.add_lctn
+        update_zones = self.update_zones
+        touched: dict[TagLoc, None] = {}  # ordered set of the tags in the batch
+        count = 0
+        start = time.perf_counter()
+        for msg in msgs:
+            # A bad message is logged and skipped, the rest of the batch still counts
+            try:
+                tagloc = add_lctn(msg)
+                update_zones(tagloc)
+            except Exception:
+                HANDLER_ERRORS.inc("LCTN")
+                logger.exception("Dropping LCTN that failed to apply: %s", getattr(msg, 'msg', msg))
+                continue
+            touched[tagloc] = None
+            count += 1
+        if count:
+            ZONE_UPDATE_SECONDS.observe((time.perf_counter() - start) / count)
+        for tagloc in touched:
+            try:
+                if self.seen is not None:
+                    if tagloc.tagid not in self.tags:
+                        continue  # evicted by an earlier tag of the batch
+                    self._touch(tagloc)
+                self.inform_cabinet(tagloc)
+            except Exception:
+                HANDLER_ERRORS.inc("LCTN")
+                logger.exception("Informing the cabinets of tag %s failed", tagloc.tagid)
+
     def inform_cabinet(self, tag:TagLoc):
-        """ Inform the cabinet object of a tag's latest location. """
+        """ Inform the cabinet objects of a tag's latest location.  Cabinets
+            with a configured footprint are found from the tag's x-y in the
+            spatial grid.  If the tag is in no footprint, the cabinet of the
+            tag's zone is informed. """
+        if self.cabinet_grid.cells and len(tag.x) > 0:
+            cabinets = self.cabinet_grid.query(tag.x[-1], tag.y[-1])
+            if cabinets:
+                for cabinet in cabinets:
+                    cabinet.new_tag_loc(tag)
+                return
         zone = tag.get_latest_zone()
         if zone in self.cabinets:
             cabinet = self.cabinets[zone]
             cabinet.new_tag_loc(tag)
 
-    def add_cabinet(self, cabinet:Cabinet, zone_name:str):
+    def assign_zone_tags(self, zone_name:str):
+        """ Match every tag in a zone against all pending shelves of the
+            zone's cabinet in one pass. """
+        cabinet = self.cabinets.get(zone_name, None)
+        if cabinet is not None:
+            cabinet.assign_tags(self.get_tags_in_zone(zone_name))
+
+    def add_cabinet(self, cabinet:'Cabinet', zone_name:str):
         self.cabinets[zone_name] = cabinet
+        xy_box = cabinet.geometry.xy_box
+        if xy_box is not None:
+            self.cabinet_grid.insert(xy_box, cabinet)
 
     def update_zones(self, tag:TagLoc):
-        """ Update zones dict with latest tag zone. Latest tag is last in the list."""
+        """ Update zones dict with latest tag zone.  A no-op when the tag is
+            still in the zone it was last seen in. """
         zone = tag.get_latest_zone()
-        if zone not in self.zones:
-            self.zones[zone] = []
-            logger.debug(f"Created new zone: {zone}")
         last_zone = self.last_zone.get(tag.tagid, None)
-        if last_zone is None:
-            self.zones[zone].append(tag)
-            logger.debug(f"Tag {tag.tagid} added to zone {zone}")
-        else:
-            self.zones[last_zone].remove(tag)
-            self.zones[zone].append(tag)
-            if zone != last_zone:
-                logger.debug(f"Tag {tag.tagid} moved from zone {last_zone} to {zone}")  
+        if zone == last_zone:
+            return
+        members = self.zones.get(zone, None)
+        if members is None:
+            members = self.zones[zone] = {}
+            if __debug__:
+                logger.debug("Created new zone: %s", zone)
+        if last_zone is not None:
+            self.zones[last_zone].pop(tag, None)
+        if __debug__:
+            if last_zone is None:
+                logger.debug("Tag %s added to zone %s", tag.tagid, zone)
+            else:
+                logger.debug("Tag %s moved from zone %s to %s", tag.tagid, last_zone, zone)
+        members[tag] = None
         self.last_zone[tag.tagid] = zone
 
     def get_tags_in_zone(self, zone_name:str):
-        """ Get all tags in a specific zone """
-        return self.zones.get(zone_name, [])
+        """ Get all tags in a specific zone.  Returns a read only, set like
+            view that follows later updates; copy it to keep a snapshot. """
+        members = self.zones.get(zone_name, None)
+        if members is None:
+            return _EMPTY_ZONE
+        return members.keys()
+
+    def get_zone_of_tag(self, tagid:int) -> str:
+        """ Get the zone a tag was last seen in, None for an unknown tag. """
+        return self.last_zone.get(tagid, None)
+
+    def get_zone_count(self, zone_name:str) -> int:
+        """ Get the number of tags in a zone. """
+        return len(self.zones.get(zone_name, _EMPTY_ZONE))
+
+    def _touch(self, tag:TagLoc):
+        """ Record that a tag was seen, then evict up to EVICT_BATCH tags.
+            Only the least recently seen tags are looked at, so the cost per
+            message does not grow with the number of tags. """
+        tagid = tag.tagid
+        now = tag.ts[-1]
+        seen = self.seen
+        if tagid in seen:
+            seen.move_to_end(tagid)
+        else:
+            TAGS_TRACKED.set(len(self.tags))
+        seen[tagid] = now
+        if self.last_zone.get(tagid, None) in self.exit_zones:
+            if tagid not in self.exiting:
+                self.exiting[tagid] = now
+        elif self.exiting:
+            self.exiting.pop(tagid, None)
+        self.evict_expired(now)
+
+    def evict_expired(self, now:int, limit:int=EVICT_BATCH) -> int:
+        """ Evict up to limit tags that are over max_tags, past their
+            ttl_ms or exit_ttl_ms at message time now.  Returns the count. """
+        if self.seen is None:
+            return 0
+        evicted = 0
+        seen = self.seen
+        while evicted < limit and seen:
+            tagid, last = next(iter(seen.items()))
+            if self.max_tags is not None and len(seen) > self.max_tags:
+                reason = 'max_tags'
+            elif self.ttl_ms is not None and now - last > self.ttl_ms:
+                reason = 'ttl'
+            else:
+                break
+            self.evict(tagid, reason)
+            evicted += 1
+        exiting = self.exiting
+        while evicted < limit and exiting:
+            tagid, entered = next(iter(exiting.items()))
+            if now - entered < self.exit_ttl_ms:
+                break
+            self.evict(tagid, 'exit')
+            evicted += 1
+        return evicted
+
+    def evict(self, tagid:int, reason:str='manual'):
+        """ Forget a tag: its history, zone membership and last zone. """
+        tag = self.tags.get_tag(tagid)
+        zone = self.last_zone.pop(tagid, None)
+        if tag is not None and zone is not None:
+            self.zones[zone].pop(tag, None)
+        self.tags.remove(tagid)
+        if self.seen is not None:
+            self.seen.pop(tagid, None)
+            self.exiting.pop(tagid, None)
+        TAGS_EVICTED.inc(reason)
+        TAGS_TRACKED.set(len(self.tags))
+        if __debug__:
+            logger.debug("Evicted tag %s (%s)", tagid, reason)
+
+    def memory_stats(self) -> dict:
+        """ Tag count and the bytes of history storage allocated, in total
+            and per tag. """
+        store = self.tags.store
+        total = store.nbytes()
+        count = len(self.tags)
+        return {'tags': count, 'store_bytes': total, 'row_bytes': store.row_nbytes(),
+                'bytes_per_tag': total / count if count else 0.0}
@@ -1,6 +1,6 @@
 """ Test the Cabinet class and the Cluster class with pytest"""
 import pytest
-from cabinet import Cabinet, Cluster
+from cabinet import Cabinet, Cluster, LED_RED, LED_BLUE
 from net.geo_packet_handler import Geomsg
 from tags import TagLoc, Tags
 
@@ -57,3 +57,302 @@ def test_new_tag_loc_calls_send_fnc(sample_cabinet_config, sample_tagloc):
 
 
 
+def test_height_estimator_from_config(sample_cabinet_config):
+    """The height estimator is picked from the cabinet config"""
+    config = dict(sample_cabinet_config[0], height_estimator='median')
+    cabinet_obj = Cabinet(config, lambda msg: None)
+    assert cabinet_obj.get_tag_height is TagLoc.get_median_height
+    with pytest.raises(ValueError):
+        Cabinet(dict(config, height_estimator='bogus'), lambda msg: None)
+
+def _tag_at(tagid, z):
+    tagloc = TagLoc(tagid=tagid)
+    tagloc.store.append_sample(tagloc.row, 0, 0.0, 0.0, z, 'ZoneA', False)
+    return tagloc
+
+def test_assign_tags_matches_all_pending_shelves():
+    """All pending shelves are matched against all tags in one pass"""
+    sent_msgs = []
+    config = {'cabinet_controller_id': 1, 'zone': 'ZoneA', 'shelf_height': 1.0,
+              'height_proximity_threshold': 0.4, 'location': (0.0, 0.0, 0.396)}
+    cabinet_obj = Cabinet(config, sent_msgs.append)
+    for shelf in (2, 5):
+        cabinet_obj.store_light_switch_state(shelf, True)
+    # shelf 2 is centered at 4.896, shelf 5 at 1.896
+    cabinet_obj.assign_tags([_tag_at(10, 1.9), _tag_at(11, 4.9), _tag_at(12, 3.4)])
+    assert list(cabinet_obj.tags[2]) == [11]
+    assert list(cabinet_obj.tags[5]) == [10]
+    assert cabinet_obj.get_assigned_shelf(11) == 2
+    assert cabinet_obj.light_switch_events == []
+    assert sent_msgs == ['RCVPRM, 1, 102=4\r\n', 'RCVPRM, 1, 105=4\r\n']
+
+def test_assign_tags_band_prefilter():
+    """Only tags in a shelf band near a pending shelf reach the matcher,
+    tags above or below the cabinet are never matched"""
+    config = {'cabinet_controller_id': 1, 'zone': 'ZoneA', 'shelf_height': 1.0,
+              'height_proximity_threshold': 1.5, 'location': (0.0, 0.0, 0.396)}
+    cabinet_obj = Cabinet(config, lambda msg: None)
+    assert cabinet_obj.band_reach == 2
+    cabinet_obj.store_light_switch_state(1, True)
+    # shelf 1 is centered at 5.896 and ends at 6.396
+    cabinet_obj.assign_tags([_tag_at(10, 6.5)])
+    assert cabinet_obj.get_assigned_shelf(10) is None
+    cabinet_obj.assign_tags([_tag_at(11, 2.9), _tag_at(12, 4.5)])
+    assert cabinet_obj.get_assigned_shelf(11) is None
+    assert cabinet_obj.get_assigned_shelf(12) == 1
+
+def test_shelf_holds_several_tags():
+    """A shelf can hold several tags, and a tag is only ever on one shelf"""
+    cabinet_obj = Cabinet({'cabinet_controller_id': 1, 'zone': 'ZoneA'}, lambda msg: None)
+    cabinet_obj.update_tags(3, 10)
+    cabinet_obj.update_tags(3, 11)
+    assert list(cabinet_obj.tags[3]) == [10, 11]
+    cabinet_obj.update_tags(4, 10)
+    assert list(cabinet_obj.tags[3]) == [11]
+    assert cabinet_obj.get_assigned_shelf(10) == 4
+    # The shelf switch going off empties the shelf
+    cabinet_obj.store_light_switch_state(4, False)
+    assert cabinet_obj.tags[4] == {}
+    assert cabinet_obj.get_assigned_shelf(10) is None
+    assert cabinet_obj.get_assigned_shelf(11) == 3
+
+def test_cluster_merges_led_writes(sample_cabinet_config):
+    """LED writes from a cabinet are merged into one RCVPRM per flush"""
+    sent_msgs = []
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config},
+                          lambda msg, callback=None: sent_msgs.append(msg))
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.send_shelf_led_msg(2, 1)
+    cabinet_obj.send_shelf_led_msg(5, 1)
+    cabinet_obj.send_shelf_led_msg(2, 4)
+    assert sent_msgs == []
+    cluster_obj.flush_commands()
+    assert sent_msgs == ['RCVPRM, 1, 102=4, 105=1\r\n']
+
+class DummyResponse:
+    def __init__(self, rspns, err=None):
+        self.rspns = rspns
+        self.err = err
+
+def test_cluster_led_timeout(sample_cabinet_config):
+    """A lit LED is turned off once led_timeout has passed"""
+    sent_msgs = []
+    def send(msg, callback=None):
+        sent_msgs.append(msg)
+        callback(DummyResponse(''))
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config, 'led_timeout': 5}, send)
+    now = [0.0]
+    cluster_obj.led_timers.clock = lambda: now[0]
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.send_shelf_led_msg(2, 1)
+    cabinet_obj.send_shelf_led_msg(3, 4)
+    cluster_obj.poll()
+    assert cluster_obj.next_timeout() == 5.0
+    now[0] = 6.0
+    cluster_obj.poll()
+    assert sent_msgs[-1] == 'RCVPRM, 1, 102=0, 103=0\r\n'
+    assert cluster_obj.next_timeout() is None
+
+def test_cluster_add_decoded_ltsw(sample_cabinet_config):
+    """A fast-path decoded LTSW reaches its cabinet"""
+    from fast_msg import LtswMsg
+    sent_msgs = []
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config},
+                          lambda msg, callback=None: sent_msgs.append(msg))
+    cabinet_obj = cluster_obj.add_ltsw_msg(LtswMsg("1,SENS0,1,LTSW,3,1", 1, 1, 3, 1))
+    assert cabinet_obj.get_light_switch_state(3) == 1
+    assert cabinet_obj.light_switch_events == [3]
+    cluster_obj.flush_commands()
+    assert sent_msgs == ['RCVPRM, 1, 103=1\r\n']
+
+def test_cluster_add_ltsw_msgs_skips_bad_message(sample_cabinet_config):
+    """An LTSW from an unknown controller does not drop the rest of the batch"""
+    from fast_msg import LtswMsg
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config}, lambda msg, callback=None: None)
+    msgs = [LtswMsg("1,SENS0,1,LTSW,2,1", 1, 1, 2, 1),
+            LtswMsg("9,SENS0,9,LTSW,3,1", 9, 9, 3, 1),
+            LtswMsg("1,SENS0,1,LTSW,3,1", 1, 1, 3, 1)]
+    cabinets = cluster_obj.add_ltsw_msgs(msgs)
+    assert [cabinet.id for cabinet in cabinets] == [1]
+    assert cabinets[0].light_switch_events == [2, 3]
+
+
+def test_cluster_armed(sample_cabinet_config):
+    """The cluster is armed while a shelf waits for a tag"""
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config}, lambda msg, callback=None: None)
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    assert not cluster_obj.is_armed()
+    cabinet_obj.store_light_switch_state(2, True)
+    assert cluster_obj.is_armed()
+    cabinet_obj.store_light_switch_state(2, False)
+    assert not cluster_obj.is_armed()
+    assert cluster_obj.get_zones() == {'ZoneA'}
+
+def test_cluster_snapshot_restart(sample_cabinet_config, tmp_path):
+    """Shelf state saved by one cluster is loaded by the next"""
+    config = {'cabinets': sample_cabinet_config, 'snapshot_file': str(tmp_path / 'shelves.json')}
+    cluster_obj = Cluster(config, lambda msg, callback=None: None)
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.store_light_switch_state(2, True)
+    cabinet_obj.update_tags(2, 11)
+    cabinet_obj.light_switch_events.remove(2)
+    cabinet_obj.store_light_switch_state(5, True)
+    cluster_obj.save_snapshot()
+
+    restarted = Cluster(config, lambda msg, callback=None: None)
+    cabinet_obj = restarted.get_cabinet(1)
+    assert cabinet_obj.get_assigned_shelf(11) == 2
+    assert cabinet_obj.get_light_switch_state(2)
+    assert cabinet_obj.light_switch_events == [5]
+    assert restarted.is_armed()
+
+def test_snapshot_keeps_leds(sample_cabinet_config):
+    """LED values survive a get_state/restore_state round trip, and are
+    derived from the shelf state for snapshots saved without them"""
+    cabinet_obj = Cabinet(sample_cabinet_config[0], lambda msg, callback=None: None)
+    cabinet_obj.set_switch(2, 1)
+    cabinet_obj.set_switch(5, 1)
+    cabinet_obj.update_tags(5, 11)
+    cabinet_obj.light_switch_events.remove(5)
+    cabinet_obj.send_shelf_led_msg(5, LED_BLUE)
+    state = cabinet_obj.get_state()
+    assert state['leds'] == [0, LED_RED, 0, 0, LED_BLUE, 0]
+
+    restored = Cabinet(sample_cabinet_config[0], lambda msg, callback=None: None)
+    restored.restore_state(state)
+    assert restored.leds == cabinet_obj.leds | {1: 0, 3: 0, 4: 0, 6: 0}
+    del state['leds']
+    derived = Cabinet(sample_cabinet_config[0], lambda msg, callback=None: None)
+    derived.restore_state(state)
+    assert derived.leds == restored.leds
+
+def test_cluster_request_states_reconciles(sample_cabinet_config, caplog):
+    """Switches the controller reports on are applied, one the restored
+    state has on is kept until switch-offs from a resync are verified"""
+    sent = []
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config}, lambda msg, callback=None: sent.append((msg, callback)))
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.store_light_switch_state(2, True)
+    cabinet_obj.update_tags(2, 11)
+    cluster_obj.request_states()
+    assert [msg for msg, _ in sent] == ['RCVCMD, 1, GETRCVP, 97\r\n',
+                                        'RCVCMD, 1, GETRCVP, 101, 102, 103, 104, 105, 106\r\n']
+    sent[0][1](DummyResponse('RCVCMD, 1, 8'))  # only shelf 4 is on
+    sent[1][1](DummyResponse('0, 0, 0, 1, 0, 0'))
+    assert cabinet_obj.initialized
+    assert cabinet_obj.get_light_switch_state(2)
+    assert cabinet_obj.get_assigned_shelf(11) == 2
+    assert "shelf 2 switch reported off" in caplog.text
+    assert cabinet_obj.get_light_switch_state(4)
+    assert cabinet_obj.led_states[4] == 1
+
+def test_cluster_resync_sends_only_corrections(sample_cabinet_config):
+    """After a resync only the LEDs that differ from the last set value are rewritten"""
+    sent = []
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config, 'resync_max_in_flight': 1},
+                          lambda msg, callback=None: sent.append((msg, callback)))
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.send_shelf_led_msg(3, 4)
+    cluster_obj.request_states()
+    assert len(sent) == 1  # window of one
+    sent[0][1](DummyResponse('0'))
+    sent[1][1](DummyResponse('0, 0, 4, 0, 2, 0'))  # shelf 5 was left GREEN
+    assert cluster_obj.resync.done()
+    sent.clear()
+    cluster_obj.flush_commands()
+    assert [msg for msg, _ in sent] == ['RCVPRM, 1, 103=4, 105=0\r\n']
+    assert cabinet_obj.led_corrections == 1
+
+def test_restart_then_resync_keeps_lit_leds(sample_cabinet_config, tmp_path):
+    """A resync after a warm restart leaves the LEDs the snapshot says are lit"""
+    config = {'cabinets': sample_cabinet_config, 'snapshot_file': str(tmp_path / 'shelves.json')}
+    cluster_obj = Cluster(config, lambda msg, callback=None: None)
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.set_switch(2, 1)
+    cabinet_obj.set_switch(5, 1)
+    cabinet_obj.update_tags(5, 11)
+    cabinet_obj.light_switch_events.remove(5)
+    cabinet_obj.send_shelf_led_msg(5, LED_BLUE)
+    cluster_obj.save_snapshot()
+
+    sent = []
+    restarted = Cluster(config, lambda msg, callback=None: sent.append((msg, callback)))
+    restarted.request_states()
+    sent[0][1](DummyResponse('18'))  # shelves 2 and 5 on
+    sent[1][1](DummyResponse('0, 1, 0, 0, 4, 0'))
+    sent.clear()
+    restarted.flush_commands()
+    assert sent == []
+    assert restarted.get_cabinet(1).led_corrections == 0
+
+def test_resync_derives_unset_leds(sample_cabinet_config):
+    """Shelves with no LED value set get the one their state implies"""
+    sent = []
+    cluster_obj = Cluster({'cabinets': sample_cabinet_config}, lambda msg, callback=None: sent.append((msg, callback)))
+    cabinet_obj = cluster_obj.get_cabinet(1)
+    cabinet_obj.restore_state({'switches': [False, True, False, False, True, False],
+                               'tags': [[], [], [], [], [11], []], 'events': [2]})
+    cabinet_obj.leds = {}
+    cluster_obj.request_states()
+    sent[0][1](DummyResponse('18'))
+    sent[1][1](DummyResponse('0, 0, 0, 0, 4, 0'))
+    sent.clear()
+    cluster_obj.flush_commands()
+    assert [msg for msg, _ in sent] == ['RCVPRM, 1, 102=1\r\n']
+
+def test_dwell_before_assignment():
+    """A tag carried past an open shelf is not matched until it rests"""
+    sent_msgs = []
+    config = {'cabinet_controller_id': 1, 'zone': 'ZoneA', 'shelf_height': 1.0,
+              'height_proximity_threshold': 0.4, 'location': (0.0, 0.0, 0.396),
+              'dwell_samples': 3, 'dwell_ms': 1000}
+    cabinet_obj = Cabinet(config, sent_msgs.append)
+    cabinet_obj.store_light_switch_state(2, True)  # centered at 4.896
+    tagloc = TagLoc(tagid=10)
+    for ts, z in ((0, 3.0), (100, 4.9), (200, 6.5)):  # carried up past shelf 2
+        tagloc.store.append_sample(tagloc.row, ts, 0.0, 0.0, z, 'ZoneA', True)
+        cabinet_obj.new_tag_loc(tagloc)
+    assert cabinet_obj.get_assigned_shelf(10) is None
+    for ts in (300, 400, 500):  # put down on shelf 2
+        tagloc.store.append_sample(tagloc.row, ts, 0.0, 0.0, 4.9, 'ZoneA', True)
+        cabinet_obj.new_tag_loc(tagloc)
+    assert cabinet_obj.get_assigned_shelf(10) == 2
+    assert sent_msgs == ['RCVPRM, 1, 102=4\r\n']
+
+def test_box_moved_from_floor_to_shelf():
+    """A box resting on the floor and then put on shelf 1 goes to shelf 1
+    with the shipped cabinet settings, not to shelf 2 below it"""
+    sent_msgs = []
+    config = {'cabinet_controller_id': 1, 'zone': 'ZoneA', 'shelf_height': 1.0,
+              'location': (87.42, 13.0, 0.396), 'shelf_width': 2.66,
+              'height_proximity_threshold': 1.5, 'width_proximity_threshold': 0.5,
+              'height_estimator': 'filtered', 'dwell_samples': 6, 'dwell_ms': 1000}
+    cabinet_obj = Cabinet(config, sent_msgs.append)
+    tagloc = TagLoc(tagid=10)
+    ts = 0
+    def sample(z, moving):
+        nonlocal ts
+        ts += 250
+        tagloc.store.append_sample(tagloc.row, ts, 87.42, 13.0, z, 'ZoneA', moving)
+        cabinet_obj.new_tag_loc(tagloc)
+    for _ in range(8):
+        sample(1.0, False)  # resting on the floor
+    cabinet_obj.store_light_switch_state(1, True)
+    cabinet_obj.store_light_switch_state(2, True)
+    for z in (2.0, 3.0, 4.0, 5.0):
+        sample(z, True)  # carried up
+    for _ in range(6):
+        sample(5.9, False)  # put down on shelf 1
+    assert cabinet_obj.get_assigned_shelf(10) == 1
+    assert abs(tagloc.get_filtered_height() - 5.9) < 0.01
+
+def test_dwell_by_stillness():
+    """No motion for dwell_ms settles a tag with a jittery height"""
+    config = {'cabinet_controller_id': 1, 'zone': 'ZoneA', 'dwell_samples': 100, 'dwell_ms': 1000}
+    cabinet_obj = Cabinet(config, lambda msg: None)
+    tagloc = TagLoc(tagid=10)
+    tagloc.store.append_sample(tagloc.row, 0, 0.0, 0.0, 1.0, 'ZoneA', False)
+    tagloc.store.append_sample(tagloc.row, 600, 0.0, 0.0, 2.0, 'ZoneA', False)
+    assert not tagloc.is_settled(cabinet_obj.dwell_samples, cabinet_obj.dwell_ms)
+    tagloc.store.append_sample(tagloc.row, 1000, 0.0, 0.0, 1.0, 'ZoneA', False)
+    assert tagloc.is_settled(cabinet_obj.dwell_samples, cabinet_obj.dwell_ms)
@@ -0,0 +1,75 @@
+import pytest
+from capture import CaptureWriter, CapturingFactory, ReplayClock, read_capture, replay
+from timers import TimerQueue
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+    def handle_message(self, msg):
+        self.messages.append(msg)
+
+@pytest.mark.parametrize("name", ["site.cap", "site.cap.gz"])
+def test_capture_round_trip(tmp_path, name):
+    path = tmp_path / name
+    with CaptureWriter(path) as writer:
+        writer.write("1,LCTN,42", ts_ns=10)
+        writer.write(b"2,SENS0,1,LTSW,2,1", ts_ns=20)
+    # A restart appends to the same file
+    with CaptureWriter(path) as writer:
+        writer.write("3,LCTN,43", ts_ns=30)
+    assert list(read_capture(path)) == [(10, "1,LCTN,42"), (20, "2,SENS0,1,LTSW,2,1"), (30, "3,LCTN,43")]
+
+@pytest.mark.parametrize("name", ["site.cap", "site.cap.gz"])
+def test_truncated_record_is_ignored(tmp_path, name):
+    path = tmp_path / name
+    with CaptureWriter(path) as writer:
+        writer.write("1,LCTN,42", ts_ns=10)
+    size = path.stat().st_size
+    # A restart that crashed while writing the next record
+    with CaptureWriter(path) as writer:
+        writer.write("2,LCTN,43", ts_ns=20)
+    path.write_bytes(path.read_bytes()[:size + 12])
+    assert list(read_capture(path)) == [(10, "1,LCTN,42")]
+
+def test_capturing_factory(tmp_path):
+    path = tmp_path / "site.cap"
+    with CaptureWriter(path) as writer:
+        factory = CapturingFactory(str.upper, writer)
+        assert factory("1,lctn") == "1,LCTN"
+    assert [raw for _, raw in read_capture(path)] == ["1,lctn"]
+
+def test_replay_speed(tmp_path):
+    path = tmp_path / "site.cap"
+    with CaptureWriter(path) as writer:
+        for idx in range(3):
+            writer.write(f"{idx},LCTN", ts_ns=idx * 1_000_000_000)
+    handler = RecordingHandler()
+    sleeps = []
+    stats = replay(path, handler, str, speed=10, sleep=sleeps.append)
+    assert handler.messages == ["0,LCTN", "1,LCTN", "2,LCTN"]
+    assert stats['messages'] == 3
+    assert stats['span'] == 2.0
+    # 1 s apart in the capture, replayed 10x faster
+    assert sleeps[0] == pytest.approx(0.1, abs=0.01)
+    assert len(sleeps) == 2
+    sleeps.clear()
+    replay(path, handler, str, speed=None, sleep=sleeps.append)
+    assert sleeps == []
+
+def test_replay_timers_run_on_capture_time(tmp_path):
+    path = tmp_path / "site.cap"
+    with CaptureWriter(path) as writer:
+        for idx, seconds in enumerate((100, 101, 106)):
+            writer.write(f"{idx},LCTN", ts_ns=seconds * 1_000_000_000)
+    clock = ReplayClock()
+    timers = TimerQueue(5.0, clock=clock)
+    expired = []
+    class TimingHandler:
+        def handle_message(self, msg):
+            if msg == "0,LCTN":
+                timers.schedule("led")
+    poll = lambda: expired.append(timers.expire())
+    # As fast as possible, the timer still fires 5 s of capture time later
+    replay(path, TimingHandler(), str, poll_fnc=poll, clock=clock)
+    assert expired == [[], [], ["led"]]
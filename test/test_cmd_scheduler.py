@@ -0,0 +1,69 @@
+import pytest
+from cmd_scheduler import CommandScheduler
+
+
+class DummyResponse:
+    def __init__(self, err=None, rspns=''):
+        self.err = err
+        self.rspns = rspns
+
+@pytest.fixture
+def sent():
+    return []
+
+@pytest.fixture
+def scheduler(sent):
+    return CommandScheduler(lambda msg, callback: sent.append((msg, callback)), max_in_flight=1)
+
+def test_writes_merge_per_controller(scheduler, sent):
+    scheduler.set_param(1, 103, 1)
+    scheduler.set_param(1, 101, 4)
+    scheduler.set_param(1, 103, 4)  # supersedes RED on shelf 3
+    scheduler.flush()
+    assert [msg for msg, _ in sent] == ['RCVPRM, 1, 101=4, 103=4\r\n']
+    assert scheduler.superseded == 1
+
+def test_in_flight_window(scheduler, sent):
+    scheduler.set_param(1, 101, 1)
+    scheduler.set_param(2, 101, 1)
+    scheduler.flush()
+    assert len(sent) == 1
+    assert scheduler.queue_depth() == 1
+    sent[0][1](DummyResponse())  # the response frees the window
+    assert [msg for msg, _ in sent] == ['RCVPRM, 1, 101=1\r\n', 'RCVPRM, 2, 101=1\r\n']
+    assert scheduler.confirmed == {(1, 101): 1}
+
+def test_failed_write_is_retried_unless_superseded(scheduler, sent):
+    scheduler.set_param(1, 101, 1)
+    scheduler.set_param(1, 102, 1)
+    scheduler.flush()
+    scheduler.set_param(1, 102, 4)
+    sent[0][1](DummyResponse(err="ERROR"))
+    assert sent[1][0] == 'RCVPRM, 1, 101=1, 102=4\r\n'
+
+def test_reset_frees_window(scheduler, sent):
+    scheduler.set_param(1, 101, 1)
+    scheduler.flush()
+    scheduler.set_param(1, 101, 0)
+    scheduler.flush()
+    assert len(sent) == 1
+    scheduler.reset()
+    scheduler.flush()
+    assert sent[1][0] == 'RCVPRM, 1, 101=0\r\n'
+
+def test_lost_response_times_out_and_resends(sent):
+    now = [0.0]
+    scheduler = CommandScheduler(lambda msg, callback: sent.append((msg, callback)),
+                                 max_in_flight=1, timeout=2.0, clock=lambda: now[0])
+    scheduler.set_param(1, 101, 1)
+    scheduler.set_param(2, 101, 4)
+    scheduler.flush()
+    assert scheduler.next_timeout() == 2.0
+    now[0] = 2.5  # the response to controller 1 was lost
+    scheduler.flush()
+    assert scheduler.timed_out == 1
+    assert [msg for msg, _ in sent] == ['RCVPRM, 1, 101=1\r\n', 'RCVPRM, 2, 101=4\r\n']
+    sent[0][1](DummyResponse())  # late, ignored
+    assert scheduler.in_flight == 1
+    sent[1][1](DummyResponse())
+    assert sent[2][0] == 'RCVPRM, 1, 101=1\r\n'
@@ -0,0 +1,50 @@
+from fast_msg import FastMsgFactory, LctnMsg, LtswMsg, DROPPED
+from tags import Tags
+
+LCTN = "1700000000,LCTN,42,Tag42,Zone1,1,0,5,0.1,1,2.5,87.5,13.1,2.25"
+LTSW = "123456,SENS0,25001,LTSW,2,1\r\n"
+
+
+class Fallback:
+    def __init__(self, raw):
+        self.raw = raw
+
+def test_decode_lctn():
+    msg = FastMsgFactory(fallback=Fallback)(LCTN.encode() + b'\r\n')
+    assert isinstance(msg, LctnMsg)
+    assert (msg.ts, msg.tagid, msg.zone, msg.motion) == (1700000000, 42, 'Zone1', True)
+    assert (msg.x, msg.y, msg.z) == (87.5, 13.1, 2.25)
+    assert msg.fmsg[2] == '42'
+
+def test_decode_ltsw():
+    msg = FastMsgFactory(fallback=Fallback)(LTSW)
+    assert isinstance(msg, LtswMsg)
+    assert (msg.type, msg.sens_type) == ("SENS0", "LTSW")
+    assert (msg.controller_id, msg.shelf, msg.state) == (25001, 2, 1)
+
+def test_other_messages_fall_back():
+    factory = FastMsgFactory(fallback=Fallback)
+    assert isinstance(factory("1,LOCMON,42"), Fallback)
+    assert isinstance(factory("1,LCTN,bad,Tag,Zone1,1,0,5,0.1,1,2.5,1,2,3"), Fallback)
+
+def test_zone_filter():
+    factory = FastMsgFactory({'Zone2'}, fallback=Fallback)
+    assert factory(LCTN) is DROPPED
+    assert isinstance(FastMsgFactory({'Zone1'}, fallback=Fallback)(LCTN), LctnMsg)
+
+def test_tags_add_lctn_record():
+    tags = Tags()
+    tagloc = tags.add_lctn(FastMsgFactory(fallback=Fallback)(LCTN))
+    assert tagloc.tagid == 42
+    assert tagloc.get_latest_location() == (87.5, 13.1, 2.25)
+    assert tagloc.get_latest_zone() == 'Zone1'
+
+def test_zone_name_is_the_same_on_both_paths():
+    spaced = "1,LCTN,42,Tag42, Zone1 ,1,0,5,0.1,1,2.5,87.5,13.1,2.25"
+    extra = spaced + ",extra"  # not the LCTN layout, falls back to Geomsg
+    from net.geo_packet_handler import Geomsg
+    fast = Tags().add_lctn(FastMsgFactory()(spaced))
+    fallback_msg = FastMsgFactory()(extra)
+    assert isinstance(fallback_msg, Geomsg)
+    slow = Tags().add_lctn(fallback_msg)
+    assert fast.get_latest_zone() == slow.get_latest_zone() == 'Zone1'
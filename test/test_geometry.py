@@ -0,0 +1,37 @@
+import pytest
+from geometry import ShelfGeometry, parse_location
+
+
+def test_parse_location():
+    assert parse_location('(87.42, 13.0, 0.396)') == (87.42, 13.0, 0.396)
+    assert parse_location([1, 2, 3]) == (1.0, 2.0, 3.0)
+    assert parse_location(None) is None
+
+def test_shelf_heights_from_config_location():
+    geometry = ShelfGeometry.from_config({'shelf_height': 1.0, 'location': (0.0, 0.0, 0.5)})
+    assert geometry.get_shelf_height(6) == 1.0
+    assert geometry.get_shelf_height(1) == 6.0
+    with pytest.raises(ValueError):
+        geometry.get_shelf_height(7)
+    with pytest.raises(ValueError):
+        geometry.shelf_z[0] = 0.0
+
+def test_shelf_at_height():
+    geometry = ShelfGeometry.from_config({'shelf_height': 1.0, 'location': (0.0, 0.0, 0.0)})
+    assert geometry.shelf_at_height(0.0) == 6
+    assert geometry.shelf_at_height(0.99) == 6
+    assert geometry.shelf_at_height(5.5) == 1
+    assert geometry.shelf_at_height(-0.1) is None
+    assert geometry.shelf_at_height(6.0) is None
+
+def test_xy_footprint():
+    config = {'shelf_height': 1.0, 'shelf_width': 2.0, 'width_proximity_threshold': 0.5,
+              'location': '(10.0, 20.0, 0.0)'}
+    geometry = ShelfGeometry.from_config(config)
+    assert geometry.xy_box == (8.5, 11.5, 18.5, 21.5)
+    assert geometry.contains_xy(11.0, 20.0)
+    assert not geometry.contains_xy(12.0, 20.0)
+    config['shelf_depth'] = 1.0
+    assert ShelfGeometry.from_config(config).xy_box == (8.5, 11.5, 19.0, 21.0)
+    # No location, no footprint: every x-y is in the cabinet
+    assert ShelfGeometry.from_config({'shelf_width': 2.0}).contains_xy(1e6, 1e6)
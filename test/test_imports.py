@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+# Importing the message path must not touch the network or pull in the
+# optional parts of the app, see benchmarks/bench_import.py for timings.
+CHECK = """
+import socket, sys
+def connect(*args, **kwargs):
+    raise AssertionError("network I/O on import")
+socket.socket.connect = connect
+socket.create_connection = connect
+import cabinet, zones, tags, msg_handler, pipeline
+heavy = [name for name in ("socketio", "http.server", "yaml", "multiprocessing", "logging.handlers")
+         if name in sys.modules]
+assert not heavy, heavy
+"""
+
+def test_imports_are_side_effect_free():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    result = subprocess.run([sys.executable, "-c", CHECK], env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
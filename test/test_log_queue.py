@@ -0,0 +1,53 @@
+import logging
+import queue
+from log_queue import RateSampler, DroppingQueueHandler, QueueLogging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def record(msg, level=logging.DEBUG, lineno=10):
+    return logging.LogRecord("app.test", level, "test.py", lineno, msg, None, None)
+
+def test_rate_sampler_limits_each_call_site():
+    now = [0.0]
+    sampler = RateSampler(per_second=2, clock=lambda: now[0])
+    assert [sampler.filter(record("a")) for _ in range(3)] == [True, True, False]
+    assert sampler.filter(record("b", lineno=11))
+    assert sampler.filter(record("c", level=logging.INFO))
+    now[0] = 1.0
+    assert sampler.filter(record("a"))
+    assert sampler.sampled == 1
+
+def test_full_queue_drops_and_reports():
+    log_queue = queue.Queue(2)
+    handler = DroppingQueueHandler(log_queue)
+    for idx in range(4):
+        handler.handle(record(f"msg {idx}"))
+    assert handler.dropped == 2
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == ["msg 0", "msg 1"]
+    handler.handle(record("msg 4"))
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == \
+        ["Log queue full, 2 records dropped", "msg 4"]
+
+def test_queue_logging_moves_and_restores_handlers():
+    log = logging.getLogger("app.test_log_queue")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    target = ListHandler()
+    log.addHandler(target)
+    queue_logging = QueueLogging(loggers=["app.test_log_queue"], queue_size=100, per_second=1)
+    queue_logging.start()
+    assert target not in log.handlers
+    for idx in range(3):
+        log.debug("debug %s", idx)
+    log.warning("warning")
+    queue_logging.stop()
+    assert target.messages == ["debug 0", "warning"]
+    assert log.handlers == [target]
+    log.removeHandler(target)
@@ -0,0 +1,70 @@
+import socket
+import threading
+import time
+import main
+
+
+class FakeConn:
+    """ A connection whose rcv() returns the messages pushed to it.  Pushing
+        also writes a byte to a socket pair, so a selector sees it readable
+        like a real socket with data. """
+    def __init__(self):
+        self.messages = []
+        self.connected = True
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+
+    def push(self, *msgs):
+        self.messages.extend(msgs)
+        self.peer.send(b'x')
+
+    def rcv(self):
+        if not self.messages:
+            return None
+        if len(self.messages) == 1:
+            try:
+                self.sock.recv(4096)  # drained, no longer readable
+            except BlockingIOError:
+                pass  # the byte of this push is not written yet
+        return self.messages.pop(0)
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.batches = []
+    def handle_messages(self, msgs):
+        self.batches.append(list(msgs))
+
+
+def test_run_handles_a_batch_as_it_arrives(monkeypatch):
+    monkeypatch.setattr(main, "MAX_IDLE_WAIT", 10.0)
+    geo_conn, cmd_conn = FakeConn(), FakeConn()
+    handler = RecordingHandler()
+    handled = []
+
+    def poll():
+        if handler.batches:
+            handled.append(time.monotonic())
+            geo_conn.connected = False  # ends run
+    timer = threading.Timer(0.05, geo_conn.push, ("1,LCTN", "2,LCTN", "3,LCTN"))
+    start = time.monotonic()
+    timer.start()
+    try:
+        main.run(geo_conn, cmd_conn, handler, poll, lambda: None)
+    finally:
+        timer.cancel()
+        geo_conn.close()
+        cmd_conn.close()
+    # The three messages are one batch, handled when they arrive, not after the idle wait
+    assert handler.batches == [["1,LCTN", "2,LCTN", "3,LCTN"]]
+    assert handled[0] - start < 2.0
@@ -0,0 +1,93 @@
+import urllib.request
+import pytest
+import metrics
+from metrics import Registry, Timed, MetricsServer
+from msg_handler import MsgHandler
+from cmd_scheduler import CommandScheduler
+
+
+class DummyGeomsg:
+    def __init__(self, msg_type):
+        self.type = msg_type
+
+class DummyResponse:
+    err = None
+    rspns = ''
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+def test_counter_by_label(registry):
+    counter = registry.counter("msgs_total", "Messages.", "type")
+    counter.inc("LCTN")
+    counter.inc("LCTN")
+    counter.inc("SENS0")
+    assert counter.get("LCTN") == 2
+    assert registry.snapshot() == {"msgs_total": {"LCTN": 2, "SENS0": 1}}
+    assert 'msgs_total{type="LCTN"} 2' in registry.render()
+
+def test_gauge_function(registry):
+    values = [3]
+    gauge = registry.gauge("store_bytes", "Bytes.")
+    gauge.set_function(lambda: values[-1])
+    values.append(5)
+    assert registry.snapshot() == {"store_bytes": 5}
+    assert 'store_bytes 5' in registry.render()
+
+def test_histogram_buckets(registry):
+    histogram = registry.histogram("wait_seconds", "Wait.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert '# TYPE wait_seconds histogram' in lines
+    assert 'wait_seconds_bucket{le="0.1"} 1' in lines
+    assert 'wait_seconds_bucket{le="1.0"} 3' in lines
+    assert 'wait_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'wait_seconds_count 4' in lines
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == float('inf')
+
+def test_duplicate_name_rejected(registry):
+    registry.gauge("depth", "Depth.")
+    with pytest.raises(ValueError):
+        registry.gauge("depth", "Depth.")
+
+def test_timed_observes_each_call(registry):
+    histogram = registry.histogram("parse_seconds", "Parse.")
+    parse = Timed(lambda raw: raw.upper(), histogram)
+    assert parse("lctn") == "LCTN"
+    assert histogram.count == 1
+
+def test_msg_handler_counts_types():
+    handler = MsgHandler()
+    handler.register_filter("LOCMON", lambda msg: False)
+    before = metrics.MESSAGES.get("LOCMON"), metrics.FILTERED.get("LOCMON")
+    handler.handle_message(DummyGeomsg("LOCMON"))
+    assert metrics.MESSAGES.get("LOCMON") == before[0] + 1
+    assert metrics.FILTERED.get("LOCMON") == before[1] + 1
+
+def test_scheduler_queue_depth_and_round_trip():
+    sent = []
+    scheduler = CommandScheduler(lambda msg, callback: sent.append(callback), max_in_flight=1)
+    scheduler.set_param(1, 101, 1)
+    scheduler.set_param(2, 101, 1)
+    rtt_count = metrics.LED_RTT_SECONDS.count
+    scheduler.flush()
+    assert metrics.CMD_QUEUE_DEPTH.value == 1
+    assert metrics.CMD_IN_FLIGHT.value == 1
+    sent[0](DummyResponse())
+    assert metrics.LED_RTT_SECONDS.count == rtt_count + 1
+    assert metrics.CMD_QUEUE_DEPTH.value == 0
+
+def test_server_serves_metrics(registry):
+    registry.counter("up_total", "Up.").inc()
+    server = MetricsServer(registry, 0)
+    server.start()
+    try:
+        host, port = server.address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as rsp:
+            body = rsp.read().decode()
+        assert "up_total 1" in body
+    finally:
+        server.stop()
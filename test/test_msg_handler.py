@@ -0,0 +1,120 @@
+from msg_handler import MsgHandler, ZoneAllowlist, IdleSampler, PRUNE_MIN_SIZE, collapse_lctns
+from fast_msg import LctnMsg
+
+
+class DummyGeomsg:
+    def __init__(self, fmsg, msg_type="LCTN"):
+        self.fmsg = fmsg
+        self.type = msg_type
+
+def lctn(tagid, ts, zone="Zone1"):
+    return LctnMsg("", ts, tagid, zone, False, 0.0, 0.0, 1.0)
+
+def test_dispatch_by_type():
+    handler = MsgHandler()
+    received = []
+    handler.register_msg_type("LCTN", received.append)
+    msg = lctn(1, 0)
+    handler.handle_message(msg)
+    handler.handle_message(DummyGeomsg([], "LOCMON"))
+    assert received == [msg]
+
+def test_filters_drop_messages():
+    handler = MsgHandler()
+    received = []
+    handler.register_msg_type("LCTN", received.append)
+    handler.register_filter("LCTN", ZoneAllowlist({"Zone1"}))
+    handler.handle_message(lctn(1, 0, "Zone1"))
+    handler.handle_message(lctn(1, 0, "Zone9"))
+    handler.handle_message(DummyGeomsg([0, "LCTN", 1, "Tag1", "Zone9"]))
+    assert len(received) == 1
+    assert handler.filtered == 2
+
+def test_idle_sampler():
+    armed = [False]
+    sampler = IdleSampler(lambda: armed[0], interval_ms=1000)
+    assert sampler(lctn(1, 0))
+    assert not sampler(lctn(1, 500))
+    assert sampler(lctn(2, 500))
+    assert sampler(DummyGeomsg([1000, "LCTN", 1]))
+    armed[0] = True
+    assert sampler(lctn(1, 1001))
+
+def test_idle_sampler_prunes_old_tags():
+    sampler = IdleSampler(lambda: False, 1000)
+    for tagid in range(PRUNE_MIN_SIZE):
+        sampler(lctn(tagid, 0))
+    assert len(sampler.last_ts) == PRUNE_MIN_SIZE
+    sampler(lctn(99999, 5000))
+    assert list(sampler.last_ts) == [99999]
+
+class DummySens0:
+    type = "SENS0"
+    def __init__(self, sens_type):
+        self.sens_type = sens_type
+
+def test_several_callbacks_by_priority():
+    handler = MsgHandler()
+    calls = []
+    handler.register_msg_type("LCTN", lambda msg: calls.append("first"))
+    handler.register_msg_type("LCTN", lambda msg: calls.append("urgent"), priority=10)
+    handler.register_msg_type("LCTN", lambda msg: calls.append("second"))
+    handler.handle_message(lctn(1, 0))
+    assert calls == ["urgent", "first", "second"]
+    assert len(handler.chains["LCTN"]) == 3
+
+def test_sens0_subtypes_and_type_wide_callbacks():
+    handler = MsgHandler()
+    calls = []
+    handler.register_msg_type("SENS0", lambda msg: calls.append(("any", msg.sens_type)))
+    handler.register_sens0_type("LTSW", lambda msg: calls.append(("ltsw", msg.sens_type)), priority=1)
+    handler.handle_message(DummySens0("LTSW"))
+    handler.handle_message(DummySens0("TEMP"))
+    assert calls == [("ltsw", "LTSW"), ("any", "LTSW"), ("any", "TEMP")]
+
+def test_failing_callback_is_isolated():
+    handler = MsgHandler()
+    received = []
+    def broken(msg):
+        raise RuntimeError("boom")
+    handler.register_msg_type("LCTN", broken, priority=1)
+    handler.register_msg_type("LCTN", received.append)
+    msg = lctn(1, 0)
+    handler.handle_message(msg)
+    assert received == [msg]
+    assert handler.errors == 1
+    handler.unregister("LCTN", broken)
+    handler.handle_message(msg)
+    assert handler.errors == 1
+
+def test_handle_messages_batch():
+    handler = MsgHandler()
+    received = []
+    handler.register_msg_type("LCTN", received.append)
+    handler.register_filter("LCTN", ZoneAllowlist({"Zone1"}))
+    msgs = [lctn(1, 0), lctn(2, 0, "Zone9"), DummyGeomsg([], "LOCMON"), lctn(3, 0)]
+    assert handler.handle_messages(iter(msgs)) == 4
+    assert [msg.tagid for msg in received] == [1, 3]
+    assert handler.filtered == 1
+
+def test_batch_callbacks_get_runs_in_order():
+    handler = MsgHandler()
+    calls = []
+    handler.register_batch("LCTN", lambda msgs: calls.append([msg.tagid for msg in msgs]))
+    handler.register_batch("SENS0", lambda msgs: calls.append("ltsw"), subtype="LTSW")
+    handler.register_msg_type("LOCMON", lambda msg: calls.append("locmon"))
+    msgs = [lctn(1, 0), lctn(2, 0), DummySens0("LTSW"), DummySens0("TEMP"), lctn(3, 0),
+            DummyGeomsg([], "LOCMON"), lctn(4, 0)]
+    handler.handle_messages(msgs)
+    assert calls == [[1, 2], "ltsw", [3], "locmon", [4]]
+    handler.handle_message(lctn(5, 0))
+    assert calls[-1] == [5]
+
+def test_collapse_lctns():
+    msgs = [lctn(1, 0), lctn(2, 0), lctn(1, 10), DummySens0("LTSW"), lctn(1, 20), lctn(1, 30)]
+    collapsed = collapse_lctns(msgs)
+    assert [(msg.type, getattr(msg, "ts", None)) for msg in collapsed] == \
+        [("LCTN", 0), ("LCTN", 10), ("SENS0", None), ("LCTN", 30)]
+    assert [msg.tagid for msg in collapsed[:2]] == [2, 1]
+    distinct = [lctn(1, 0), lctn(2, 0)]
+    assert collapse_lctns(distinct) is distinct
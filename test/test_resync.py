@@ -0,0 +1,70 @@
+import pytest
+from resync import Resync
+
+
+class DummyResponse:
+    def __init__(self, err=None, rspns='0'):
+        self.err = err
+        self.rspns = rspns
+
+@pytest.fixture
+def sent():
+    return []
+
+def test_window_is_kept_full(sent):
+    answers = []
+    resync = Resync(lambda msg, callback: sent.append((msg, callback)), max_in_flight=2)
+    for idx in range(5):
+        resync.add(f"q{idx}", lambda rsp, idx=idx: answers.append(idx))
+    resync.start()
+    assert [msg for msg, _ in sent] == ["q0", "q1"]
+    sent[1][1](DummyResponse())
+    assert [msg for msg, _ in sent] == ["q0", "q1", "q2"]
+    sent[0][1](DummyResponse(err="ERROR"))
+    sent[2][1](DummyResponse(err="ERROR"))
+    assert [msg for msg, _ in sent] == ["q0", "q1", "q2", "q3", "q4"]
+    sent[3][1](DummyResponse(err="ERROR"))
+    assert not resync.done()
+    sent[4][1](DummyResponse())
+    assert resync.done()
+    assert resync.answered == 5
+    assert resync.failed == 3
+    assert resync.elapsed is not None
+    assert sorted(answers) == [0, 1, 2, 3, 4]
+
+def test_cancel_ignores_late_responses(sent):
+    answers = []
+    resync = Resync(lambda msg, callback: sent.append((msg, callback)), max_in_flight=1)
+    resync.add("q0", answers.append)
+    resync.add("q1", answers.append)
+    resync.start()
+    resync.cancel()
+    sent[0][1](DummyResponse())
+    assert answers == []
+    assert len(sent) == 1
+    assert resync.done()
+
+def test_unanswered_query_is_resent_then_given_up(sent):
+    now = [0.0]
+    answers = []
+    resync = Resync(lambda msg, callback: sent.append((msg, callback)), max_in_flight=1,
+                    timeout=2.0, clock=lambda: now[0])
+    resync.add("q0", answers.append)
+    resync.add("q1", answers.append)
+    resync.start()
+    assert resync.next_timeout() == 2.0
+    now[0] = 2.0
+    resync.poll()
+    assert [msg for msg, _ in sent] == ["q0", "q0"]
+    sent[0][1](DummyResponse())  # late, the query was resent
+    assert answers == []
+    now[0] = 4.0
+    resync.poll()
+    now[0] = 6.0
+    resync.poll()  # the slot goes to q1 after MAX_RETRIES resends
+    assert [msg for msg, _ in sent] == ["q0", "q0", "q0", "q1"]
+    assert resync.failed == 1
+    assert resync.timed_out == 3
+    sent[3][1](DummyResponse())
+    assert len(answers) == 1
+    assert resync.done()
@@ -0,0 +1,86 @@
+import multiprocessing
+import selectors
+from shards import ShardedCluster, RouteMsg, partition_zones, shard_config
+from fast_msg import FastMsgFactory
+from snapshot import load_snapshot
+
+
+def cabinets_config(count):
+    return {'cabinets': [{'cabinet_controller_id': 100 + idx, 'zone': f'Zone{idx}', 'shelf_height': 1.0,
+                          'location': (0.0, 0.0, 0.0)} for idx in range(count)]}
+
+def test_partition_zones():
+    config = cabinets_config(5)
+    zone_shard = partition_zones(config, 2)
+    assert zone_shard == {'Zone0': 0, 'Zone1': 1, 'Zone2': 0, 'Zone3': 1, 'Zone4': 0}
+    assert [c['zone'] for c in shard_config(config, {'Zone1', 'Zone3'})['cabinets']] == ['Zone1', 'Zone3']
+    assert len(config['cabinets']) == 5
+
+def test_sharded_cluster_end_to_end():
+    sent = []
+    sharded = ShardedCluster(cabinets_config(4), lambda msg, callback=None: sent.append(msg), 2,
+                             context=multiprocessing.get_context('fork'))
+    factory = FastMsgFactory()
+    sharded.start()
+    try:
+        for line in ("1,SENS0,103,LTSW,5,1",  # arms shelf 5 of the Zone3 cabinet
+                     "2,LCTN,42,Tag42,Zone3,0,0,5,0.1,1,2.5,0.0,0.0,1.5",
+                     "3,LCTN,43,Tag43,Nowhere,0,0,5,0.1,1,2.5,0.0,0.0,1.5"):
+            sharded.handler.handle_message(factory(line))
+        sharded.sync()
+    finally:
+        sharded.stop()
+    # RED for the switch is superseded by BLUE for the match in the same batch
+    assert sent == ['RCVPRM, 103, 105=4\r\n']
+    assert sharded.unrouted == 1
+
+def test_shard_command_wakes_a_selector():
+    sent = []
+    sharded = ShardedCluster(cabinets_config(2), lambda msg, callback=None: sent.append(msg), 2,
+                             context=multiprocessing.get_context('fork'))
+    assert sharded.next_timeout() is None  # no periodic wake up
+    selector = selectors.DefaultSelector()
+    for conn in sharded.selectables():
+        selector.register(conn, selectors.EVENT_READ)
+    sharded.start()
+    try:
+        sharded.handler.handle_message(sharded.factory("1,SENS0,101,LTSW,5,1"))
+        sharded.poll()  # the LTSW goes to shard 1
+        assert selector.select(10.0)
+        sharded.poll()
+        assert sent == ['RCVPRM, 101, 105=1\r\n']
+    finally:
+        sharded.stop()
+        selector.close()
+
+def test_router_splits_only_the_routing_fields():
+    config = cabinets_config(4)
+    config['cabinets'][0].update(location=(10.0, 10.0, 0.0), shelf_width=2.0)  # Zone0, shard 0
+    sharded = ShardedCluster(config, lambda msg, callback=None: None, 2,
+                             context=multiprocessing.get_context('fork'))
+    in_footprint = sharded.factory(b"2,LCTN,42,Tag42,Zone3,0,0,5,0.1,1,2.5,10.5,9.5,1.5\r\n")
+    assert isinstance(in_footprint, RouteMsg)
+    assert in_footprint.shards == (0,)  # spatial match wins over the zone
+    assert sharded.factory("2,LCTN,42,Tag42, Zone3 ,0,0,5,0.1,1,2.5,0.0,0.0,1.5").shards == (1,)
+    assert sharded.factory("2,LCTN,43,Tag43,Nowhere,0,0,5,0.1,1,2.5,0.0,0.0,1.5").shards == ()
+    ltsw = sharded.factory("1,SENS0,103,LTSW,5,1")
+    assert (ltsw.type, ltsw.sens_type, ltsw.shards) == ("SENS0", "LTSW", (1,))
+    for line in ("1,SENS0,103,LTSW,5,1", "2,LCTN,42,Tag42,Zone3,0,0,5,0.1,1,2.5,10.5,9.5,1.5"):
+        sharded.handler.handle_message(sharded.factory(line))
+    assert sharded.batches == [[('msg', "2,LCTN,42,Tag42,Zone3,0,0,5,0.1,1,2.5,10.5,9.5,1.5")],
+                               [('msg', "1,SENS0,103,LTSW,5,1")]]
+
+def test_stop_saves_shard_snapshots(tmp_path):
+    config = cabinets_config(4)
+    config.update(snapshot_file=str(tmp_path / 'shelves.json'), snapshot_interval=3600)
+    sharded = ShardedCluster(config, lambda msg, callback=None: None, 2,
+                             context=multiprocessing.get_context('fork'))
+    sharded.start()
+    try:
+        sharded.handler.handle_message(sharded.factory("1,SENS0,103,LTSW,5,1"))
+        sharded.sync()
+    finally:
+        sharded.stop()
+    assert not any(proc.is_alive() for proc in sharded.procs)
+    assert load_snapshot(tmp_path / 'shelves.json.shard1')['103']['switches'][4] is True
+    assert set(load_snapshot(tmp_path / 'shelves.json.shard0')) == {'100', '102'}
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from shelf_match import distance_matrix, match_greedy, match_hungarian
+
+
+def test_distance_matrix():
+    dist = distance_matrix([1.0, 3.0], [0.5, 2.0, 4.0])
+    assert dist.shape == (2, 3)
+    assert dist[1].tolist() == [2.5, 1.0, 1.0]
+
+@pytest.mark.parametrize("matcher", [match_greedy, match_hungarian])
+def test_matchers_respect_threshold(matcher):
+    dist = np.array([[0.2, 3.0],
+                     [3.0, 3.0]])
+    assert matcher(dist, 1.0) == [(0, 0)]
+
+def test_hungarian_minimizes_total_distance():
+    # Greedy takes the 0.1 pair and strands tag 1, Hungarian assigns both
+    dist = np.array([[0.1, 0.2],
+                     [0.15, 2.0]])
+    assert match_greedy(dist, 1.0) == [(0, 0)]
+    assert match_hungarian(dist, 1.0) == [(0, 1), (1, 0)]
+
+def test_hungarian_more_tags_than_shelves():
+    dist = np.array([[0.9], [0.1], [0.5]])
+    assert match_hungarian(dist, 1.0) == [(1, 0)]
@@ -0,0 +1,35 @@
+import json
+from snapshot import SnapshotWriter, save_snapshot, load_snapshot
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / 'state' / 'shelves.json'
+    save_snapshot(path, {'1': {'switches': [False] * 6}})
+    assert load_snapshot(path) == {'1': {'switches': [False] * 6}}
+    assert not (tmp_path / 'state' / 'shelves.json.tmp').exists()
+
+def test_missing_or_bad_snapshot_is_empty(tmp_path):
+    assert load_snapshot(tmp_path / 'none.json') == {}
+    bad = tmp_path / 'bad.json'
+    bad.write_text('{"version": 1, "cab')
+    assert load_snapshot(bad) == {}
+    bad.write_text(json.dumps({'version': 99, 'cabinets': {'1': {}}}))
+    assert load_snapshot(bad) == {}
+
+def test_writer_saves_changes_only(tmp_path):
+    clock = FakeClock()
+    writer = SnapshotWriter(tmp_path / 'shelves.json', interval=5.0, clock=clock)
+    assert not writer.due()
+    clock.now = 5.0
+    assert writer.due()
+    assert writer.save({'1': {}})
+    assert not writer.due()
+    assert not writer.save({'1': {}})
+    assert writer.save({'2': {}})
+    assert writer.saves == 2
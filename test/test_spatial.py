@@ -0,0 +1,23 @@
+import pytest
+from spatial import GridIndex
+
+
+def test_grid_query_point():
+    grid = GridIndex(cell_size=2.0)
+    grid.insert((0.0, 3.0, 0.0, 1.0), 'a')
+    grid.insert((2.5, 5.0, 0.0, 1.0), 'b')
+    assert grid.query(1.0, 0.5) == ['a']
+    assert grid.query(2.8, 0.5) == ['a', 'b']
+    assert grid.query(4.0, 0.5) == ['b']
+    assert grid.query(4.0, 1.5) == []
+    assert grid.query(-100.0, -100.0) == []
+
+def test_grid_negative_coordinates():
+    grid = GridIndex(cell_size=1.0)
+    grid.insert((-1.5, -0.5, -1.5, -0.5), 'a')
+    assert grid.query(-1.0, -1.0) == ['a']
+    assert len(grid) == 4
+
+def test_grid_cell_size_must_be_positive():
+    with pytest.raises(ValueError):
+        GridIndex(cell_size=0.0)
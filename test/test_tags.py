@@ -1,5 +1,5 @@
 import pytest
-from tags import Tags, TagLoc, MAX_LOC_BUFF_LEN
+from tags import Tags, TagLoc, TagStore, MAX_LOC_BUFF_LEN, FLUSH_SAMPLES, PENDING_WIDTH
 
 
 class DummyGeomsg:
@@ -52,3 +52,106 @@ def test_tagloc_buffer_length(sample_fmsg):
     assert len(tagloc.x) == 3
     assert tagloc.x[-1] == 4.0
     assert tagloc.x[0] == 2.0
+
+def test_tags_share_one_store(sample_fmsg):
+    tags_obj = Tags()
+    for tagid in (1, 2, 3):
+        fmsg = sample_fmsg.copy()
+        fmsg[2] = tagid
+        tags_obj.add_locmon(DummyGeomsg(fmsg))
+    assert len(tags_obj.store.rows) == 3
+    assert all(tags_obj.get_tag(t).store is tags_obj.store for t in (1, 2, 3))
+    assert tags_obj.get_tag(2).get_latest_location() == (10.0, 20.0, 5.0)
+
+def test_tagstore_grows_past_capacity(sample_fmsg):
+    store = TagStore(depth=2, capacity=1)
+    for tagid in range(5):
+        tagloc = TagLoc(tagid, store=store)
+        fmsg = sample_fmsg.copy()
+        fmsg[13] = float(tagid)
+        tagloc.add_locmon(DummyGeomsg(fmsg))
+    assert store.capacity >= 5
+    assert [TagLoc(t, store=store).x[-1] for t in range(5)] == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_tagstore_history_is_chronological():
+    store = TagStore(depth=3, capacity=1)
+    row = store.add_tag(7)
+    for i in range(5):
+        store.append(row, 'z', float(i))
+    assert list(store.history(row, 'z')) == [2.0, 3.0, 4.0]
+
+def test_tagstore_fields_share_one_head():
+    store = TagStore(depth=3, capacity=1)
+    row = store.add_tag(7)
+    store.append(row, 'zone', 'ZoneA')  # an empty row starts from zeros
+    assert (store.latest(row, 'z'), store.latest(row, 'zone')) == (0.0, 'ZoneA')
+    for ts in range(1, 4):
+        store.append_sample(row, ts, 1.0, 2.0, float(ts), 'ZoneA', False)
+    store.append(row, 'zone', 'ZoneB')  # the other fields repeat the latest sample
+    assert store.length(row, 'x') == store.length(row, 'zone') == 3
+    assert list(store.history(row, 'z')) == [2.0, 3.0, 3.0]
+    assert [store.get(row, 'zone', idx) for idx in range(3)] == ['ZoneA', 'ZoneA', 'ZoneB']
+    assert store.latest(row, 'ts') == 3
+
+def test_tagstore_writes_queued_samples_in_batches():
+    store = TagStore(depth=3, capacity=4)
+    rows = [store.add_tag(tagid) for tagid in range(4)]
+    total = FLUSH_SAMPLES + 5
+    for ts in range(total):
+        store.append_sample(rows[ts % 4], ts, 0.0, 0.0, float(ts), f'Zone{ts % 3}', False)
+    assert len(store.pending) == 5 * PENDING_WIDTH  # the rest went out in one batch
+    assert store.latest(rows[1], 'z') == float(total - 4)  # read without writing the queue
+    assert len(store.pending) == 5 * PENDING_WIDTH
+    expected = [ts for ts in range(total) if ts % 4 == 1][-3:]
+    assert list(store.history(rows[1], 'z')) == [float(ts) for ts in expected]
+    assert store.pending == []
+    assert [store.get(rows[1], 'zone', idx) for idx in range(3)] == [f'Zone{ts % 3}' for ts in expected]
+
+def test_tagloc_estimators(sample_fmsg):
+    tagloc = TagLoc(tagid=1, max_len=4)
+    assert tagloc.get_mean_location() is None
+    assert tagloc.get_filtered_height() is None
+    for z in (1.0, 2.0, 9.0):
+        fmsg = sample_fmsg.copy()
+        fmsg[15] = z
+        tagloc.add_locmon(DummyGeomsg(fmsg))
+    assert tagloc.get_latest_height() == 9.0
+    assert tagloc.get_average_height() == 4.0
+    assert tagloc.get_median_height() == 2.0
+    assert tagloc.get_mean_location() == (10.0, 20.0, 4.0)
+    assert tagloc.get_median_location() == (10.0, 20.0, 2.0)
+    # Each sample moved by more than dwell_band, so the filter restarted
+    assert tagloc.get_filtered_height() == 9.0
+
+def test_height_filter_damps_jitter_at_rest():
+    store = TagStore()
+    row = store.add_tag(1)
+    for ts, z in enumerate((1.0, 1.2, 0.95, 1.25, 1.05)):
+        store.append_sample(row, ts, 0.0, 0.0, z, 'ZoneA', False)
+    assert store.run_len[row] == 5
+    assert abs(store.filtered_height(row) - 1.09) < abs(1.05 - 1.09)
+
+def test_tagstore_reuses_removed_rows():
+    tags_obj = Tags()
+    for tagid in range(3):
+        tags_obj._get_or_create(tagid).z.append(1.0)
+    row = tags_obj[1].row
+    tags_obj.remove(1)
+    assert 1 not in tags_obj
+    tagloc = tags_obj._get_or_create(9)
+    assert tagloc.row == row
+    assert len(tagloc.z) == 0
+    assert tagloc.get_filtered_height() is None
+    assert len(tags_obj) == 3
+
+def test_tagstore_dwell_runs():
+    store = TagStore(dwell_band=0.5)
+    row = store.add_tag(1)
+    for ts, z, motion in ((0, 1.0, True), (10, 1.3, True), (20, 2.0, False), (30, 2.2, False)):
+        store.append_sample(row, ts, 0.0, 0.0, z, 'ZoneA', motion)
+    assert store.run_len[row] == 2  # restarted at 2.0
+    assert store.still_since[row] == 20
+    assert store.settled(row, 2)
+    assert not store.settled(row, 3)
+    assert store.settled(row, 3, still_ms=10)
+    assert not store.settled(row, 3, still_ms=20)
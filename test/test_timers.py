@@ -0,0 +1,45 @@
+import pytest
+from timers import TimerQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def test_timers_expire_in_order(clock):
+    timers = TimerQueue(5.0, clock=clock)
+    timers.schedule('a')
+    clock.now = 1.0
+    timers.schedule('b', delay=1.0)
+    assert timers.next_timeout() == 1.0
+    assert timers.expire() == []
+    clock.now = 10.0
+    assert timers.expire() == ['b', 'a']
+    assert len(timers) == 0
+    assert timers.next_timeout() is None
+
+def test_reschedule_and_cancel(clock):
+    timers = TimerQueue(5.0, clock=clock)
+    timers.schedule('a')
+    timers.schedule('b')
+    clock.now = 4.0
+    timers.schedule('a')  # restarts a
+    timers.cancel('b')
+    clock.now = 6.0
+    assert timers.expire() == []
+    assert 'a' in timers
+    clock.now = 9.0
+    assert timers.expire() == ['a']
+
+def test_stale_entries_are_compacted(clock):
+    timers = TimerQueue(5.0, clock=clock)
+    for _ in range(1000):
+        timers.schedule('a')
+    assert len(timers.heap) < 100
+    assert len(timers) == 1
@@ -0,0 +1,79 @@
+import threading
+import pytest
+from ui_publisher import UiPublisher
+
+
+class StandInUiServer:
+    """ Local stand-in for the UI Socket.IO server.  Hands out clients that
+        record what they emit, and can be taken down. """
+    def __init__(self):
+        self.up = True
+        self.events = []
+        self.connects = 0
+        self.received = threading.Event()
+
+    def client(self):
+        server = self
+        class Client:
+            def connect(self, url):
+                if not server.up:
+                    raise ConnectionError("UI server down")
+                server.connects += 1
+            def emit(self, event, data):
+                if not server.up:
+                    raise ConnectionError("UI server down")
+                server.events.append((event, data))
+                server.received.set()
+            def disconnect(self):
+                pass
+        return Client()
+
+
+@pytest.fixture
+def server():
+    return StandInUiServer()
+
+def test_publish_does_not_connect(server):
+    publisher = UiPublisher('http://ui', client_factory=server.client)
+    publisher.update_shelf(10, 3)
+    assert server.connects == 0
+    assert publisher.flush()
+    assert server.events == [('box_update', {'box_id': 10, 'shelf': 3})]
+
+def test_updates_coalesce_per_box(server):
+    publisher = UiPublisher('http://ui', client_factory=server.client)
+    publisher.update_shelf(10, 3)
+    publisher.update_shelf(11, 2)
+    publisher.update_shelf(10, 0)
+    publisher.flush()
+    assert server.events == [('box_update', {'box_id': 11, 'shelf': 2}),
+                             ('box_update', {'box_id': 10, 'shelf': 0})]
+
+def test_pending_is_bounded(server):
+    publisher = UiPublisher('http://ui', client_factory=server.client, max_pending=2)
+    for box in range(4):
+        publisher.update_shelf(box, 1)
+    assert publisher.dropped == 2
+    publisher.flush()
+    assert len(server.events) == 2
+
+def test_server_down_keeps_updates(server):
+    server.up = False
+    publisher = UiPublisher('http://ui', client_factory=server.client)
+    publisher.update_shelf(10, 3)
+    assert not publisher.flush()
+    # A newer update published while the server was down wins
+    publisher.update_shelf(10, 4)
+    server.up = True
+    assert publisher.flush()
+    assert server.events == [('box_update', {'box_id': 10, 'shelf': 4})]
+
+def test_background_thread_emits(server):
+    publisher = UiPublisher('http://ui', client_factory=server.client, window=0.0)
+    publisher.start()
+    try:
+        publisher.update_shelf(10, 3)
+        assert server.received.wait(1.0)
+    finally:
+        publisher.stop()
+    assert server.events == [('box_update', {'box_id': 10, 'shelf': 3})]
@@ -2,7 +2,9 @@ import pytest
 from zones import Zones
 from tags import TagLoc, Tags
 from cabinet import Cabinet
+from geometry import ShelfGeometry
 from net.geo_packet_handler import Geomsg
+from metrics import TAG_STORE_BYTES
 
 class DummyGeomsg:
     def __init__(self, fmsg):
@@ -64,4 +66,106 @@ def test_add_locmon(zones_obj):
     zones_obj.add_locmon(msg)
     assert "ZoneX" in zones_obj.zones
     taglocs = zones_obj.zones["ZoneX"]
-    assert any(t.tagid == 99 for t in taglocs)
\ No newline at end of file
+    assert any(t.tagid == 99 for t in taglocs)
+
+
+def test_inform_cabinet_by_location(zones_obj):
+    called = []
+    class DummyCabinet:
+        def __init__(self, name, x):
+            self.name = name
+            self.geometry = ShelfGeometry.from_config({'shelf_width': 2.0, 'location': (x, 0.0, 0.0)})
+        def new_tag_loc(self, tag):
+            called.append(self.name)
+    zones_obj.add_cabinet(DummyCabinet('near', 0.0), "ZoneA")
+    zones_obj.add_cabinet(DummyCabinet('far', 10.0), "ZoneB")
+    tagloc = TagLoc(tagid=7)
+    tagloc.store.append_sample(tagloc.row, 0, 10.5, 0.5, 1.0, 'ZoneA', False)
+    zones_obj.inform_cabinet(tagloc)
+    assert called == ['far']
+    # Outside every footprint, fall back to the zone name
+    tagloc.store.append_sample(tagloc.row, 1, 50.0, 50.0, 1.0, 'ZoneA', False)
+    zones_obj.inform_cabinet(tagloc)
+    assert called == ['far', 'near']
+
+def test_update_zones_unchanged_is_noop(zones_obj, sample_tagloc):
+    zones_obj.update_zones(sample_tagloc)
+    zones_obj.update_zones(sample_tagloc)
+    assert zones_obj.get_zone_count("ZoneA") == 1
+    assert zones_obj.get_zone_of_tag(42) == "ZoneA"
+    sample_tagloc.zone.append("ZoneB")
+    zones_obj.update_zones(sample_tagloc)
+    assert zones_obj.get_zone_count("ZoneA") == 0
+    assert zones_obj.get_zone_count("ZoneB") == 1
+    assert zones_obj.get_zone_of_tag(42) == "ZoneB"
+    assert list(zones_obj.get_tags_in_zone("ZoneC")) == []
+
+def lctn(tagid, zone, ts):
+    from fast_msg import LctnMsg
+    return LctnMsg("", ts, tagid, zone, False, 0.0, 0.0, 1.0)
+
+def test_evict_after_ttl():
+    zones_obj = Zones(ttl_ms=1000)
+    zones_obj.add_lctn(lctn(1, "ZoneA", 0))
+    zones_obj.add_lctn(lctn(2, "ZoneA", 500))
+    zones_obj.add_lctn(lctn(2, "ZoneA", 1600))  # tag 1 not seen for 1.6 s
+    assert 1 not in zones_obj.tags
+    assert zones_obj.get_zone_of_tag(1) is None
+    assert [tag.tagid for tag in zones_obj.get_tags_in_zone("ZoneA")] == [2]
+
+def test_evict_least_recently_seen_over_max_tags():
+    zones_obj = Zones(max_tags=2)
+    for ts, tagid in enumerate((1, 2, 1, 3)):
+        zones_obj.add_lctn(lctn(tagid, "ZoneA", ts))
+    assert sorted(zones_obj.tags.tags) == [1, 3]
+    assert zones_obj.memory_stats()['tags'] == 2
+
+def test_tag_store_bytes_gauge_follows_the_store():
+    zones_obj = Zones()
+    store = zones_obj.tags.store
+    before = TAG_STORE_BYTES.snapshot()
+    assert before == store.nbytes()
+    for tagid in range(store.capacity + 1):
+        zones_obj.add_lctn(lctn(tagid, "ZoneA", 0))
+    assert TAG_STORE_BYTES.snapshot() > before
+    assert TAG_STORE_BYTES.snapshot() == store.nbytes() == zones_obj.memory_stats()['store_bytes']
+
+def test_evict_after_exit_zone():
+    zones_obj = Zones(exit_zones=["Exit"], exit_ttl_ms=100)
+    zones_obj.add_lctn(lctn(1, "Exit", 0))
+    zones_obj.add_lctn(lctn(2, "ZoneA", 50))
+    assert 1 in zones_obj.tags
+    zones_obj.add_lctn(lctn(2, "ZoneA", 150))
+    assert 1 not in zones_obj.tags
+    assert zones_obj.get_zone_count("Exit") == 0
+
+def test_eviction_keeps_shelf_assignment():
+    cabinet = Cabinet({'cabinet_controller_id': 1, 'zone': 'ZoneA'}, lambda msg, callback=None: None)
+    zones_obj = Zones(max_tags=1)
+    zones_obj.add_cabinet(cabinet, "ZoneA")
+    cabinet.update_tags(2, 7)
+    zones_obj.add_lctn(lctn(7, "ZoneA", 0))
+    zones_obj.add_lctn(lctn(8, "ZoneA", 1))
+    assert 7 not in zones_obj.tags
+    assert cabinet.get_assigned_shelf(7) == 2
+    zones_obj.add_lctn(lctn(7, "ZoneA", 2))  # seen again, new history
+    assert len(zones_obj.tags[7].z) == 1
+
+def test_add_lctns_informs_cabinet_once_per_tag():
+    cabinet = Cabinet({'cabinet_controller_id': 1, 'zone': 'ZoneA'}, lambda msg, callback=None: None)
+    informed = []
+    cabinet.new_tag_loc = lambda tag: informed.append((tag.tagid, tag.ts[-1]))
+    zones_obj = Zones()
+    zones_obj.add_cabinet(cabinet, "ZoneA")
+    zones_obj.add_lctns([lctn(1, "ZoneA", 0), lctn(2, "ZoneB", 0), lctn(1, "ZoneA", 10)])
+    assert informed == [(1, 10)]
+    assert len(zones_obj.tags[1].z) == 2
+    assert zones_obj.get_zone_of_tag(2) == "ZoneB"
+
+def test_add_lctns_skips_bad_message():
+    zones_obj = Zones()
+    bad = DummyGeomsg([0, "LCTN", "not-a-number", "Tag", "ZoneA"])
+    bad.msg = "0,LCTN,not-a-number"
+    msgs = [lctn(1, "ZoneA", 0), lctn(2, "ZoneA", 0), bad, lctn(3, "ZoneA", 0), lctn(4, "ZoneA", 0)]
+    zones_obj.add_lctns(msgs)
+    assert sorted(zones_obj.tags.tags) == [1, 2, 3, 4]